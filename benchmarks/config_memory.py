@@ -0,0 +1,89 @@
+"""
+Configuration Memory Benchmark.
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measures the memory used to load a large synthetic deployment configuration, and to construct all of its actions:
+the peak traced memory of each stage, and the memory retained once the stage completes.
+
+Usage:
+    python -m benchmarks.config_memory [--actions 20000] [--realm-users 50000] [--encrypted-fields 100]
+"""
+
+from .measurement import measure
+from .synthetic import DEPLOY_ENV
+from .synthetic import ENCRYPTION_PREFIX
+from .synthetic import fake_kmsdecrypt
+from .synthetic import generate_deploy_tree
+
+import argparse
+import os
+import sys
+import tempfile
+import unittest.mock
+
+
+def run(deploy_dir):
+    """
+    Load the configuration of a deployment directory, and construct all of its actions.
+    :param deploy_dir: The deployment configuration directory.
+    :return: The stage measurements.
+    """
+
+    from keycloak_config.actions_engine import ActionsEngine
+    from keycloak_config.deploy_config import DeployConfig
+    from keycloak_config.encryption import EncryptionHelper
+    from keycloak_config.json import JsonLoader
+
+    json_loader = JsonLoader(EncryptionHelper(ENCRYPTION_PREFIX, None))
+
+    def build_actions():
+        # Actions are built one after the other, as when executing them.
+        for action_name, action_class, action_config_json in actions_engine.pending_actions:
+            actions_engine.build_action(action_name, action_class, action_config_json)
+
+    with unittest.mock.patch('keycloak_config.encryption.kmsdecrypt', fake_kmsdecrypt):
+        config, load = measure('load configuration', lambda: DeployConfig(deploy_dir, DEPLOY_ENV, json_loader))
+        actions_engine, engine = measure(
+                'create engine', lambda: ActionsEngine(DEPLOY_ENV, config.get_config_dir(), config.get_json_config(), json_loader)
+        )
+        _, build = measure('build actions', build_actions)
+
+    return [load, engine, build]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the memory used to load a large synthetic configuration.')
+    parser.add_argument('--actions', type=int, default=20000, help='The number of createUser and createClient actions')
+    parser.add_argument('--roles', type=int, default=100, help='The number of createRole actions')
+    parser.add_argument('--encrypted-fields', type=int, default=100, help='The number of encrypted values')
+    parser.add_argument('--realm-users', type=int, default=50000, help='The number of users in the imported realm file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as deploy_dir:
+        generate_deploy_tree(
+                deploy_dir,
+                users=args.actions // 2,
+                clients=args.actions - args.actions // 2,
+                roles=args.roles,
+                encrypted_fields=args.encrypted_fields,
+                realm_users=args.realm_users
+        )
+        config_size = os.path.getsize(os.path.join(deploy_dir, 'src', 'keycloak.json'))
+        print('Configuration: {0:.1f} MiB, {1} actions, {2} realm users'.format(
+                config_size / 1048576.0, args.actions + args.roles, args.realm_users
+        ))
+
+        print('{0:<20} {1:>10} {2:>12} {3:>14}'.format('stage', 'ms', 'peak MiB', 'retained MiB'))
+        for measurement in run(deploy_dir):
+            print('{0:<20} {1:>10.1f} {2:>12.1f} {3:>14.1f}'.format(
+                    measurement.name,
+                    measurement.seconds * 1000,
+                    measurement.peak_bytes / 1048576.0,
+                    measurement.retained_bytes / 1048576.0
+            ))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
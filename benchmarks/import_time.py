@@ -0,0 +1,97 @@
+"""
+Import Time Benchmark.
+~~~~~~~~~~~~~~~~~~~~~~
+
+Measures the time needed to import the command-line entry point, and verifies that the heavy dependencies (the KMS
+toolbox with boto3, and the HTTP stack) are not imported before they are needed.
+
+Usage:
+    python -m benchmarks.import_time [--runs 5] [--max-ms 100]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ENTRY_MODULE = 'keycloak_config.__main__'
+
+# Modules which must not be loaded by importing the entry point.
+LAZY_MODULES = ['kmsencryption', 'boto3', 'botocore', 'requests']
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def measure_import(module=ENTRY_MODULE):
+    """
+    Import a module in a fresh interpreter.
+    :param module: The module to import.
+    :return: A tuple of the cumulative import time of the module (in milliseconds) and the set of loaded modules.
+    """
+
+    code = 'import sys, {0}; print(",".join(sorted(sys.modules)))'.format(module)
+    result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=REPO_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+    )
+
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match and match.group(4) == module:
+            cumulative_us = int(match.group(2))
+
+    loaded_modules = set(result.stdout.strip().split(','))
+    return cumulative_us / 1000.0, loaded_modules
+
+
+def eagerly_loaded(loaded_modules):
+    """
+    Find the lazily loaded modules which were imported anyway.
+    :param loaded_modules: The set of loaded module names.
+    :return: The sorted list of offending modules.
+    """
+
+    return sorted(module for module in LAZY_MODULES if module in loaded_modules)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of the keycloak-config-tool entry point.')
+    parser.add_argument('--runs', type=int, default=5, help='The number of measurements to take')
+    parser.add_argument('--max-ms', type=float, default=None, help='Fail if the median import time exceeds this value')
+    args = parser.parse_args(argv)
+
+    timings = []
+    offending = []
+    for _ in range(args.runs):
+        elapsed_ms, loaded_modules = measure_import()
+        timings.append(elapsed_ms)
+        offending = eagerly_loaded(loaded_modules)
+
+    median_ms = statistics.median(timings)
+    print('{0}: median {1:.1f} ms, min {2:.1f} ms, max {3:.1f} ms over {4} runs'.format(
+            ENTRY_MODULE, median_ms, min(timings), max(timings), args.runs
+    ))
+
+    failed = False
+    if offending:
+        print('Eagerly imported modules: {0}'.format(', '.join(offending)))
+        failed = True
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print('Median import time exceeds {0:.1f} ms'.format(args.max_ms))
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
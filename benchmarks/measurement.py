@@ -0,0 +1,43 @@
+"""
+Stage Measurement.
+~~~~~~~~~~~~~~~~~~
+"""
+
+import gc
+import time
+import tracemalloc
+
+
+class StageMeasurement(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+
+    def to_json(self):
+        return {'seconds': self.seconds, 'peak_bytes': self.peak_bytes, 'retained_bytes': self.retained_bytes}
+
+
+def measure(name, stage):
+    """
+    Run a stage, tracing the memory it allocates.
+    The elapsed time includes the tracing overhead, which is the same from one run to the next.
+    :param name: The stage name.
+    :param stage: A callable running the stage.
+    :return: A tuple of the stage result and its measurement.
+    """
+
+    measurement = StageMeasurement(name)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = stage()
+    finally:
+        measurement.seconds = time.perf_counter() - start
+        gc.collect()
+        measurement.retained_bytes, measurement.peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, measurement
@@ -0,0 +1,241 @@
+"""
+Benchmark Suite.
+~~~~~~~~~~~~~~~~
+
+Runs the configuration processing stages of the tool against a synthetic deployment configuration, offline, and
+reports the time and peak traced memory of each stage. Results can be saved as a baseline, and later runs compared
+against it to flag regressions.
+
+Usage:
+    python -m benchmarks.suite [--users 100] [--clients 100] ... [--repeat 3]
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json [--time-tolerance 0.25] [--memory-tolerance 0.1]
+"""
+
+from .measurement import measure
+from .synthetic import DEPLOY_ENV
+from .synthetic import ENCRYPTION_PREFIX
+from .synthetic import fake_kmsdecrypt
+from .synthetic import generate_deploy_tree
+from .synthetic import Scale
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import unittest.mock
+
+STAGES = [
+    'load variables',
+    'process variables',
+    'parse json',
+    'decrypt',
+    'create engine',
+    'build actions',
+    'process user roles'
+]
+
+
+class OfflineResponse(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class OfflineKeycloakClient(object):
+    """
+    Answers the requests made by the role utilities from memory.
+    """
+
+    def __init__(self, role_names):
+        from keycloak_config.cache import KeycloakCache
+
+        self.cache = KeycloakCache()
+        self.roles = dict((role_name, {'id': 'id-{0}'.format(role_name), 'name': role_name}) for role_name in role_names)
+
+    def get(self, path, params=None, **kwargs):
+        if path.endswith('/roles'):
+            return OfflineResponse(200, list(self.roles.values()))
+        role_name = path.rsplit('/', 1)[-1]
+        if role_name in self.roles:
+            return OfflineResponse(200, self.roles[role_name])
+        return OfflineResponse(404)
+
+    def paginate(self, path, params=None, **kwargs):
+        return iter(self.get(path, params).json())
+
+    def post(self, path, data=None, json=None, **kwargs):
+        self.cache.invalidate_path(path)
+        return OfflineResponse(204)
+
+    def delete(self, path, **kwargs):
+        self.cache.invalidate_path(path)
+        return OfflineResponse(204)
+
+
+def run_stages(deploy_dir):
+    """
+    Run and measure every stage once.
+    :param deploy_dir: The deployment configuration directory.
+    :return: The measurements, by stage name.
+    """
+
+    from keycloak_config.actions.utils import process_user_roles
+    from keycloak_config.actions_engine import ActionsEngine
+    from keycloak_config.deploy_config import DeployConfig
+    from keycloak_config.encryption import EncryptionHelper
+    from keycloak_config.json import JsonLoader
+
+    encryption_helper = EncryptionHelper(ENCRYPTION_PREFIX, None)
+    json_loader = JsonLoader(encryption_helper)
+    config = DeployConfig(deploy_dir, DEPLOY_ENV, json_loader)
+    raw_config = config.read_raw_config()
+    results = {}
+
+    def run(name, stage):
+        result, results[name] = measure(name, stage)
+        return result
+
+    run('load variables', config.load_variables)
+    processed_config = run('process variables', lambda: config.process_config_variables(raw_config))
+    parsed_config = run('parse json', lambda: json.loads(processed_config))
+    json_config = run('decrypt', lambda: encryption_helper.decrypt(parsed_config))
+    actions_engine = run('create engine', lambda: ActionsEngine(DEPLOY_ENV, config.get_config_dir(), json_config, json_loader))
+
+    def build_actions():
+        for action_name, action_class, action_config_json in actions_engine.pending_actions:
+            actions_engine.build_action(action_name, action_class, action_config_json)
+
+    run('build actions', build_actions)
+
+    role_names = [item['role']['name'] for item in json_config if item['action'] == 'createRole']
+    users = [item for item in json_config if item['action'] == 'createUser']
+    keycloak_client = OfflineKeycloakClient(role_names)
+
+    def process_roles():
+        for index, user in enumerate(users):
+            # Users already have some of their roles, and roles they should lose.
+            existing_roles = [keycloak_client.roles[role_name] for role_name in role_names[index % max(len(role_names), 1):][1:4]]
+            process_user_roles(user['realmName'], 'user-{0}'.format(index), existing_roles, user['roles'], keycloak_client)
+
+    run('process user roles', process_roles)
+    return results
+
+
+def run_suite(scale, repeat=3):
+    """
+    Generate a synthetic configuration, and measure every stage several times.
+    :param scale: The size of the configuration.
+    :param repeat: The number of measurements of each stage.
+    :return: The results, with the median time and the highest peak memory of each stage.
+    """
+
+    with tempfile.TemporaryDirectory() as deploy_dir, \
+            unittest.mock.patch('keycloak_config.encryption.kmsdecrypt', fake_kmsdecrypt):
+        generate_deploy_tree(deploy_dir, scale)
+        # Import the action modules once, so that the first run is not charged for it.
+        run_stages(deploy_dir)
+        runs = [run_stages(deploy_dir) for _ in range(repeat)]
+
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {
+            'seconds': statistics.median(results[stage].seconds for results in runs),
+            'peak_bytes': max(results[stage].peak_bytes for results in runs)
+        }
+    return {'scale': scale.to_json(), 'repeat': repeat, 'stages': stages}
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """
+    Compare results against a baseline.
+    :param results: The results.
+    :param baseline: The baseline results.
+    :param time_tolerance: The relative time increase above which a stage is flagged.
+    :param memory_tolerance: The relative peak memory increase above which a stage is flagged.
+    :return: The list of regressions, as (stage, metric, baseline value, value) tuples.
+    """
+
+    regressions = []
+    for stage, measurement in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        reference = baseline['stages'][stage]
+        if measurement['seconds'] > reference['seconds'] * (1 + time_tolerance):
+            regressions.append((stage, 'seconds', reference['seconds'], measurement['seconds']))
+        if measurement['peak_bytes'] > reference['peak_bytes'] * (1 + memory_tolerance):
+            regressions.append((stage, 'peak_bytes', reference['peak_bytes'], measurement['peak_bytes']))
+    return regressions
+
+
+def format_results(results, baseline=None):
+    lines = ['{0:<20} {1:>10} {2:>12} {3:>10} {4:>10}'.format('stage', 'ms', 'peak KiB', 'ms %', 'peak %')]
+    for stage in STAGES:
+        measurement = results['stages'][stage]
+        line = '{0:<20} {1:>10.2f} {2:>12.1f}'.format(stage, measurement['seconds'] * 1000, measurement['peak_bytes'] / 1024.0)
+        if baseline and stage in baseline['stages']:
+            reference = baseline['stages'][stage]
+            line += ' {0:>+10.1f} {1:>+10.1f}'.format(
+                    relative_change(reference['seconds'], measurement['seconds']),
+                    relative_change(reference['peak_bytes'], measurement['peak_bytes'])
+            )
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def relative_change(reference, value):
+    if not reference:
+        return 0.0
+    return 100.0 * (value - reference) / reference
+
+
+def main(argv=None):
+    defaults = Scale()
+    parser = argparse.ArgumentParser(description='Benchmark the configuration processing stages of the tool.')
+    for field in Scale.FIELDS:
+        parser.add_argument('--' + field.replace('_', '-'), type=int, default=getattr(defaults, field),
+                            help='The number of {0} of the synthetic configuration'.format(field.replace('_', ' ')))
+    parser.add_argument('--repeat', type=int, default=3, help='The number of measurements of each stage')
+    parser.add_argument('--save-baseline', help='Save the results to this file')
+    parser.add_argument('--baseline', help='Compare the results against the baseline saved in this file')
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help='The allowed relative time increase')
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help='The allowed relative peak memory increase')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        # Only compare like with like, at the scale of the baseline.
+        scale = Scale(**baseline['scale'])
+    else:
+        scale = Scale(**dict((field, getattr(args, field)) for field in Scale.FIELDS))
+
+    results = run_suite(scale, args.repeat)
+    print('Scale: {0}'.format(', '.join('{0}={1}'.format(field, value) for field, value in results['scale'].items())))
+    print(format_results(results, baseline))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Baseline saved to "{0}".'.format(args.save_baseline))
+
+    if baseline:
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        for stage, metric, reference, value in regressions:
+            print('REGRESSION: {0} {1}: {2:.6g} -> {3:.6g} ({4:+.1f}%)'.format(
+                    stage, metric, reference, value, relative_change(reference, value)
+            ))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Synthetic Deployment Configuration.
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Generates deployment configuration directories (a `src/keycloak.json` configuration, a realm file and variable files)
+of a configurable size, for the benchmarks.
+"""
+
+import json
+import os
+
+DEPLOY_ENV = 'local'
+REALM_NAME = 'bench'
+REALM_FILE = 'keycloak/bench-realm.json'
+
+# The prefix of the generated encrypted values; the benchmarks replace KMS decryption with a local function.
+ENCRYPTION_PREFIX = 'decrypt:'
+
+
+def fake_kmsdecrypt(data, prefix, **kwargs):
+    """
+    Stand-in for the KMS toolbox decryption, so that the benchmarks run offline.
+    """
+
+    return data[len(prefix):]
+
+
+class Scale(object):
+    """
+    The size of a synthetic deployment configuration.
+    """
+
+    FIELDS = ['users', 'clients', 'roles', 'mappers', 'variables', 'encrypted_fields', 'realm_users']
+
+    def __init__(self, users=100, clients=100, roles=20, mappers=2, variables=20, encrypted_fields=20, realm_users=1000):
+        """
+        Constructor.
+        :param users: The number of createUser actions.
+        :param clients: The number of createClient actions.
+        :param roles: The number of createRole actions, which are also the roles assigned to users and clients.
+        :param mappers: The number of protocol mappers of each client.
+        :param variables: The number of variables, referenced throughout the configuration.
+        :param encrypted_fields: The number of encrypted values, spread across the users and clients.
+        :param realm_users: The number of users in the realm file, which is imported by an importRealm action.
+        """
+
+        self.users = users
+        self.clients = clients
+        self.roles = roles
+        self.mappers = mappers
+        self.variables = variables
+        self.encrypted_fields = encrypted_fields
+        self.realm_users = realm_users
+
+    def to_json(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+
+def generate_deploy_tree(target_dir, scale=None, **kwargs):
+    """
+    Generate a deployment configuration directory.
+    :param target_dir: The directory to generate the configuration into.
+    :param scale: The size of the configuration.
+    :param kwargs: The size of the configuration, if no scale is provided (see Scale).
+    :return: The path of the generated directory.
+    """
+
+    scale = scale or Scale(**kwargs)
+
+    src_dir = os.path.join(target_dir, 'src')
+    var_dir = os.path.join(target_dir, 'var', 'keycloak')
+    os.makedirs(os.path.join(src_dir, 'keycloak'), exist_ok=True)
+    os.makedirs(var_dir, exist_ok=True)
+
+    role_names = ['role-{0}'.format(index) for index in range(scale.roles)]
+    variable_names = ['VAR_{0}'.format(index) for index in range(scale.variables)]
+    config = []
+
+    def variable(index):
+        if not variable_names:
+            return 'value-{0}'.format(index)
+        return '#{{{0}}}'.format(variable_names[index % len(variable_names)])
+
+    def secret(index):
+        # Encrypted values are spread evenly across the users and clients.
+        total = scale.users + scale.clients
+        every = max(total // scale.encrypted_fields, 1) if scale.encrypted_fields else None
+        if every and index % every == 0 and index // every < scale.encrypted_fields:
+            return '{0}secret-{1}'.format(ENCRYPTION_PREFIX, index)
+        return 'secret-{0}'.format(index)
+
+    def assigned_roles(index):
+        return role_names[index % max(scale.roles, 1):][:3]
+
+    if scale.realm_users:
+        config.append({
+            'name': 'importRealm',
+            'action': 'importRealm',
+            'realmFile': REALM_FILE,
+            'overwrite': True
+        })
+        with open(os.path.join(src_dir, REALM_FILE), 'w') as f:
+            json.dump(generate_realm(scale.realm_users, role_names), f)
+
+    for role_name in role_names:
+        config.append({
+            'name': 'createRole-{0}'.format(role_name),
+            'action': 'createRole',
+            'realmName': '#{REALM_NAME}',
+            'role': {'name': role_name, 'description': 'Synthetic role {0}'.format(role_name)}
+        })
+
+    for index in range(scale.users):
+        config.append({
+            'name': 'createUser-{0}'.format(index),
+            'action': 'createUser',
+            'realmName': '#{REALM_NAME}',
+            'password': secret(index),
+            'roles': assigned_roles(index),
+            'user': {
+                'email': 'user-{0}@#{{EMAIL_DOMAIN}}'.format(index),
+                'enabled': True,
+                'firstName': 'User',
+                'lastName': str(index),
+                'attributes': {'team': [variable(index)]}
+            }
+        })
+
+    for index in range(scale.clients):
+        config.append({
+            'name': 'createClient-{0}'.format(index),
+            'action': 'createClient',
+            'realmName': '#{REALM_NAME}',
+            'roles': assigned_roles(index),
+            'client': {
+                'clientId': 'client-{0}'.format(index),
+                'enabled': True,
+                'secret': secret(scale.users + index),
+                'redirectUris': ['https://{0}/client-{1}/*'.format(variable(index), index)],
+                'serviceAccountsEnabled': True,
+                'protocolMappers': [{
+                    'name': 'mapper-{0}'.format(mapper_index),
+                    'protocol': 'openid-connect',
+                    'protocolMapper': 'oidc-hardcoded-claim-mapper',
+                    'config': {'claim.name': 'claim-{0}'.format(mapper_index), 'claim.value': variable(index + mapper_index)}
+                } for mapper_index in range(scale.mappers)]
+            }
+        })
+
+    with open(os.path.join(src_dir, 'keycloak.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+    with open(os.path.join(var_dir, 'defaults.var'), 'w') as f:
+        f.write('REALM_NAME={0}\nEMAIL_DOMAIN=example.com\n'.format(REALM_NAME))
+        for variable_name in variable_names:
+            f.write('{0}=default-{1}\n'.format(variable_name, variable_name.lower()))
+    with open(os.path.join(var_dir, '{0}.var'.format(DEPLOY_ENV)), 'w') as f:
+        # Half of the variables are overridden by the environment.
+        for variable_name in variable_names[::2]:
+            f.write('{0}={1}-{2}\n'.format(variable_name, DEPLOY_ENV, variable_name.lower()))
+
+    return target_dir
+
+
+def generate_realm(users, role_names):
+    """
+    Generate a realm representation.
+    :param users: The number of users.
+    :param role_names: The realm role names.
+    :return: The realm representation.
+    """
+
+    return {
+        'realm': REALM_NAME,
+        'enabled': True,
+        'roles': {'realm': [{'name': role_name} for role_name in role_names]},
+        'users': [{
+            'username': 'realm-user-{0}'.format(index),
+            'email': 'realm-user-{0}@example.com'.format(index),
+            'enabled': True,
+            'realmRoles': role_names[:2],
+            'attributes': {'index': [str(index)]}
+        } for index in range(users)]
+    }
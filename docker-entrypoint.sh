@@ -23,6 +23,14 @@ if [[ -n "${AWS_PROFILE}" ]] ; then
     ADDITIONAL_ARGS=( "${ADDITIONAL_ARGS[@]}" "--aws-profile" "${AWS_PROFILE}" )
 fi
 
+if [[ -n "${LOG_LEVEL}" ]] ; then
+    ADDITIONAL_ARGS=( "${ADDITIONAL_ARGS[@]}" "--log-level" "${LOG_LEVEL}" )
+fi
+
+if [[ -n "${LOG_FORMAT}" ]] ; then
+    ADDITIONAL_ARGS=( "${ADDITIONAL_ARGS[@]}" "--log-format" "${LOG_FORMAT}" )
+fi
+
 keycloak-config-tool \
         --keycloak-base-url "${KEYCLOAK_BASE_URL}" \
         --keycloak-username "${KEYCLOAK_USERNAME}" \
@@ -6,22 +6,47 @@ from .actions_engine import ActionsEngine
 from .deploy_config import DeployConfig
 from .encryption import EncryptionHelper
 from .json import JsonLoader
-from .keycloak_client import KeycloakClient
+from .log import configure_logging
+from .log import LOG_FORMAT_TEXT
+from .log import LOG_FORMATS
+from .log import LOG_LEVELS
+from .log import LOGGER_NAME
+from .upsert import LOOKUP_FIRST
+from .upsert import UPSERT_STRATEGIES
 
 import click
-import os
+import logging
+import re
 import sys
+import time
+
+logger = logging.getLogger(LOGGER_NAME)
 
 # `prog` & `version` will be auto detected by clicked based on setup.py
 VERSION_MESSAGE = '%(prog)s version %(version)s Applause AQI Inc. 2017. All rights reserved.'
 
 
+def validate_positive(ctx, param, value):
+    if value is not None and value <= 0:
+        raise click.BadParameter('must be positive')
+    return value
+
+
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise click.BadParameter('expected i/N, with 1 <= i <= N')
+    return int(match.group(1)), int(match.group(2))
+
+
 @click.command()
 @click.option(
         '--keycloak-base-url',
         type=click.STRING,
         required=True,
-        help='The base URL for the Keycloak service'
+        help='The base URL for the Keycloak service, or the comma-separated base URLs of the nodes of a Keycloak cluster'
 )
 @click.option(
         '--keycloak-timeout',
@@ -29,6 +54,20 @@ VERSION_MESSAGE = '%(prog)s version %(version)s Applause AQI Inc. 2017. All righ
         default=180,
         help='The timeout to use while waiting for Keycloak to become available'
 )
+@click.option(
+        '--keycloak-connect-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        default=10,
+        help='The timeout (in seconds) for connecting to Keycloak'
+)
+@click.option(
+        '--keycloak-read-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        default=60,
+        help='The timeout (in seconds) for receiving data from Keycloak, between two reads'
+)
 @click.option(
         '--keycloak-username',
         type=click.STRING,
@@ -68,19 +107,141 @@ VERSION_MESSAGE = '%(prog)s version %(version)s Applause AQI Inc. 2017. All righ
         type=click.STRING,
         help='AWS profile to be used for contacting KMS when decryption is required'
 )
+@click.option(
+        '--watch',
+        is_flag=True,
+        help='If supplied, keep running and apply changes to the deployment configuration as they are made'
+)
+@click.option(
+        '--watch-interval',
+        type=click.INT,
+        default=2,
+        help='The interval (in seconds) between two checks of the deployment configuration in watch mode'
+)
+@click.option(
+        '--resync-interval',
+        type=click.INT,
+        default=600,
+        help='The interval (in seconds) between two full resynchronizations in watch mode'
+)
+@click.option(
+        '--profile',
+        type=click.Path(file_okay=False),
+        help='If supplied, profile each action, and write the results to this directory'
+)
+@click.option(
+        '--coalesce',
+        is_flag=True,
+        help='If supplied, consecutive createRole and createUser actions for a realm are combined into partial imports'
+)
+@click.option(
+        '--journal',
+        type=click.Path(dir_okay=False),
+        help='If supplied, record the completed actions in this journal file'
+)
+@click.option(
+        '--resume',
+        is_flag=True,
+        help='If supplied, skip the actions completed by the last run recorded in the journal, if it did not finish'
+)
+@click.option(
+        '--ignore-fingerprints',
+        is_flag=True,
+        help='If supplied, update resources even if their fingerprint matches the configuration, to undo manual changes'
+)
+@click.option(
+        '--prefetch-depth',
+        type=click.IntRange(min=0),
+        default=0,
+        help='The number of upcoming actions whose lookups are made in the background while an action is executed'
+)
+@click.option(
+        '--upsert-strategy',
+        type=click.Choice(UPSERT_STRATEGIES),
+        default=LOOKUP_FIRST,
+        help='Whether create actions look resources up before creating them, create them first, or pick per realm'
+)
+@click.option(
+        '--action-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        help='If supplied, the default deadline (in seconds) of each action, covering all its requests'
+)
+@click.option(
+        '--slow-action-threshold',
+        type=click.FLOAT,
+        callback=validate_positive,
+        default=10,
+        help='The duration (in seconds) from which an action is reported as slow'
+)
+@click.option(
+        '--shard',
+        type=click.STRING,
+        callback=parse_shard,
+        help='If supplied, as i/N, only execute the actions of the i-th of N shards, the actions being assigned to shards '
+             'by realm or by their shardKey property'
+)
+@click.option(
+        '--results-file',
+        type=click.Path(dir_okay=False),
+        help='If supplied, write the outcome of each action to this JSON file, for keycloak-config-summary'
+)
+@click.option(
+        '--plan',
+        is_flag=True,
+        help='If supplied, the changes the actions would make are displayed, for the actions which support it, and no '
+             'action is executed'
+)
+@click.option(
+        '--max-workers',
+        type=click.INT,
+        default=8,
+        help='The maximum number of concurrent requests made to Keycloak'
+)
+@click.option(
+        '--log-level',
+        type=click.Choice(LOG_LEVELS),
+        default='INFO',
+        help='The minimum level of the log messages to output'
+)
+@click.option(
+        '--log-format',
+        type=click.Choice(LOG_FORMATS),
+        default=LOG_FORMAT_TEXT,
+        help='The format of the log messages, either plain text or JSON lines'
+)
 def main(
         keycloak_base_url,
         keycloak_timeout,
+        keycloak_connect_timeout,
+        keycloak_read_timeout,
         keycloak_username,
         keycloak_password,
         deploy_config_dir,
         deploy_env,
         config_only,
         encryption_prefix,
-        aws_profile
+        aws_profile,
+        watch,
+        watch_interval,
+        resync_interval,
+        profile,
+        coalesce,
+        journal,
+        resume,
+        ignore_fingerprints,
+        prefetch_depth,
+        upsert_strategy,
+        action_timeout,
+        slow_action_threshold,
+        shard,
+        results_file,
+        plan,
+        max_workers,
+        log_level,
+        log_format
 ):
-    # 'Unbuffer' stdout
-    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)
+    configure_logging(log_level, log_format)
 
     encryption_helper = EncryptionHelper(encryption_prefix, aws_profile)
     json_loader = JsonLoader(encryption_helper)
@@ -90,12 +251,166 @@ def main(
         print(config.get_processed_config())
         return
 
-    actions_engine = ActionsEngine(deploy_env, config.get_config_dir(), config.get_json_config(), json_loader)
+    if plan and watch:
+        raise click.UsageError('--plan cannot be combined with --watch')
+
+    if watch and (coalesce or prefetch_depth):
+        # Watch mode executes the changed actions one by one.
+        raise click.UsageError('--coalesce and --prefetch-depth cannot be combined with --watch')
+
+    if watch and results_file:
+        raise click.UsageError('--results-file cannot be combined with --watch')
+
+    if watch and (journal or resume or profile):
+        # These options describe a single run, while watch mode keeps running.
+        raise click.UsageError('--journal, --resume and --profile cannot be combined with --watch')
+
+    if watch:
+        watch_config(
+                keycloak_base_url,
+                keycloak_timeout,
+                keycloak_username,
+                keycloak_password,
+                deploy_config_dir,
+                deploy_env,
+                json_loader,
+                watch_interval,
+                resync_interval,
+                max_workers,
+                keycloak_connect_timeout,
+                keycloak_read_timeout,
+                {
+                    'ignore_fingerprints': ignore_fingerprints,
+                    'upsert_strategy': upsert_strategy,
+                    'action_timeout': action_timeout,
+                    'slow_action_threshold': slow_action_threshold,
+                    'shard': shard
+                }
+        )
+        return
+
+    if resume and not journal:
+        raise click.UsageError('--resume requires --journal')
+
+    if plan and results_file:
+        raise click.UsageError('--plan cannot be combined with --results-file')
+
+    run_journal = None
+    if journal:
+        from .journal import RunJournal
+        run_journal = RunJournal(journal)
+
+    profiler = None
+    if profile:
+        from .profiling import ActionProfiler
+        profiler = ActionProfiler(profile, custom_code_dir=config.get_config_dir())
+
+    actions_engine = ActionsEngine(
+            deploy_env, config.get_config_dir(), config.get_json_config(), json_loader, profiler=profiler, coalesce=coalesce,
+            journal=run_journal, resume=resume, ignore_fingerprints=ignore_fingerprints, prefetch_depth=prefetch_depth,
+            upsert_strategy=upsert_strategy, action_timeout=action_timeout, slow_action_threshold=slow_action_threshold,
+            shard=shard
+    )
+
+    start = time.perf_counter()
+    error = None
+    client = None
+    try:
+        if actions_engine.is_empty():
+            logger.info('There are no actions to execute.')
+        else:
+            # Imported here, as the HTTP stack is not needed to only process the configuration.
+            from .keycloak_client import KeycloakClient
+
+            client = KeycloakClient(
+                    keycloak_base_url, max_workers=max_workers, connect_timeout=keycloak_connect_timeout,
+                    read_timeout=keycloak_read_timeout
+            )
+            if client.wait_for_availability(keycloak_timeout) and \
+                    client.initialize_session(keycloak_username, keycloak_password):
+                try:
+                    if plan:
+                        print_plan(actions_engine.plan(client))
+                    else:
+                        actions_engine.execute(client)
+                finally:
+                    if len(client.nodes) > 1:
+                        client.log_node_summary()
+                    if profiler:
+                        logger.info('Profiling results written to "%s":\n%s', profile, profiler.write_summary())
+            else:
+                error = 'Unable to connect or log in to Keycloak'
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if client is not None:
+            client.close()
+        if results_file:
+            from .results import build_results
+            from .results import write_results
+            write_results(results_file, build_results(actions_engine, time.perf_counter() - start, error))
+
+
+def print_plan(previews):
+    """
+    Display the changes the actions would make.
+    :param previews: The list of (action name, action type, change descriptions) tuples.
+    """
+
+    for action_name, action_type, changes in previews:
+        if changes is None:
+            print('{0} ({1}): no preview'.format(action_name, action_type))
+        elif not changes:
+            print('{0} ({1}): no changes'.format(action_name, action_type))
+        else:
+            print('{0} ({1}):'.format(action_name, action_type))
+            for change in changes:
+                print('  {0}'.format(change))
+
+
+def watch_config(
+        keycloak_base_url,
+        keycloak_timeout,
+        keycloak_username,
+        keycloak_password,
+        deploy_config_dir,
+        deploy_env,
+        json_loader,
+        watch_interval,
+        resync_interval,
+        max_workers,
+        connect_timeout,
+        read_timeout,
+        engine_kwargs
+):
+    """
+    Keep a single logged-in client, and apply configuration changes until interrupted.
+    """
+
+    from .keycloak_client import KeycloakClient
+    from .watch import ConfigWatcher
+
+    client = KeycloakClient(
+            keycloak_base_url, max_workers=max_workers, connect_timeout=connect_timeout, read_timeout=read_timeout
+    )
+    try:
+        if not client.wait_for_availability(keycloak_timeout) or \
+                not client.initialize_session(keycloak_username, keycloak_password):
+            sys.exit(1)
 
-    if actions_engine.is_empty():
-        print("==== There are no actions to execute.")
-    else:
-        client = KeycloakClient(keycloak_base_url)
-        if client.wait_for_availability(keycloak_timeout) and \
-                client.initialize_session(keycloak_username, keycloak_password):
-            actions_engine.execute(client)
+        watcher = ConfigWatcher(
+                deploy_config_dir,
+                deploy_env,
+                json_loader,
+                client,
+                keycloak_timeout,
+                poll_interval=watch_interval,
+                resync_interval=resync_interval,
+                engine_kwargs=engine_kwargs
+        )
+        watcher.run()
+    except KeyboardInterrupt:
+        logger.info('Stopped watching.')
+    finally:
+        client.close()
@@ -3,34 +3,281 @@ Action superclass.
 ~~~~~~~~~~~~~~~~~~
 """
 
+from ..cache import CLIENTS
+from ..fingerprint import fingerprint
+from ..keycloak_client import UnexpectedResponseException
+from ..upsert import CREATE_FIRST
+from ..upsert import LOOKUP_FIRST
+from ..upsert import UPSERT_STRATEGIES
+from .exceptions import ActionExecutionException
+from .exceptions import InvalidActionConfigurationException
+
 import requests
 import urllib
 
+# The attribute in which create actions store the fingerprint of the configuration they applied to a resource.
+FINGERPRINT_ATTRIBUTE = 'keycloak-config-tool.fingerprint'
 
-class InvalidActionConfigurationException(Exception):
-    pass
-
+# The fingerprint attribute value of a resource whose update is in progress, which matches no configuration.
+PENDING_FINGERPRINT = 'pending'
 
-class ActionExecutionException(Exception):
-    pass
+# The kind of declared resource holding the protocol mapper names of a client, see Action.declared_resources().
+PROTOCOL_MAPPERS = 'protocolMappers'
 
 
 class Action(object):
+    # Actions only keep the fields they extract from their configuration.
+    __slots__ = ['name', 'ignore_fingerprints', 'upsert_strategy', 'upsert_stats']
+
+    # Whether the action may be coalesced with others into a partial import, see partial_import().
+    COALESCIBLE = False
 
     def __init__(self, name, *args, **kwargs):
         self.name = name
+        self.ignore_fingerprints = kwargs.get('ignore_fingerprints', False)
+        self.upsert_strategy = kwargs.get('upsert_strategy', None) or LOOKUP_FIRST
+        self.upsert_stats = kwargs.get('upsert_stats', None)
+
+    @staticmethod
+    def referenced_files(config_file_dir, action_config_json):
+        """
+        Returns the files, besides the configuration file, that the action reads its configuration from.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The list of file paths.
+        """
+
+        return []
+
+    @staticmethod
+    def shard_key(config_file_dir, action_config_json):
+        """
+        Returns the key assigning the action to a shard when the actions are sharded: the realm of the action, so that
+        the actions of a realm are executed by the same runner.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The shard key, or None if the action has no realm.
+        """
+
+        return action_config_json.get('realmName', None)
+
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the resources the action creates or refers to, which prune actions must keep. The configuration may be
+        invalid, or for another deployment environment.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples: the kinds are CLIENTS (by client ID), ROLES (realm roles, by
+        name), USERS (by lower-cased username) and PROTOCOL_MAPPERS (a tuple of a client ID and of the sorted names of
+        the protocol mappers configured for the client).
+        """
+
+        return []
+
+    def plan(self, keycloak_client):
+        """
+        Describe the changes the action would make, without making them.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The list of change descriptions, or None if the action cannot be previewed.
+        """
+
+        return None
+
+    def partial_import(self):
+        """
+        Describe the resource this action creates, if the action can be coalesced with others into a partial import.
+        Creating the resource through a partial import must be equivalent to executing the action when the resource
+        does not exist yet.
+        :return: A (realm name, resource type, resource name, representation) tuple, or None if the action cannot be
+        coalesced.
+        """
+
+        return None
+
+    def prefetch(self, keycloak_client):
+        """
+        Perform the read-only lookups of the action ahead of its execution, while the previous actions are executed, so
+        that the action then finds their results in the cache. Lookup results which may have been affected by the
+        requests of the previous actions are discarded by the cache.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        pass
+
+    def read_upsert_strategy(self, action_config_json):
+        """
+        Read the upsert strategy of a create action, which overrides the default one of the run.
+        :param action_config_json: The JSON configuration for the action
+        """
+
+        self.upsert_strategy = action_config_json.get('upsertStrategy', self.upsert_strategy)
+        if self.upsert_strategy not in UPSERT_STRATEGIES:
+            raise InvalidActionConfigurationException('Configuration "{0}" has an invalid upsert strategy: {1}'.format(
+                    self.name, self.upsert_strategy
+            ))
+
+    def read_concurrency(self, action_config_json, property_name='concurrency'):
+        """
+        Read the maximum number of concurrent requests of an action.
+        :param action_config_json: The JSON configuration for the action
+        :param property_name: The configuration property.
+        :return: The maximum number of concurrent requests, or None for the size of the worker pool.
+        """
+
+        concurrency = action_config_json.get(property_name, None)
+        if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1):
+            raise InvalidActionConfigurationException('Configuration "{0}" has an invalid {1}: {2}'.format(
+                    self.name, property_name, concurrency
+            ))
+        return concurrency
+
+    def creates_first(self, realm_name):
+        """
+        Returns True if resources should be created without looking them up first, False otherwise.
+        :param realm_name: The realm of the resource.
+        """
+
+        if self.upsert_strategy == LOOKUP_FIRST:
+            return False
+        if self.upsert_strategy == CREATE_FIRST:
+            return True
+        return self.upsert_stats is not None and self.upsert_stats.creates_first(realm_name)
+
+    def look_up_or_create(self, realm_name, cached, look_up, create):
+        """
+        Find an existing resource, or create it, following the upsert strategy of the action (see the upsert module).
+        Resources whose lookup is answered by the cache are always looked up first.
+        :param realm_name: The realm of the resource.
+        :param cached: True if the lookup is answered by the cache.
+        :param look_up: A function returning the existing resource representation, or None.
+        :param create: A function sending the creation request, and returning its response.
+        :return: A tuple of the existing resource representation and of the creation response, one of them being None.
+        The creation response is returned as it is, including when the creation failed.
+        """
+
+        if not cached and self.creates_first(realm_name):
+            create_response = create()
+            existed = create_response.status_code == requests.codes.conflict
+            self.record_upsert(realm_name, existed)
+            if not existed:
+                return None, create_response
+
+            existing_data = look_up()
+            # The conflict may be on another property than the key the resource is looked up with.
+            return (existing_data, None) if existing_data else (None, create_response)
+
+        existing_data = look_up()
+        self.record_upsert(realm_name, bool(existing_data))
+        if existing_data:
+            return existing_data, None
+        return None, create()
+
+    def record_upsert(self, realm_name, existed):
+        if self.upsert_stats is not None:
+            self.upsert_stats.record(realm_name, existed)
+
+    @staticmethod
+    def add_fingerprint(representation, desired_state, multivalued_attributes=True):
+        """
+        Add the fingerprint of the desired state of a resource to its attributes.
+        :param representation: The resource representation, which is not modified.
+        :param desired_state: The JSON-compatible desired state of the resource, including the representation.
+        :param multivalued_attributes: True if attribute values are lists (users, roles), False if they are strings
+        (clients).
+        :return: A copy of the representation, with the fingerprint attribute.
+        """
+
+        return Action.with_fingerprint_attribute(representation, fingerprint(desired_state), multivalued_attributes)
+
+    @staticmethod
+    def add_pending_fingerprint(representation, multivalued_attributes=True):
+        """
+        Mark a resource as being updated, for the actions which apply its desired state with several requests: the
+        fingerprint is only written once all of them succeeded (see write_fingerprint()), so that a resource left
+        partially updated by a failure is updated again by the next run.
+        :param representation: The resource representation, which is not modified.
+        :param multivalued_attributes: True if attribute values are lists (users, roles), False if they are strings
+        (clients).
+        :return: A copy of the representation, with the pending fingerprint attribute.
+        """
+
+        return Action.with_fingerprint_attribute(representation, PENDING_FINGERPRINT, multivalued_attributes)
+
+    @staticmethod
+    def with_fingerprint_attribute(representation, value, multivalued_attributes):
+        attributes = dict(representation.get('attributes') or {})
+        attributes[FINGERPRINT_ATTRIBUTE] = [value] if multivalued_attributes else value
+        return dict(representation, attributes=attributes)
+
+    def write_fingerprint(self, path, representation, keycloak_client):
+        """
+        Update a resource with its fingerprinted representation, once all the requests applying its desired state
+        succeeded.
+        :param path: The resource path.
+        :param representation: The resource representation, with its fingerprint attribute.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        response = keycloak_client.put(path, json=representation)
+        if response.status_code != requests.codes.no_content:
+            raise ActionExecutionException('Unexpected response for fingerprint update request ({0})'.format(response.status_code))
+
+    def is_unchanged(self, existing_representation, representation):
+        """
+        Returns True if an existing resource was last updated by the tool with the same desired state, which is
+        determined by comparing fingerprint attributes only.
+        :param existing_representation: The existing resource representation, or None.
+        :param representation: The resource representation to apply, with its fingerprint attribute.
+        :return: True if the resource is unchanged, False otherwise or if fingerprints are ignored.
+        """
+
+        if self.ignore_fingerprints or not existing_representation:
+            return False
+
+        existing_fingerprint = (existing_representation.get('attributes') or {}).get(FINGERPRINT_ATTRIBUTE, None)
+        return existing_fingerprint is not None and existing_fingerprint == representation['attributes'][FINGERPRINT_ATTRIBUTE]
+
+    @staticmethod
+    def get_clients(realm_name, keycloak_client):
+        """
+        List all clients of a realm, and keep them in the realm cache.
+        :param realm_name: The realm name.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The client representations.
+        """
+
+        realm_cache = keycloak_client.cache.realm(realm_name)
+        generation = realm_cache.current_generation()
+        clients_path = '/admin/realms/{0}/clients'.format(urllib.parse.quote(realm_name))
+        try:
+            clients = list(keycloak_client.paginate(clients_path))
+        except UnexpectedResponseException as e:
+            raise ActionExecutionException('Unexpected response from client listing request ({0})'.format(e.status_code))
+
+        for client_data in clients:
+            realm_cache.put(CLIENTS, client_data['clientId'], client_data, generation)
+        return clients
 
     @staticmethod
     def get_client_by_client_id(realm_name, client_id, keycloak_client):
+        realm_cache = keycloak_client.cache.realm(realm_name)
+        if realm_cache.contains(CLIENTS, client_id):
+            return realm_cache.get(CLIENTS, client_id)
+
+        generation = realm_cache.current_generation()
         client_id_query_path = '/admin/realms/{0}/clients'.format(urllib.parse.quote(realm_name))
         client_id_query_params = {'client_id': client_id}
-        query_response = keycloak_client.get(client_id_query_path, client_id_query_params)
-
-        if query_response.status_code == requests.codes.ok:
-            for client_data in query_response.json():
+        found_client_data = None
+        try:
+            # The listing may contain more than the requested client, so keep all of them.
+            for client_data in keycloak_client.paginate(client_id_query_path, client_id_query_params, stream=True):
+                realm_cache.put(CLIENTS, client_data['clientId'], client_data, generation)
                 if client_data['clientId'] == client_id:
-                    return client_data
-        else:
-            raise ActionExecutionException('Unexpected response from client lookup request ({0})'.format(query_response.status_code))
+                    found_client_data = client_data
+        except UnexpectedResponseException as e:
+            raise ActionExecutionException('Unexpected response from client lookup request ({0})'.format(e.status_code))
 
-        return None
+        if not found_client_data:
+            realm_cache.put(CLIENTS, client_id, None, generation)
+        return found_client_data
@@ -3,18 +3,27 @@ Client creation action.
 ~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+from ..cache import CLIENTS
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
-from .utils import get_user_roles
+from .action import PROTOCOL_MAPPERS
+from .utils import get_created_id
+from .utils import get_user_role_mappings
 from .utils import InvalidUserResponse
-from .utils import process_user_roles
+from .utils import prefetch_role_catalogs
+from .utils import process_user_role_mappings
+from .utils import referenced_roles
 
+import logging
 import requests
 import urllib
 
+logger = logging.getLogger(__name__)
+
 
 class CreateClientAction(Action):
+    __slots__ = ['realm_name', 'client_data', 'client_id', 'roles', 'client_roles']
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -26,6 +35,25 @@ class CreateClientAction(Action):
 
         return True
 
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the client, its protocol mappers, and the roles of its service account.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        realm_name = action_config_json.get('realmName', None)
+        client_data = action_config_json.get('client', None) or {}
+        resources = referenced_roles(realm_name, action_config_json.get('roles', []), action_config_json.get('clientRoles', {}))
+        if client_data.get('clientId', None):
+            resources.append((realm_name, CLIENTS, client_data['clientId']))
+            if 'protocolMappers' in client_data:
+                mapper_names = tuple(sorted(mapper['name'] for mapper in client_data['protocolMappers']))
+                resources.append((realm_name, PROTOCOL_MAPPERS, (client_data['clientId'], mapper_names)))
+        return resources
+
     def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
         """
         Constructor.
@@ -35,7 +63,6 @@ class CreateClientAction(Action):
         """
 
         super(CreateClientAction, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'realmName' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
@@ -51,6 +78,19 @@ class CreateClientAction(Action):
         if not self.client_id:
             raise InvalidActionConfigurationException('Client configuration for "{0}" missing property "clientId"'.format(name))
 
+        self.roles = action_config_json.get('roles', [])
+        self.client_roles = action_config_json.get('clientRoles', {})
+        self.read_upsert_strategy(action_config_json)
+
+    def prefetch(self, keycloak_client):
+        """
+        Look up the client and the roles to map to its service account ahead of the execution.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
+        prefetch_role_catalogs(self.realm_name, self.roles, self.client_roles, keycloak_client)
+
     def execute(self, keycloak_client):
         """
         Execute this action. In this case, attempt to create a client.
@@ -58,39 +98,60 @@ class CreateClientAction(Action):
         """
 
         # Process the client data.
-        print('==== Creating client "{0}" in realm "{1}"...'.format(self.client_id, self.realm_name))
-        existing_client_data = self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
+        logger.debug('Creating client "%s" in realm "%s"...', self.client_id, self.realm_name)
+        client_data = self.add_fingerprint(
+                self.client_data,
+                {'client': self.client_data, 'roles': self.roles, 'clientRoles': self.client_roles},
+                multivalued_attributes=False
+        )
+        # The protocol mappers and service account roles are updated with separate requests, so the fingerprint is only
+        # written once they succeeded.
+        request_data = self.add_pending_fingerprint(self.client_data, multivalued_attributes=False)
+        client_creation_path = '/admin/realms/{0}/clients'.format(urllib.parse.quote(self.realm_name))
+        existing_client_data, create_response = self.look_up_or_create(
+                self.realm_name,
+                keycloak_client.cache.realm(self.realm_name).contains(CLIENTS, self.client_id),
+                lambda: self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client),
+                lambda: keycloak_client.post(client_creation_path, json=request_data)
+        )
+        created_with_mappers = False
+
+        if self.is_unchanged(existing_client_data, client_data):
+            logger.debug('Client "%s" is unchanged.', self.client_id)
+            return
 
         if not existing_client_data:
-            print('==== Client "{0}" does not exist, creating...'.format(self.client_id))
-            client_creation_path = '/admin/realms/{0}/clients'.format(urllib.parse.quote(self.realm_name))
-            create_response = keycloak_client.post(client_creation_path, json=self.client_data)
             if create_response.status_code == requests.codes.created:
-                print('==== Client "{0}" created.'.format(self.client_id))
-                existing_client_data = self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
-                client_uuid = existing_client_data['id']
+                logger.debug('Client "%s" created.', self.client_id)
+                client_uuid = get_created_id(create_response)
+                if client_uuid:
+                    existing_client_data = self.created_client_data(request_data, client_uuid, keycloak_client)
+                    created_with_mappers = 'protocolMappers' in self.client_data
+                else:
+                    existing_client_data = self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
+                    client_uuid = existing_client_data['id']
             else:
                 raise ActionExecutionException('Unexpected response for client creation request ({0})'.format(create_response.status_code))
         else:
-            print('==== Client "{0}" exists, updating...'.format(self.client_id))
+            logger.debug('Client "%s" exists, updating...', self.client_id)
             client_uuid = existing_client_data['id']
             client_update_path = '/admin/realms/{0}/clients/{1}'.format(
                     urllib.parse.quote(self.realm_name),
                     urllib.parse.quote(client_uuid)
             )
-            update_response = keycloak_client.put(client_update_path, json=self.client_data)
+            update_response = keycloak_client.put(client_update_path, json=request_data)
             if update_response.status_code == requests.codes.no_content:
-                print('==== Client "{0}" updated.'.format(self.client_id))
+                logger.debug('Client "%s" updated.', self.client_id)
             else:
                 raise ActionExecutionException('Unexpected response for client update request ({0})'.format(update_response.status_code))
 
             # Now update the secret.
             if 'secret' in self.client_data:
-                print('==== NOT updating client "{0}" secret, as it is currently broken...'.format(self.client_id))
+                logger.debug('NOT updating client "%s" secret, as it is currently broken...', self.client_id)
 
             # NOTE: the following code is disabled because it requires a custom keycloak extension, which is not currently working
             if False and 'secret' in self.client_data:
-                print('==== Updating client "{0}" secret...'.format(self.client_id))
+                logger.debug('Updating client "%s" secret...', self.client_id)
                 client_secret_update_path = '/realms/{0}/clients-custom/{1}/client-secret'.format(
                         urllib.parse.quote(self.realm_name),
                         urllib.parse.quote(client_uuid)
@@ -99,17 +160,61 @@ class CreateClientAction(Action):
                         client_secret_update_path, json={'secret': self.client_data['secret']}
                 )
                 if client_secret_update_response.status_code == requests.codes.no_content:
-                    print('==== Client "{0}" secret updated.'.format(self.client_id))
+                    logger.debug('Client "%s" secret updated.', self.client_id)
                 else:
                     raise ActionExecutionException('Unexpected response for client secret update request ({0})'.format(
                             client_secret_update_response.status_code
                     ))
 
-        # We always need to process mappers, as Keycloak adds default mappers on client creation calls.
-        self.update_protocol_mappers(existing_client_data, keycloak_client)
+        # We always need to process mappers, as Keycloak adds default mappers on client creation calls, unless the
+        # client was just created with the configured mappers.
+        if not created_with_mappers:
+            self.update_protocol_mappers(existing_client_data, keycloak_client)
 
         # Process the service account roles.
-        self.process_service_account_roles(client_uuid, self.action_config_json.get('roles', []), keycloak_client)
+        self.process_service_account_roles(client_uuid, self.roles, self.client_roles, keycloak_client)
+
+        self.write_fingerprint('/admin/realms/{0}/clients/{1}'.format(
+                urllib.parse.quote(self.realm_name), urllib.parse.quote(client_uuid)
+        ), client_data, keycloak_client)
+
+    def created_client_data(self, created_client_data, client_uuid, keycloak_client):
+        """
+        Build the representation of a client that was just created from the configured client data, rather than
+        reading it back from Keycloak.
+        :param created_client_data: The client data of the creation request
+        :param client_uuid: The UUID of the created client
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The client representation
+        """
+
+        client_data = dict(created_client_data)
+        client_data['id'] = client_uuid
+
+        if 'protocolMappers' not in self.client_data:
+            # Only the mappers Keycloak added by default are unknown.
+            client_data['protocolMappers'] = self.get_protocol_mappers(client_uuid, keycloak_client)
+
+        keycloak_client.cache.realm(self.realm_name).put(CLIENTS, self.client_id, client_data)
+        return client_data
+
+    def get_protocol_mappers(self, client_uuid, keycloak_client):
+        """
+        Get the protocol mappers of the client.
+        :param client_uuid: The UUID of the client
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The protocol mappers
+        """
+
+        path = '/admin/realms/{0}/clients/{1}/protocol-mappers/models'.format(
+                urllib.parse.quote(self.realm_name),
+                urllib.parse.quote(client_uuid)
+        )
+
+        get_response = keycloak_client.get(path)
+        if get_response.status_code != requests.codes.ok:
+            raise ActionExecutionException('Unexpected response for client protocol mappers request ({0})'.format(get_response.status_code))
+        return get_response.json()
 
     def update_protocol_mappers(self, existing_client_data, keycloak_client):
         """
@@ -118,7 +223,7 @@ class CreateClientAction(Action):
         :param keycloak_client: The client to use when interacting with Keycloak
         """
 
-        print('==== Processing client "{0}" protocol mappers...'.format(self.client_id))
+        logger.debug('Processing client "%s" protocol mappers...', self.client_id)
         client_uuid = existing_client_data['id']
         existing_mappers = existing_client_data['protocolMappers']
         new_mappers = self.client_data['protocolMappers']
@@ -139,7 +244,7 @@ class CreateClientAction(Action):
             if name not in new_mappers_by_name:
                 self.delete_protocol_mapper(client_uuid, existing_mappers_by_name[name]['id'], name, keycloak_client)
 
-        print('==== Processed client "{0}" protocol mappers.'.format(self.client_id))
+        logger.debug('Processed client "%s" protocol mappers.', self.client_id)
 
     @staticmethod
     def mapper_list_to_map_by_name(mapper_list):
@@ -163,7 +268,7 @@ class CreateClientAction(Action):
         :param keycloak_client: The client to use when interacting with Keycloak
         """
 
-        print('==== Updating client "{0}" protocol mapper "{1}".'.format(self.client_id, mapper_config['name']))
+        logger.debug('Updating client "%s" protocol mapper "%s".', self.client_id, mapper_config['name'])
         path = '/admin/realms/{0}/clients/{1}/protocol-mappers/models/{2}'.format(
                 urllib.parse.quote(self.realm_name),
                 urllib.parse.quote(client_uuid),
@@ -184,7 +289,7 @@ class CreateClientAction(Action):
         :return:
         """
 
-        print('==== Creating client "{0}" protocol mapper "{1}".'.format(self.client_id, mapper_config['name']))
+        logger.debug('Creating client "%s" protocol mapper "%s".', self.client_id, mapper_config['name'])
         path = '/admin/realms/{0}/clients/{1}/protocol-mappers/models'.format(
                 urllib.parse.quote(self.realm_name),
                 urllib.parse.quote(client_uuid)
@@ -203,7 +308,7 @@ class CreateClientAction(Action):
         :param keycloak_client: The client to use when interacting with Keycloak
         """
 
-        print('==== Deleting client "{0}" protocol mapper "{1}".'.format(self.client_id, mapper_name))
+        logger.debug('Deleting client "%s" protocol mapper "%s".', self.client_id, mapper_name)
         path = '/admin/realms/{0}/clients/{1}/protocol-mappers/models/{2}'.format(
                 urllib.parse.quote(self.realm_name),
                 urllib.parse.quote(client_uuid),
@@ -233,20 +338,25 @@ class CreateClientAction(Action):
 
         raise InvalidUserResponse('Unexpected user get response ({0})'.format(get_response.status_code))
 
-    def process_service_account_roles(self, client_uuid, service_account_roles, keycloak_client):
+    def process_service_account_roles(self, client_uuid, service_account_roles, service_account_client_roles, keycloak_client):
         """
         Process the service account roles for the client.
         :param client_uuid: The client UUID
-        :param service_account_roles: The roles to assign to the service account
+        :param service_account_roles: The realm roles to assign to the service account
+        :param service_account_client_roles: The client roles to assign to the service account, by client ID
         :param keycloak_client: The client to use when interacting with Keycloak
         """
 
-        print('==== Processing client "{0}" service account roles...'.format(self.client_id))
+        logger.debug('Processing client "%s" service account roles...', self.client_id)
         user_config = self.get_service_account_user(client_uuid, keycloak_client)
-        if not user_config and len(service_account_roles) > 0:
+        if not user_config and (len(service_account_roles) > 0 or len(service_account_client_roles) > 0):
             raise ActionExecutionException('No service account user found for client "{0}"'.format(self.client_id))
+        if not user_config:
+            return
 
         user_id = user_config['id']
-        existing_roles = get_user_roles(self.realm_name, user_id, keycloak_client)
-        process_user_roles(self.realm_name, user_id, existing_roles, service_account_roles, keycloak_client)
-        print('==== Processed client "{0}" service account roles.'.format(self.client_id))
+        existing_mappings = get_user_role_mappings(self.realm_name, user_id, keycloak_client)
+        process_user_role_mappings(
+                self.realm_name, user_id, existing_mappings, service_account_roles, service_account_client_roles, keycloak_client
+        )
+        logger.debug('Processed client "%s" service account roles.', self.client_id)
@@ -0,0 +1,414 @@
+"""
+Group creation action.
+~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+from ..cache import GROUPS
+from ..cache import USERS
+from ..keycloak_client import UnexpectedResponseException
+from .action import Action
+from .action import ActionExecutionException
+from .action import InvalidActionConfigurationException
+from .utils import get_created_id
+from .utils import prefetch_role_catalogs
+from .utils import referenced_roles
+from .utils import RESERVED_ROLES
+from .utils import role_names_to_roles
+
+import json
+import logging
+import os
+import requests
+import urllib
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_PAGE_SIZE = 100
+
+
+class GroupConfig(object):
+    """
+    The configuration of a group, and of its subgroups.
+    """
+
+    __slots__ = ['group_data', 'group_name', 'role_names', 'members', 'members_file_path', 'sub_groups']
+
+    def __init__(self, action_name, config_file_dir, group_config_json):
+        """
+        Constructor.
+        :param action_name: The action name, for error messages.
+        :param config_file_dir: The directory containing the configuration file.
+        :param group_config_json: The JSON configuration of the group.
+        """
+
+        if 'group' not in group_config_json:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "group"'.format(action_name))
+
+        self.group_data = dict(group_config_json['group'])
+        # Subgroups are configured separately, with their own roles and members.
+        self.group_data.pop('subGroups', None)
+        self.group_name = self.group_data.get('name', None)
+
+        if not self.group_name:
+            raise InvalidActionConfigurationException('Group configuration for "{0}" missing property "name"'.format(action_name))
+
+        self.role_names = group_config_json.get('roles', None)
+
+        # Membership is only reconciled when members are configured, inline or in a file.
+        self.members = None
+        if 'members' in group_config_json:
+            self.members = list(group_config_json['members'])
+        self.members_file_path = None
+        if 'membersFile' in group_config_json:
+            self.members_file_path = os.path.join(config_file_dir, group_config_json['membersFile'])
+            if not os.path.isfile(self.members_file_path):
+                raise InvalidActionConfigurationException('Configuration "{0}" members file not found: {1}'.format(
+                        action_name, self.members_file_path
+                ))
+
+        self.sub_groups = [
+            GroupConfig(action_name, config_file_dir, sub_group_config_json)
+            for sub_group_config_json in group_config_json.get('subGroups', [])
+        ]
+
+    @staticmethod
+    def referenced_files(config_file_dir, group_config_json):
+        files = []
+        if 'membersFile' in group_config_json:
+            files.append(os.path.join(config_file_dir, group_config_json['membersFile']))
+        for sub_group_config_json in group_config_json.get('subGroups', []):
+            files.extend(GroupConfig.referenced_files(config_file_dir, sub_group_config_json))
+        return files
+
+    def declared_resources(self, realm_name):
+        """
+        Returns the roles and members of the group and of its subgroups.
+        :param realm_name: The realm of the group.
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        resources = referenced_roles(realm_name, self.role_names, {})
+        resources.extend((realm_name, USERS, email) for email in self.load_members())
+        for sub_group in self.sub_groups:
+            resources.extend(sub_group.declared_resources(realm_name))
+        return resources
+
+    def manages_members(self):
+        return self.members is not None or self.members_file_path is not None
+
+    def load_members(self):
+        """
+        Get the configured member emails: the inline members, and those of the members file, which is either a JSON list
+        or a text file with one email per line.
+        :return: The set of member emails, lower-cased.
+        """
+
+        emails = list(self.members or [])
+        if self.members_file_path:
+            with open(self.members_file_path, 'r') as f:
+                if self.members_file_path.endswith('.json'):
+                    emails.extend(json.load(f))
+                else:
+                    for line in f:
+                        email = line.split('#', 1)[0].strip()
+                        if email:
+                            emails.append(email)
+        return set(email.lower() for email in emails)
+
+
+class CreateGroupAction(Action):
+    __slots__ = ['realm_name', 'group_config', 'membership_concurrency']
+
+    @staticmethod
+    def valid_deploy_env(deploy_env):
+        """
+        Returns True if the provided deployment environment is valid for this action, False otherwise
+        :param deploy_env: The target deployment environment.
+        :return: True always, as this action is valid for all environments.
+        """
+
+        return True
+
+    @staticmethod
+    def referenced_files(config_file_dir, action_config_json):
+        """
+        Returns the files, besides the configuration file, that the action reads its configuration from.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The list of file paths.
+        """
+
+        return GroupConfig.referenced_files(config_file_dir, action_config_json)
+
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the roles and members of the group and of its subgroups.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        try:
+            group_config = GroupConfig(action_config_json.get('name', None), config_file_dir, action_config_json)
+        except InvalidActionConfigurationException:
+            return []
+        return group_config.declared_resources(action_config_json.get('realmName', None))
+
+    def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
+        """
+        Constructor.
+        :param name: The action name.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for this action
+        """
+
+        super(CreateGroupAction, self).__init__(name, *args, **kwargs)
+
+        if 'realmName' not in action_config_json:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
+
+        self.realm_name = action_config_json['realmName']
+        self.group_config = GroupConfig(name, config_file_dir, action_config_json)
+        self.membership_concurrency = self.read_concurrency(action_config_json, 'membershipConcurrency')
+        self.read_upsert_strategy(action_config_json)
+
+    def prefetch(self, keycloak_client):
+        """
+        Look up the group and its roles ahead of the execution.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        self.get_group('/{0}'.format(self.group_config.group_name), None, keycloak_client)
+        prefetch_role_catalogs(self.realm_name, self.group_config.role_names, {}, keycloak_client)
+
+    def execute(self, keycloak_client):
+        """
+        Execute this action. In this case, attempt to create or update a group, its subgroups, their realm roles and
+        their members.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        self.process_group(self.group_config, None, keycloak_client)
+
+    def process_group(self, group_config, parent_group, keycloak_client):
+        """
+        Create or update a group, then its subgroups.
+        :param group_config: The group configuration.
+        :param parent_group: The parent group representation, or None for a top-level group.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        logger.debug('Creating group "%s" in realm "%s"...', group_config.group_name, self.realm_name)
+        group_path = '{0}/{1}'.format(parent_group['path'] if parent_group else '', group_config.group_name)
+        if parent_group:
+            group_creation_path = '/admin/realms/{0}/groups/{1}/children'.format(
+                    urllib.parse.quote(self.realm_name), parent_group['id']
+            )
+        else:
+            group_creation_path = '/admin/realms/{0}/groups'.format(urllib.parse.quote(self.realm_name))
+        existing_group_data, create_response = self.look_up_or_create(
+                self.realm_name,
+                keycloak_client.cache.realm(self.realm_name).contains(GROUPS, group_path),
+                lambda: self.get_group(group_path, parent_group, keycloak_client),
+                lambda: keycloak_client.post(group_creation_path, json=group_config.group_data)
+        )
+
+        if not existing_group_data:
+            if create_response.status_code != requests.codes.created:
+                raise ActionExecutionException('Unexpected response for group creation request ({0})'.format(create_response.status_code))
+
+            group_id = get_created_id(create_response)
+            if group_id:
+                group_data = dict(group_config.group_data, id=group_id, path=group_path)
+            else:
+                group_data = self.get_group(group_path, parent_group, keycloak_client)
+            if not group_data:
+                raise ActionExecutionException('Created group "{0}" not found'.format(group_config.group_name))
+            logger.debug('Group "%s" created.', group_config.group_name)
+            existing_role_names = []
+            existing_member_ids = {}
+        else:
+            logger.debug('Group "%s" exists, updating...', group_config.group_name)
+            group_data = existing_group_data
+            group_update_path = '/admin/realms/{0}/groups/{1}'.format(urllib.parse.quote(self.realm_name), group_data['id'])
+            update_response = keycloak_client.put(group_update_path, json=group_config.group_data)
+            if update_response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for group update request ({0})'.format(update_response.status_code))
+            logger.debug('Group "%s" updated.', group_config.group_name)
+            existing_role_names = None
+            existing_member_ids = None
+
+        if group_config.role_names is not None:
+            self.process_group_roles(group_data['id'], existing_role_names, group_config.role_names, keycloak_client)
+
+        if group_config.manages_members():
+            if existing_member_ids is None:
+                existing_member_ids = self.get_group_member_ids(group_data['id'], keycloak_client)
+            self.process_group_members(group_data, existing_member_ids, group_config.load_members(), keycloak_client)
+
+        for sub_group_config in group_config.sub_groups:
+            self.process_group(sub_group_config, group_data, keycloak_client)
+
+    def get_group(self, group_path, parent_group, keycloak_client):
+        """
+        Get a group by path, listing the top-level groups of the realm, or the subgroups of the parent group, at once.
+        :param group_path: The group path, such as "/parent/child".
+        :param parent_group: The parent group representation, or None for a top-level group.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The group representation, or None if the group does not exist.
+        """
+
+        realm_cache = keycloak_client.cache.realm(self.realm_name)
+        if realm_cache.contains(GROUPS, group_path):
+            return realm_cache.get(GROUPS, group_path)
+
+        generation = realm_cache.current_generation()
+        if parent_group:
+            groups = self.get_sub_groups(parent_group, keycloak_client)
+        else:
+            groups_path = '/admin/realms/{0}/groups'.format(urllib.parse.quote(self.realm_name))
+            try:
+                groups = list(keycloak_client.paginate(groups_path, {'briefRepresentation': 'false'}))
+            except UnexpectedResponseException as e:
+                raise ActionExecutionException('Unexpected response from group listing request ({0})'.format(e.status_code))
+
+        # The listing contains the sibling groups as well, so keep all of them.
+        found_group_data = None
+        for group_data in groups:
+            realm_cache.put(GROUPS, group_data['path'], group_data, generation)
+            if group_data['path'] == group_path:
+                found_group_data = group_data
+
+        if not found_group_data:
+            realm_cache.put(GROUPS, group_path, None, generation)
+        return found_group_data
+
+    def get_sub_groups(self, parent_group, keycloak_client):
+        """
+        List the subgroups of a group. Recent versions of Keycloak only list them through the children endpoint.
+        :param parent_group: The parent group representation.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The subgroup representations.
+        """
+
+        children_path = '/admin/realms/{0}/groups/{1}/children'.format(urllib.parse.quote(self.realm_name), parent_group['id'])
+        try:
+            return list(keycloak_client.paginate(children_path, {'briefRepresentation': 'false'}))
+        except UnexpectedResponseException as e:
+            if e.status_code not in (requests.codes.not_found, requests.codes.method_not_allowed):
+                raise ActionExecutionException('Unexpected response from subgroup listing request ({0})'.format(e.status_code))
+
+        group_path = '/admin/realms/{0}/groups/{1}'.format(urllib.parse.quote(self.realm_name), parent_group['id'])
+        get_response = keycloak_client.get(group_path)
+        if get_response.status_code != requests.codes.ok:
+            raise ActionExecutionException('Unexpected response from group get request ({0})'.format(get_response.status_code))
+        return get_response.json().get('subGroups', [])
+
+    def process_group_roles(self, group_id, existing_role_names, new_role_names, keycloak_client):
+        """
+        Reconcile the realm roles of a group.
+        :param group_id: The group UUID.
+        :param existing_role_names: The current role names of the group, or None to look them up.
+        :param new_role_names: The configured role names.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        mappings_path = '/admin/realms/{0}/groups/{1}/role-mappings/realm'.format(urllib.parse.quote(self.realm_name), group_id)
+        existing_roles = []
+        if existing_role_names is None:
+            get_response = keycloak_client.get(mappings_path)
+            if get_response.status_code != requests.codes.ok:
+                raise ActionExecutionException('Unexpected response for group role get request ({0})'.format(get_response.status_code))
+            existing_roles = get_response.json()
+            existing_role_names = [existing_role['name'] for existing_role in existing_roles]
+
+        add_role_names = [role_name for role_name in new_role_names if role_name not in existing_role_names]
+        if add_role_names:
+            add_roles = role_names_to_roles(self.realm_name, add_role_names, keycloak_client)
+            add_response = keycloak_client.post(mappings_path, json=add_roles)
+            if add_response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for group role update request ({0})'.format(add_response.status_code))
+
+        delete_roles = [
+            existing_role for existing_role in existing_roles
+            if existing_role['name'] not in new_role_names and existing_role['name'] not in RESERVED_ROLES
+        ]
+        if delete_roles:
+            delete_response = keycloak_client.delete(mappings_path, json=delete_roles)
+            if delete_response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for group role deletion request ({0})'.format(delete_response.status_code))
+
+    def get_group_member_ids(self, group_id, keycloak_client):
+        """
+        List the current members of a group, page by page.
+        :param group_id: The group UUID.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The member UUIDs, by lower-cased email (or by UUID, for members without an email).
+        """
+
+        members_path = '/admin/realms/{0}/groups/{1}/members'.format(urllib.parse.quote(self.realm_name), group_id)
+        member_ids = {}
+        try:
+            members = keycloak_client.paginate(members_path, {'briefRepresentation': 'true'}, MEMBERS_PAGE_SIZE, prefetch=1, stream=True)
+            for member in members:
+                member_ids[(member.get('email') or member['id']).lower()] = member['id']
+        except UnexpectedResponseException as e:
+            raise ActionExecutionException('Unexpected response for group member listing request ({0})'.format(e.status_code))
+        return member_ids
+
+    def process_group_members(self, group_data, existing_member_ids, emails, keycloak_client):
+        """
+        Reconcile the members of a group: only the missing members are added, and the extra members removed.
+        :param group_data: The group representation.
+        :param existing_member_ids: The current member UUIDs, by lower-cased email.
+        :param emails: The configured member emails, lower-cased.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        add_emails = sorted(email for email in emails if email not in existing_member_ids)
+        remove_ids = [member_id for key, member_id in sorted(existing_member_ids.items()) if key not in emails]
+
+        add_ids = keycloak_client.run_concurrently(
+                lambda email: self.get_user_id(email, keycloak_client), add_emails, self.membership_concurrency
+        )
+        unknown_emails = [email for email, user_id in zip(add_emails, add_ids) if not user_id]
+        if unknown_emails:
+            raise ActionExecutionException('Unknown members of group "{0}": {1}'.format(group_data['name'], ', '.join(unknown_emails)))
+
+        def update_membership(change):
+            method, user_id = change
+            membership_path = '/admin/realms/{0}/users/{1}/groups/{2}'.format(
+                    urllib.parse.quote(self.realm_name), user_id, group_data['id']
+            )
+            response = keycloak_client.put(membership_path) if method == 'put' else keycloak_client.delete(membership_path)
+            if response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for group membership request ({0})'.format(response.status_code))
+
+        changes = [('put', user_id) for user_id in add_ids] + [('delete', user_id) for user_id in remove_ids]
+        keycloak_client.run_concurrently(update_membership, changes, self.membership_concurrency)
+        logger.debug('Group "%s": %s member(s) added, %s removed.', group_data['name'], len(add_ids), len(remove_ids))
+
+    def get_user_id(self, email, keycloak_client):
+        """
+        Get the UUID of a user by email.
+        :param email: The lower-cased email.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The user UUID, or None if there is no such user.
+        """
+
+        realm_cache = keycloak_client.cache.realm(self.realm_name)
+        user_data = realm_cache.get(USERS, email)
+        if user_data:
+            return user_data['id']
+
+        users_path = '/admin/realms/{0}/users'.format(urllib.parse.quote(self.realm_name))
+        query_response = keycloak_client.get(users_path, {'email': email, 'exact': 'true', 'briefRepresentation': 'true'})
+        if query_response.status_code != requests.codes.ok:
+            raise ActionExecutionException('Unexpected response for user lookup request ({0})'.format(query_response.status_code))
+
+        for user_data in query_response.json():
+            # Without exact matching (before Keycloak 12), the email is matched as a substring.
+            if (user_data.get('email') or '').lower() == email:
+                return user_data['id']
+        return None
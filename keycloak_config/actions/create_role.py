@@ -3,16 +3,29 @@ Role creation action.
 ~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+from ..cache import CLIENTS
+from ..cache import ROLES
+from ..partial_import import REALM_ROLE
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
+from .utils import CATALOG
+from .utils import composites_to_roles
 from .utils import get_role_by_name
+from .utils import referenced_roles
 
+import functools
+import logging
 import requests
 import urllib
 
+logger = logging.getLogger(__name__)
+
 
 class CreateRoleAction(Action):
+    __slots__ = ['realm_name', 'role_data', 'role_name', 'client_id', 'composites']
+
+    COALESCIBLE = True
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -24,6 +37,25 @@ class CreateRoleAction(Action):
 
         return True
 
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the role, or its client, and its composites.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        realm_name = action_config_json.get('realmName', None)
+        role_data = action_config_json.get('role', None) or {}
+        composites = role_data.get('composites', None) or {}
+        resources = referenced_roles(realm_name, composites.get('realm', []), composites.get('client', {}))
+        if action_config_json.get('clientId', None):
+            resources.append((realm_name, CLIENTS, action_config_json['clientId']))
+        elif role_data.get('name', None):
+            resources.append((realm_name, ROLES, role_data['name']))
+        return resources
+
     def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
         """
         Constructor.
@@ -33,7 +65,6 @@ class CreateRoleAction(Action):
         """
 
         super(CreateRoleAction, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'realmName' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
@@ -43,12 +74,52 @@ class CreateRoleAction(Action):
         if 'role' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "role"'.format(name))
 
-        self.role_data = action_config_json['role']
+        self.role_data = dict(action_config_json['role'])
         self.role_name = self.role_data.get('name', None)
 
         if not self.role_name:
             raise InvalidActionConfigurationException('Role configuration for "{0}" missing property "name"'.format(name))
 
+        # The role is a client role if a client is set, and a realm role otherwise.
+        self.client_id = action_config_json.get('clientId', None)
+
+        # Keycloak does not process composites in role creation and update requests, they are updated separately.
+        self.composites = self.role_data.pop('composites', None)
+        if self.composites is not None:
+            self.role_data['composite'] = bool(self.composites.get('realm') or self.composites.get('client'))
+
+        self.read_upsert_strategy(action_config_json)
+
+    def partial_import(self):
+        """
+        Describe the role to create, so that the action can be coalesced into a partial import.
+        :return: A (realm name, resource type, resource name, representation) tuple, or None for client and composite
+        roles.
+        """
+
+        if self.client_id or self.composites is not None:
+            return None
+        return self.realm_name, REALM_ROLE, self.role_name, self.fingerprinted_role_data()
+
+    def fingerprinted_role_data(self):
+        """
+        Add the fingerprint of the configured role and composites to the role data.
+        :return: A copy of the role data, with the fingerprint attribute.
+        """
+
+        return self.add_fingerprint(self.role_data, {'role': self.role_data, 'clientId': self.client_id, 'composites': self.composites})
+
+    def prefetch(self, keycloak_client):
+        """
+        Look up the role, or its client, ahead of the execution.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        if self.client_id:
+            self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
+        else:
+            get_role_by_name(self.realm_name, self.role_name, keycloak_client)
+
     def execute(self, keycloak_client):
         """
         Execute this action. In this case, attempt to create a role.
@@ -56,25 +127,106 @@ class CreateRoleAction(Action):
         """
 
         # Process the role data.
-        print('==== Creating role "{0}" in realm "{1}"...'.format(self.role_name, self.realm_name))
-        existing_role_data = get_role_by_name(self.realm_name, self.role_name, keycloak_client)
+        logger.debug('Creating role "%s" in realm "%s"...', self.role_name, self.realm_name)
+        if self.client_id:
+            client_data = self.get_client_by_client_id(self.realm_name, self.client_id, keycloak_client)
+            if not client_data:
+                raise ActionExecutionException('Client "{0}" of role "{1}" not found'.format(self.client_id, self.role_name))
+            roles_path = '/admin/realms/{0}/clients/{1}/roles'.format(
+                    urllib.parse.quote(self.realm_name),
+                    urllib.parse.quote(client_data['id'])
+            )
+            role_path = '{0}/{1}'.format(roles_path, urllib.parse.quote(self.role_name))
+            cached = False
+            look_up = functools.partial(self.get_role, role_path, keycloak_client)
+        else:
+            roles_path = '/admin/realms/{0}/roles'.format(urllib.parse.quote(self.realm_name))
+            role_path = '{0}/{1}'.format(roles_path, urllib.parse.quote(self.role_name))
+            realm_cache = keycloak_client.cache.realm(self.realm_name)
+            cached = realm_cache.contains(ROLES, self.role_name) or realm_cache.contains(ROLES, CATALOG)
+            look_up = functools.partial(get_role_by_name, self.realm_name, self.role_name, keycloak_client)
+
+        role_data = self.fingerprinted_role_data()
+        # Composites are updated with separate requests, so the fingerprint is only written once they succeeded.
+        request_data = role_data if self.composites is None else self.add_pending_fingerprint(self.role_data)
+        existing_role_data, create_response = self.look_up_or_create(
+                self.realm_name, cached, look_up, lambda: keycloak_client.post(roles_path, json=request_data)
+        )
+        if self.is_unchanged(existing_role_data, role_data):
+            logger.debug('Role "%s" is unchanged.', self.role_name)
+            return
 
         if not existing_role_data:
-            print('==== Role "{0}" does not exist, creating...'.format(self.role_name))
-            role_creation_path = '/admin/realms/{0}/roles'.format(urllib.parse.quote(self.realm_name))
-            create_response = keycloak_client.post(role_creation_path, json=self.role_data)
             if create_response.status_code == requests.codes.created:
-                print('==== Role "{0}" created.'.format(self.role_name))
+                logger.debug('Role "%s" created.', self.role_name)
             else:
                 raise ActionExecutionException('Unexpected response for role creation request ({0})'.format(create_response.status_code))
         else:
-            print('==== Role "{0}" exists, updating...'.format(self.role_name))
-            role_update_path = '/admin/realms/{0}/roles/{1}'.format(
-                    urllib.parse.quote(self.realm_name),
-                    urllib.parse.quote(self.role_name)
-            )
-            update_response = keycloak_client.put(role_update_path, json=self.role_data)
+            logger.debug('Role "%s" exists, updating...', self.role_name)
+            update_response = keycloak_client.put(role_path, json=request_data)
             if update_response.status_code == requests.codes.no_content:
-                print('==== Role "{0}" updated.'.format(self.role_name))
+                logger.debug('Role "%s" updated.', self.role_name)
             else:
                 raise ActionExecutionException('Unexpected response for role update request ({0})'.format(update_response.status_code))
+
+        if self.composites is not None:
+            # The creation response only locates the role by name, and composites are managed by role UUID.
+            role_id = existing_role_data['id'] if existing_role_data else (self.get_role(role_path, keycloak_client) or {}).get('id')
+            if not role_id:
+                raise ActionExecutionException('Created role "{0}" not found'.format(self.role_name))
+            self.process_composites(role_id, existing_role_data is None, keycloak_client)
+            self.write_fingerprint(role_path, role_data, keycloak_client)
+
+    @staticmethod
+    def get_role(role_path, keycloak_client):
+        """
+        Get a realm or client role, without caching it.
+        :param role_path: The path of the role.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The role representation, or None if the role does not exist.
+        """
+
+        get_response = keycloak_client.get(role_path)
+        if get_response.status_code == requests.codes.ok:
+            return get_response.json()
+        if get_response.status_code == requests.codes.not_found:
+            return None
+        raise ActionExecutionException('Unexpected response for role get request ({0})'.format(get_response.status_code))
+
+    def process_composites(self, role_id, created, keycloak_client):
+        """
+        Update the composites of the role, with at most one addition and one removal request.
+        :param role_id: The role UUID.
+        :param created: True if the role was just created, and has no composites yet.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        logger.debug('Processing role "%s" composites...', self.role_name)
+        composites_path = '/admin/realms/{0}/roles-by-id/{1}/composites'.format(
+                urllib.parse.quote(self.realm_name),
+                urllib.parse.quote(role_id)
+        )
+
+        existing_composites = []
+        if not created:
+            get_response = keycloak_client.get(composites_path)
+            if get_response.status_code != requests.codes.ok:
+                raise ActionExecutionException('Unexpected response for role composites request ({0})'.format(get_response.status_code))
+            existing_composites = get_response.json()
+
+        new_composites = composites_to_roles(self.realm_name, self.composites, keycloak_client)
+        existing_ids = set(role['id'] for role in existing_composites)
+        new_ids = set(role['id'] for role in new_composites)
+
+        add_composites = [role for role in new_composites if role['id'] not in existing_ids]
+        if add_composites:
+            add_response = keycloak_client.post(composites_path, json=add_composites)
+            if add_response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for role composites update request ({0})'.format(add_response.status_code))
+
+        delete_composites = [role for role in existing_composites if role['id'] not in new_ids]
+        if delete_composites:
+            delete_response = keycloak_client.delete(composites_path, json=delete_composites)
+            if delete_response.status_code != requests.codes.no_content:
+                raise ActionExecutionException('Unexpected response for role composites deletion request ({0})'.format(delete_response.status_code))
+        logger.debug('Processed role "%s" composites.', self.role_name)
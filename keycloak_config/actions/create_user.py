@@ -3,18 +3,29 @@ User creation action.
 ~~~~~~~~~~~~~~~~~~~~~
 """
 
+from ..cache import USERS
+from ..partial_import import USER
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
+from .utils import get_created_id
 from .utils import get_user_by_email
-from .utils import get_user_roles
-from .utils import process_user_roles
+from .utils import get_user_role_mappings
+from .utils import prefetch_role_catalogs
+from .utils import process_user_role_mappings
+from .utils import referenced_roles
 
+import logging
 import requests
 import urllib
 
+logger = logging.getLogger(__name__)
+
 
 class CreateUserAction(Action):
+    __slots__ = ['realm_name', 'user_data', 'email', 'password', 'roles', 'client_roles']
+
+    COALESCIBLE = True
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -26,6 +37,23 @@ class CreateUserAction(Action):
 
         return True
 
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the user and its roles.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        realm_name = action_config_json.get('realmName', None)
+        email = (action_config_json.get('user', None) or {}).get('email', None)
+        resources = referenced_roles(realm_name, action_config_json.get('roles', []), action_config_json.get('clientRoles', {}))
+        if email:
+            # The username is the email, which Keycloak stores in lower case.
+            resources.append((realm_name, USERS, email.lower()))
+        return resources
+
     def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
         """
         Constructor.
@@ -35,7 +63,6 @@ class CreateUserAction(Action):
         """
 
         super(CreateUserAction, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'realmName' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
@@ -56,6 +83,43 @@ class CreateUserAction(Action):
 
         self.password = action_config_json.get('password', None)
         self.roles = action_config_json.get('roles', [])
+        self.client_roles = action_config_json.get('clientRoles', {})
+        self.read_upsert_strategy(action_config_json)
+
+    def partial_import(self):
+        """
+        Describe the user to create, so that the action can be coalesced into a partial import.
+        :return: A (realm name, resource type, resource name, representation) tuple, or None if a password is set.
+        """
+
+        if self.password:
+            # Passwords are set with a separate request.
+            return None
+
+        representation = self.fingerprinted_user_data()
+        representation['realmRoles'] = self.roles
+        if self.client_roles:
+            representation['clientRoles'] = self.client_roles
+        # Keycloak stores usernames in lower case.
+        return self.realm_name, USER, self.email.lower(), representation
+
+    def fingerprinted_user_data(self):
+        """
+        Add the fingerprint of the configured user and roles to the user data. The password is not part of it, as the
+        fingerprint can be read by any administrator, so the password is always set.
+        :return: A copy of the user data, with the fingerprint attribute.
+        """
+
+        return self.add_fingerprint(self.user_data, {'user': self.user_data, 'roles': self.roles, 'clientRoles': self.client_roles})
+
+    def prefetch(self, keycloak_client):
+        """
+        Look up the user and the roles to map to it ahead of the execution.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        get_user_by_email(self.realm_name, self.email, keycloak_client)
+        prefetch_role_catalogs(self.realm_name, self.roles, self.client_roles, keycloak_client)
 
     def execute(self, keycloak_client):
         """
@@ -64,39 +128,69 @@ class CreateUserAction(Action):
         """
 
         # Process the user data.
-        print('==== Creating user "{0}" in realm "{1}"...'.format(self.email, self.realm_name))
-        existing_user_data = get_user_by_email(self.realm_name, self.email, keycloak_client)
+        logger.debug('Creating user "%s" in realm "%s"...', self.email, self.realm_name)
+        user_data = self.fingerprinted_user_data()
+        # The roles are mapped with separate requests, so the fingerprint is only written once they succeeded.
+        request_data = self.add_pending_fingerprint(self.user_data)
+        user_creation_path = '/admin/realms/{0}/users'.format(urllib.parse.quote(self.realm_name))
+        existing_user_data, create_response = self.look_up_or_create(
+                self.realm_name,
+                keycloak_client.cache.realm(self.realm_name).contains(USERS, self.email),
+                lambda: get_user_by_email(self.realm_name, self.email, keycloak_client),
+                lambda: keycloak_client.post(user_creation_path, json=request_data)
+        )
+
+        if self.is_unchanged(existing_user_data, user_data):
+            logger.debug('User "%s" is unchanged.', self.email)
+            self.update_password(existing_user_data['id'], keycloak_client)
+            return
 
         if not existing_user_data:
-            print('==== User "{0}" does not exist, creating...'.format(self.email))
-            user_creation_path = '/admin/realms/{0}/users'.format(urllib.parse.quote(self.realm_name))
-            create_response = keycloak_client.post(user_creation_path, json=self.user_data)
             if create_response.status_code == requests.codes.created:
-                print('==== User "{0}" created.'.format(self.email))
-                existing_user_data = get_user_by_email(self.realm_name, self.email, keycloak_client)
+                logger.debug('User "%s" created.', self.email)
+                user_uuid = get_created_id(create_response)
+                if user_uuid:
+                    existing_user_data = dict(request_data)
+                    existing_user_data['id'] = user_uuid
+                    keycloak_client.cache.realm(self.realm_name).put(USERS, self.email, existing_user_data)
+                else:
+                    existing_user_data = get_user_by_email(self.realm_name, self.email, keycloak_client)
             else:
                 raise ActionExecutionException('Unexpected response for user creation request ({0})'.format(create_response.status_code))
         else:
-            print('==== User "{0}" exists, updating...'.format(self.email))
+            logger.debug('User "%s" exists, updating...', self.email)
             user_update_path = '/admin/realms/{0}/users/{1}'.format(
                     urllib.parse.quote(self.realm_name),
                     urllib.parse.quote(existing_user_data['id'])
             )
-            update_response = keycloak_client.put(user_update_path, json=self.user_data)
+            update_response = keycloak_client.put(user_update_path, json=request_data)
             if update_response.status_code == requests.codes.no_content:
-                print('==== User "{0}" updated.'.format(self.email))
+                logger.debug('User "%s" updated.', self.email)
             else:
                 raise ActionExecutionException('Unexpected response for user update request ({0})'.format(update_response.status_code))
 
         user_uuid = existing_user_data['id']
 
-        print('==== Processing user "{0}" roles...'.format(self.email))
-        existing_roles = get_user_roles(self.realm_name, user_uuid, keycloak_client)
-        process_user_roles(self.realm_name, user_uuid, existing_roles, self.roles, keycloak_client)
-        print('==== Processed user "{0}" roles.'.format(self.email))
+        logger.debug('Processing user "%s" roles...', self.email)
+        existing_mappings = get_user_role_mappings(self.realm_name, user_uuid, keycloak_client)
+        process_user_role_mappings(self.realm_name, user_uuid, existing_mappings, self.roles, self.client_roles, keycloak_client)
+        logger.debug('Processed user "%s" roles.', self.email)
+
+        self.write_fingerprint('/admin/realms/{0}/users/{1}'.format(
+                urllib.parse.quote(self.realm_name), urllib.parse.quote(user_uuid)
+        ), user_data, keycloak_client)
+
+        self.update_password(user_uuid, keycloak_client)
+
+    def update_password(self, user_uuid, keycloak_client):
+        """
+        Set the password of the user, if one is configured.
+        :param user_uuid: The UUID of the user
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
 
         if self.password:
-            print('==== Updating password for user "{0}"...'.format(self.email))
+            logger.debug('Updating password for user "%s"...', self.email)
             password_payload = {
                 'value': self.password,
                 'type': 'password',
@@ -105,6 +199,6 @@ class CreateUserAction(Action):
             password_path = '/admin/realms/{0}/users/{1}/reset-password'.format(self.realm_name, user_uuid)
             password_response = keycloak_client.put(password_path, json=password_payload)
             if password_response.status_code == requests.codes.no_content:
-                print('==== User "{0}" password updated.'.format(self.email))
+                logger.debug('User "%s" password updated.', self.email)
             else:
                 raise ActionExecutionException('Unexpected response for user password request ({0})'.format(password_response.status_code))
@@ -1,17 +1,146 @@
 """
 Custom module action.
 ~~~~~~~~~~~~~~~~~~~~~
+
+Custom action files contain a `CustomAction` class. Two versions of the contract are supported, selected by the
+`API_VERSION` class attribute:
+
+* Version 1 (the default): `CustomAction(name, config_file_dir, action_config_json, invalid_configuration_exception)`
+  and `execute(keycloak_client, action_execution_exception)`.
+* Version 2: `CustomAction(name, config_file_dir, action_config_json, context)`, and either `execute(context)` or the
+  coroutine `execute_async(context)`, where `context` is a CustomActionContext.
 """
 
+from ..keycloak_client import UnexpectedResponseException
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
 
-import importlib.machinery
+import asyncio
+import hashlib
+import importlib.util
+import logging
 import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_API_VERSIONS = (1, 2)
+
+# Loaded custom modules, by absolute file path, along with the modification time and size of the file when loaded.
+_module_cache = {}
+_module_cache_lock = threading.Lock()
+
+
+def load_custom_module(file_path):
+    """
+    Load a custom action file as a module. Modules are cached, and only loaded again when their file changes.
+    :param file_path: The path of the custom action file.
+    :return: The module.
+    """
+
+    file_path = os.path.abspath(file_path)
+    file_stat = os.stat(file_path)
+    version = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    with _module_cache_lock:
+        cached = _module_cache.get(file_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        module_name = 'keycloak_config_custom_{0}'.format(hashlib.sha1(file_path.encode('utf-8')).hexdigest()[:16])
+        spec = importlib.util.spec_from_file_location(module_name, file_path)
+        module = importlib.util.module_from_spec(spec)
+        # Registered before executing the module, as the import system does, so that the module can refer to itself.
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+
+        _module_cache[file_path] = (version, module)
+        return module
+
+
+class CustomActionContext(object):
+    """
+    The facilities of the tool shared with version 2 custom actions. The Keycloak client, its caches and its worker pool
+    are only available once the action is executed.
+    """
+
+    API_VERSION = 2
+
+    InvalidActionConfigurationException = InvalidActionConfigurationException
+    ActionExecutionException = ActionExecutionException
+    UnexpectedResponseException = UnexpectedResponseException
+
+    __slots__ = ['name', 'config_file_dir', 'json_loader', 'logger', 'keycloak_client']
+
+    def __init__(self, name, config_file_dir, json_loader=None):
+        """
+        Constructor.
+        :param name: The action name.
+        :param config_file_dir: The directory containing the configuration file.
+        :param json_loader: The object used to load JSON files, decrypting their encrypted values.
+        """
+
+        self.name = name
+        self.config_file_dir = config_file_dir
+        self.json_loader = json_loader
+        self.logger = logger.getChild(name)
+        self.keycloak_client = None
+
+    @property
+    def cache(self):
+        return self.keycloak_client.cache
+
+    def realm_cache(self, realm_name):
+        """
+        Get the cache of the resources of a realm, shared with the other actions.
+        :param realm_name: The realm name.
+        :return: The realm cache.
+        """
+
+        return self.keycloak_client.cache.realm(realm_name)
+
+    def run_concurrently(self, func, items, max_concurrency=None):
+        """
+        Apply a function to every item using the worker pool of the Keycloak client (see KeycloakClient.run_concurrently).
+        :param func: The function to apply.
+        :param items: The items.
+        :param max_concurrency: The maximum number of concurrent calls, defaults to the size of the worker pool.
+        :return: The results, in the order of the items.
+        """
+
+        return self.keycloak_client.run_concurrently(func, items, max_concurrency)
+
+    def paginate(self, path, params=None, **kwargs):
+        """
+        Iterate over the items of a Keycloak list endpoint, page by page (see KeycloakClient.paginate).
+        :param path: The request path, relative to the base URL.
+        :param params: The other query parameters.
+        :param kwargs: The pagination options: page_size, prefetch and stream.
+        :return: A generator of the items.
+        """
+
+        return self.keycloak_client.paginate(path, params, **kwargs)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Call a blocking function, such as a request method of the Keycloak client, on the worker pool.
+        :param func: The function to call.
+        :param args: The positional arguments.
+        :param kwargs: The keyword arguments.
+        :return: The result of the call.
+        """
+
+        return await asyncio.wrap_future(self.keycloak_client.submit(func, *args, **kwargs))
 
 
 class CustomActionWrapper(Action):
+    __slots__ = ['custom_code_file_path', 'custom_action', 'api_version', 'context']
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -23,6 +152,19 @@ class CustomActionWrapper(Action):
 
         return deploy_env == 'local'
 
+    @staticmethod
+    def referenced_files(config_file_dir, action_config_json):
+        """
+        Returns the files, besides the configuration file, that the action reads its configuration from.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The list of file paths.
+        """
+
+        if 'file' not in action_config_json:
+            return []
+        return [os.path.join(config_file_dir, action_config_json['file'])]
+
     def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
         """
         Constructor.
@@ -32,15 +174,25 @@ class CustomActionWrapper(Action):
         """
 
         super(CustomActionWrapper, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'file' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "file"'.format(name))
 
         self.custom_code_file_path = os.path.join(config_file_dir, action_config_json['file'])
-        loader = importlib.machinery.SourceFileLoader(name, self.custom_code_file_path)
-        handle = loader.load_module(name)
-        self.custom_action = handle.CustomAction(name, config_file_dir, action_config_json, InvalidActionConfigurationException)
+        custom_action_class = load_custom_module(self.custom_code_file_path).CustomAction
+
+        self.api_version = getattr(custom_action_class, 'API_VERSION', 1)
+        if self.api_version not in SUPPORTED_API_VERSIONS:
+            raise InvalidActionConfigurationException('Unsupported custom action API version in "{0}": {1}'.format(
+                    self.custom_code_file_path, self.api_version
+            ))
+
+        if self.api_version == 1:
+            self.context = None
+            self.custom_action = custom_action_class(name, config_file_dir, action_config_json, InvalidActionConfigurationException)
+        else:
+            self.context = CustomActionContext(name, config_file_dir, kwargs.get('json_loader'))
+            self.custom_action = custom_action_class(name, config_file_dir, action_config_json, self.context)
 
     def execute(self, keycloak_client):
         """
@@ -48,6 +200,13 @@ class CustomActionWrapper(Action):
         :param keycloak_client: The client to use when interacting with Keycloak.
         """
 
-        print('==== Executing custom action "{0}"...'.format(self.name))
-        self.custom_action.execute(keycloak_client, ActionExecutionException)
-        print('==== Completed executing custom action "{0}".'.format(self.name))
+        logger.debug('Executing custom action "%s"...', self.name)
+        if self.api_version == 1:
+            self.custom_action.execute(keycloak_client, ActionExecutionException)
+        else:
+            self.context.keycloak_client = keycloak_client
+            if asyncio.iscoroutinefunction(getattr(self.custom_action, 'execute_async', None)):
+                asyncio.run(self.custom_action.execute_async(self.context))
+            else:
+                self.custom_action.execute(self.context)
+        logger.debug('Completed executing custom action "%s".', self.name)
@@ -6,12 +6,19 @@ Client deletion action.
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
+from .utils import DEFAULT_CLIENTS
 
+import collections
+import logging
+import re
 import requests
 import urllib
 
+logger = logging.getLogger(__name__)
+
 
 class DeleteClientAction(Action):
+    __slots__ = ['realm_name', 'clients_data', 'client_prefixes', 'client_patterns', 'concurrency']
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -32,39 +39,89 @@ class DeleteClientAction(Action):
         """
 
         super(DeleteClientAction, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'realmName' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
 
         self.realm_name = action_config_json['realmName']
 
-        if 'clients' not in action_config_json:
-            raise InvalidActionConfigurationException('Configuration "{0}" missing property "clients"'.format(name))
+        if 'clients' not in action_config_json and 'clientPatterns' not in action_config_json and \
+                'clientPrefixes' not in action_config_json:
+            raise InvalidActionConfigurationException(
+                    'Configuration "{0}" missing property "clients", "clientPatterns" or "clientPrefixes"'.format(name)
+            )
+
+        self.clients_data = action_config_json.get('clients', [])
+        self.client_prefixes = action_config_json.get('clientPrefixes', [])
+
+        try:
+            self.client_patterns = [re.compile(pattern) for pattern in action_config_json.get('clientPatterns', [])]
+        except re.error as err:
+            raise InvalidActionConfigurationException('Configuration "{0}" has an invalid client pattern: {1}'.format(name, err))
+
+        self.concurrency = self.read_concurrency(action_config_json)
+
+    def matches(self, client_id):
+        """
+        Returns True if the client ID matches one of the configured prefixes or patterns, False otherwise.
+        Keycloak's default clients are never matched.
+        :param client_id: The client ID.
+        """
+
+        if client_id in DEFAULT_CLIENTS:
+            return False
+
+        if any(client_id.startswith(prefix) for prefix in self.client_prefixes):
+            return True
 
-        self.clients_data = action_config_json['clients']
+        return any(pattern.fullmatch(client_id) for pattern in self.client_patterns)
 
     def execute(self, keycloak_client):
         """
-        Execute this action. In this case, attempt to delete a client.
+        Execute this action. In this case, attempt to delete clients.
+        The clients of the realm are listed once, and the matching clients are deleted concurrently.
         :param keycloak_client: The client to use when interacting with Keycloak
         """
 
-        # Process the client data.
+        logger.debug('Deleting clients in realm "%s"...', self.realm_name)
+        clients_by_client_id = {}
+        for client_data in self.get_clients(self.realm_name, keycloak_client):
+            clients_by_client_id[client_data['clientId']] = client_data
+
+        # The clients to delete, keyed by ID, in order.
+        targets = collections.OrderedDict()
         for client in self.clients_data:
-            print('==== Deleting client "{0}" in realm "{1}"...'.format(client, self.realm_name))
-            existing_client_data = self.get_client_by_client_id(self.realm_name, client, keycloak_client)
-            if not existing_client_data:
-                print('==== Client "{0}" does not exist, skip...'.format(client))
+            if client not in clients_by_client_id:
+                logger.debug('Client "%s" does not exist, skip...', client)
             else:
-                print('==== Client "{0}" exists, deleting...'.format(client))
-                client_uuid = existing_client_data['id']
-                client_delete_path = '/admin/realms/{0}/clients/{1}'.format(
-                        urllib.parse.quote(self.realm_name),
-                        urllib.parse.quote(client_uuid)
-                )
-                response = keycloak_client.delete(client_delete_path)
-                if response.status_code == requests.codes.no_content:
-                    print('==== Client "{0}" deleted.'.format(client))
-                else:
-                    raise ActionExecutionException('Unexpected response for client delete request ({0})'.format(response.status_code))
+                targets.setdefault(clients_by_client_id[client]['id'], clients_by_client_id[client])
+
+        for client_id, client_data in clients_by_client_id.items():
+            if self.matches(client_id):
+                targets.setdefault(client_data['id'], client_data)
+
+        keycloak_client.run_concurrently(
+                lambda client_data: self.delete_client(client_data, keycloak_client), list(targets.values()), self.concurrency
+        )
+        logger.debug('Deleted %s client(s) in realm "%s".', len(targets), self.realm_name)
+
+    def delete_client(self, client_data, keycloak_client):
+        """
+        Delete a client.
+        :param client_data: The client representation
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        client = client_data['clientId']
+        logger.debug('Client "%s" exists, deleting...', client)
+        client_delete_path = '/admin/realms/{0}/clients/{1}'.format(
+                urllib.parse.quote(self.realm_name),
+                urllib.parse.quote(client_data['id'])
+        )
+        response = keycloak_client.delete(client_delete_path)
+        if response.status_code == requests.codes.no_content:
+            logger.debug('Client "%s" deleted.', client)
+        elif response.status_code == requests.codes.not_found:
+            logger.debug('Client "%s" was already deleted.', client)
+        else:
+            raise ActionExecutionException('Unexpected response for client delete request ({0})'.format(response.status_code))
@@ -0,0 +1,12 @@
+"""
+Action exceptions.
+~~~~~~~~~~~~~~~~~~
+"""
+
+
+class InvalidActionConfigurationException(Exception):
+    pass
+
+
+class ActionExecutionException(Exception):
+    pass
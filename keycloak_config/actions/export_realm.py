@@ -0,0 +1,367 @@
+"""
+Export realm action.
+~~~~~~~~~~~~~~~~~~~~
+"""
+
+from ..keycloak_client import UnexpectedResponseException
+from .action import Action
+from .action import ActionExecutionException
+from .action import InvalidActionConfigurationException
+
+import gzip
+import itertools
+import json
+import logging
+import os
+import requests
+import urllib
+
+logger = logging.getLogger(__name__)
+
+
+class ExportRealmAction(Action):
+    """
+    Exports a realm into a file which can be imported with the importRealm action.
+    Users, groups, clients and roles are fetched page by page, the following pages being fetched while a page is
+    written out, so that the memory used does not depend on the size of the realm.
+    """
+
+    __slots__ = [
+        'realm_name', 'export_file_path', 'compress', 'page_size', 'concurrency', 'encrypt_fields', 'encryption_key',
+        'encryption_helper'
+    ]
+
+    DEFAULT_PAGE_SIZE = 100
+
+    # Properties of the realm representation which are exported page by page.
+    STREAMED_PROPERTIES = ['users', 'groups', 'clients', 'roles']
+
+    @staticmethod
+    def valid_deploy_env(deploy_env):
+        """
+        Returns True if the provided deployment environment is valid for this action, False otherwise
+        :param deploy_env: The target deployment environment.
+        :return: True always, as this action is valid for all environments.
+        """
+
+        return True
+
+    def __init__(self, name, config_file_dir, action_config_json, json_loader, *args, **kwargs):
+        """
+        Constructor.
+        :param name: The action name.
+        :param config_file_dir: The directory containing the configuration file.
+        :param action_config_json: The JSON configuration for this action.
+        :param json_loader: The JSON loader, whose encryption helper is used to encrypt fields.
+        """
+
+        super(ExportRealmAction, self).__init__(name, *args, **kwargs)
+
+        if 'realmName' not in action_config_json:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
+
+        self.realm_name = action_config_json['realmName']
+
+        if 'exportFile' not in action_config_json:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "exportFile"'.format(name))
+
+        self.export_file_path = os.path.join(config_file_dir, action_config_json['exportFile'])
+        self.compress = self.export_file_path.endswith('.gz')
+
+        self.page_size = action_config_json.get('pageSize', self.DEFAULT_PAGE_SIZE)
+        if not isinstance(self.page_size, int) or self.page_size < 1:
+            raise InvalidActionConfigurationException('Configuration "{0}" has an invalid page size: {1}'.format(name, self.page_size))
+
+        self.concurrency = self.read_concurrency(action_config_json)
+
+        self.encrypt_fields = set(action_config_json.get('encryptFields', []))
+        self.encryption_key = action_config_json.get('encryptionKey', None)
+        if self.encrypt_fields and not self.encryption_key:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "encryptionKey"'.format(name))
+
+        self.encryption_helper = json_loader.encryption_helper
+
+    def execute(self, keycloak_client):
+        """
+        Execute this action. In this case, export a realm to a file.
+        The file is written under a temporary name, and only replaces an existing export once complete.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        """
+
+        logger.debug('Exporting realm "%s" to "%s"...', self.realm_name, self.export_file_path)
+        realm_data = self.get_realm(keycloak_client)
+        for property_name in self.STREAMED_PROPERTIES:
+            realm_data.pop(property_name, None)
+
+        temp_file_path = self.export_file_path + '.tmp'
+        try:
+            with self.open_export_file(temp_file_path) as f:
+                counts = self.write_realm(f, realm_data, keycloak_client)
+            os.replace(temp_file_path, self.export_file_path)
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+        logger.debug(
+                'Exported realm "%s": %s user(s), %s group(s), %s client(s), %s realm role(s).',
+                self.realm_name, counts['users'], counts['groups'], counts['clients'], counts['roles']
+        )
+
+    def open_export_file(self, path):
+        """
+        Open the export file for writing, compressing it if its name ends with ".gz".
+        :param path: The file path.
+        :return: The file object.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.compress:
+            return gzip.open(path, 'wt', encoding='utf-8')
+        return open(path, 'w', encoding='utf-8')
+
+    def write_realm(self, f, realm_data, keycloak_client):
+        """
+        Write the realm representation.
+        :param f: The file object to write to.
+        :param realm_data: The realm representation, without its streamed properties.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The number of exported resources, by property name.
+        """
+
+        counts = {}
+        f.write('{')
+        for key, value in realm_data.items():
+            f.write('{0}: {1}, '.format(json.dumps(key), json.dumps(self.encrypt(key, value))))
+
+        # Client roles are written first, which yields the client IDs needed to name client composite roles.
+        client_ids = {}
+        f.write('"roles": {"client": {')
+        client_roles = self.iterate_pages(
+                keycloak_client, 'clients', lambda client_data: self.get_client_roles(client_data, keycloak_client)
+        )
+        for index, (client_data, roles) in enumerate(client_roles):
+            client_ids[client_data['id']] = client_data['clientId']
+            f.write('{0}{1}: '.format(', ' if index else '', json.dumps(client_data['clientId'])))
+            self.write_array(f, roles)
+
+        f.write('}, "realm": ')
+        counts['roles'] = self.write_array(f, self.iterate_pages(
+                keycloak_client, 'roles', lambda role: self.export_role(role, client_ids, keycloak_client),
+                {'briefRepresentation': 'false'}
+        ))
+
+        f.write('}, "clients": ')
+        counts['clients'] = self.write_array(f, self.iterate_pages(
+                keycloak_client, 'clients', lambda client_data: self.export_client(client_data, keycloak_client)
+        ))
+
+        f.write(', "groups": ')
+        counts['groups'] = self.write_array(f, self.iterate_pages(
+                keycloak_client, 'groups', lambda group: self.export_group(group, keycloak_client)
+        ))
+
+        f.write(', "users": ')
+        counts['users'] = self.write_array(f, self.iterate_pages(
+                keycloak_client, 'users', lambda user: self.export_user(user, keycloak_client)
+        ))
+
+        f.write('}\n')
+        return counts
+
+    def write_array(self, f, items):
+        """
+        Write a JSON array, one item at a time.
+        :param f: The file object to write to.
+        :param items: An iterable of the items.
+        :return: The number of items written.
+        """
+
+        count = 0
+        f.write('[')
+        for item in items:
+            f.write('{0}{1}'.format(', ' if count else '', json.dumps(self.encrypt(None, item))))
+            count += 1
+        f.write(']')
+        return count
+
+    def encrypt(self, key, value):
+        """
+        Encrypt the configured fields of a value.
+        :param key: The property name of the value, if any.
+        :param value: The value.
+        :return: The value, with the configured fields encrypted.
+        """
+
+        if isinstance(value, str):
+            if key in self.encrypt_fields:
+                return self.encryption_helper.encrypt_string(value, self.encryption_key)
+            return value
+        if isinstance(value, dict):
+            return dict((item_key, self.encrypt(item_key, item_value)) for item_key, item_value in value.items())
+        if isinstance(value, list):
+            return [self.encrypt(key, item) for item in value]
+        return value
+
+    def realm_path(self, *segments):
+        """
+        Build an admin path below the realm.
+        :param segments: The path segments below the realm.
+        :return: The path.
+        """
+
+        return '/'.join(['/admin/realms', urllib.parse.quote(self.realm_name)] + [urllib.parse.quote(segment) for segment in segments])
+
+    def get(self, keycloak_client, path, params=None):
+        """
+        Get a resource, failing the action on any unexpected response.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :param path: The resource path.
+        :param params: The query parameters.
+        :return: The decoded response.
+        """
+
+        response = keycloak_client.get(path, params)
+        if response.status_code != requests.codes.ok:
+            raise ActionExecutionException('Unexpected response for export request "{0}" ({1})'.format(path, response.status_code))
+        return response.json()
+
+    def get_realm(self, keycloak_client):
+        """
+        Get the realm representation.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The realm representation.
+        """
+
+        response = keycloak_client.get(self.realm_path())
+        if response.status_code == requests.codes.not_found:
+            raise ActionExecutionException('Realm "{0}" does not exist'.format(self.realm_name))
+        if response.status_code != requests.codes.ok:
+            raise ActionExecutionException('Unexpected response for realm export request ({0})'.format(response.status_code))
+        return response.json()
+
+    def iterate_pages(self, keycloak_client, collection, export_item, params=None):
+        """
+        Iterate over a paginated collection of the realm.
+        While the items of a page are exported concurrently, up to `concurrency - 1` following pages are fetched.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :param collection: The collection path, relative to the realm.
+        :param export_item: A function turning a listed item into its exported representation.
+        :param params: Additional query parameters.
+        :return: A generator of the exported items, in the order of the listing.
+        """
+
+        path = self.realm_path(*collection.split('/'))
+        window = min(self.concurrency or keycloak_client.max_workers, keycloak_client.max_workers)
+        items = keycloak_client.paginate(path, params, self.page_size, prefetch=window - 1)
+        try:
+            while True:
+                try:
+                    page = list(itertools.islice(items, self.page_size))
+                except UnexpectedResponseException as e:
+                    raise ActionExecutionException('Unexpected response for export request "{0}" ({1})'.format(path, e.status_code))
+
+                for item in keycloak_client.run_concurrently(export_item, page, self.concurrency):
+                    yield item
+                if len(page) < self.page_size:
+                    return
+        finally:
+            items.close()
+
+    @staticmethod
+    def role_names(role_mappings):
+        """
+        Convert role mappings into role names.
+        :param role_mappings: The role mappings, as returned by the "role-mappings" endpoints.
+        :return: A (realm role names, client role names by client ID) tuple.
+        """
+
+        realm_roles = [role['name'] for role in role_mappings.get('realmMappings', [])]
+        client_roles = {}
+        for client_id, client_mappings in role_mappings.get('clientMappings', {}).items():
+            client_roles[client_id] = [role['name'] for role in client_mappings.get('mappings', [])]
+        return realm_roles, client_roles
+
+    def get_client_roles(self, client_data, keycloak_client):
+        """
+        Get the roles of a client.
+        :param client_data: The listed client.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: A (client, client roles) tuple.
+        """
+
+        roles = self.get(keycloak_client, self.realm_path('clients', client_data['id'], 'roles'), {'briefRepresentation': 'false'})
+        return client_data, roles
+
+    def export_role(self, role, client_ids, keycloak_client):
+        """
+        Add the composite roles to a role.
+        :param role: The listed role.
+        :param client_ids: The client IDs, by client UUID.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The exported role.
+        """
+
+        if not role.get('composite', False):
+            return role
+
+        composites = {}
+        for composite in self.get(keycloak_client, self.realm_path('roles-by-id', role['id'], 'composites')):
+            if composite.get('clientRole', False):
+                client_id = client_ids.get(composite['containerId'], composite['containerId'])
+                composites.setdefault('client', {}).setdefault(client_id, []).append(composite['name'])
+            else:
+                composites.setdefault('realm', []).append(composite['name'])
+
+        role['composites'] = composites
+        return role
+
+    def export_client(self, client_data, keycloak_client):
+        """
+        Add the secret of a confidential client, if the listing does not include it.
+        :param client_data: The listed client.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The exported client.
+        """
+
+        confidential = not client_data.get('publicClient', False) and not client_data.get('bearerOnly', False)
+        if confidential and 'secret' not in client_data:
+            response = keycloak_client.get(self.realm_path('clients', client_data['id'], 'client-secret'))
+            if response.status_code == requests.codes.ok:
+                client_data['secret'] = response.json().get('value')
+        return client_data
+
+    def export_group(self, group, keycloak_client):
+        """
+        Add the role mappings and the sub-groups to a group.
+        :param group: The listed group.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The exported group.
+        """
+
+        role_mappings = self.get(keycloak_client, self.realm_path('groups', group['id'], 'role-mappings'))
+        group['realmRoles'], group['clientRoles'] = self.role_names(role_mappings)
+
+        sub_groups = group.get('subGroups', [])
+        if not sub_groups and group.get('subGroupCount', 0):
+            # Recent Keycloak versions no longer include sub-groups in group listings.
+            sub_groups = list(self.iterate_pages(keycloak_client, 'groups/{0}/children'.format(group['id']), lambda sub_group: sub_group))
+        group['subGroups'] = [self.export_group(sub_group, keycloak_client) for sub_group in sub_groups]
+        group.pop('subGroupCount', None)
+        return group
+
+    def export_user(self, user, keycloak_client):
+        """
+        Add the role mappings and the group memberships to a user.
+        :param user: The listed user.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The exported user.
+        """
+
+        role_mappings = self.get(keycloak_client, self.realm_path('users', user['id'], 'role-mappings'))
+        user['realmRoles'], user['clientRoles'] = self.role_names(role_mappings)
+        user['groups'] = [group['path'] for group in self.get(keycloak_client, self.realm_path('users', user['id'], 'groups'))]
+        user.pop('access', None)
+        return user
@@ -3,16 +3,24 @@ Import realm action.
 ~~~~~~~~~~~~~~~~~~~~
 """
 
+from ..cache import CLIENTS
+from ..cache import ROLES
+from ..cache import USERS
 from .action import Action
 from .action import ActionExecutionException
 from .action import InvalidActionConfigurationException
 
+import json
+import logging
 import os
 import requests
 import urllib
 
+logger = logging.getLogger(__name__)
+
 
 class ImportRealmAction(Action):
+    __slots__ = ['realm_file_path', 'realm_data', 'realm_name', 'overwrite']
 
     @staticmethod
     def valid_deploy_env(deploy_env):
@@ -24,6 +32,69 @@ class ImportRealmAction(Action):
 
         return deploy_env == 'local'
 
+    @staticmethod
+    def referenced_files(config_file_dir, action_config_json):
+        """
+        Returns the files, besides the configuration file, that the action reads its configuration from.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The list of file paths.
+        """
+
+        if 'realmFile' not in action_config_json:
+            return []
+        return [os.path.join(config_file_dir, action_config_json['realmFile'])]
+
+    @staticmethod
+    def shard_key(config_file_dir, action_config_json):
+        """
+        Returns the key assigning the action to a shard: the realm of the realm file.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: The shard key, or None if the realm file cannot be read.
+        """
+
+        if 'realmFile' not in action_config_json:
+            return None
+        try:
+            with open(os.path.join(config_file_dir, action_config_json['realmFile']), 'r') as f:
+                return json.load(f).get('realm', None)
+        except (OSError, ValueError, AttributeError):
+            # The action fails when executed.
+            return None
+
+    @staticmethod
+    def declared_resources(config_file_dir, action_config_json):
+        """
+        Returns the clients, realm roles and users of the realm file.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for the action
+        :return: A list of (realm name, kind, key) tuples.
+        """
+
+        if 'realmFile' not in action_config_json:
+            return []
+        try:
+            # Names are never encrypted, so the realm file is read as is.
+            with open(os.path.join(config_file_dir, action_config_json['realmFile']), 'r') as f:
+                realm_data = json.load(f)
+        except (OSError, ValueError):
+            # The realm file may only exist for another deployment environment, and the action fails if executed.
+            return []
+        if not isinstance(realm_data, dict):
+            return []
+
+        realm_name = realm_data.get('realm', None)
+        roles = realm_data.get('roles', None) or {}
+        resources = [(realm_name, CLIENTS, client['clientId']) for client in realm_data.get('clients', []) if 'clientId' in client]
+        resources.extend((realm_name, ROLES, role['name']) for role in roles.get('realm', []) if 'name' in role)
+        resources.extend((realm_name, CLIENTS, client_id) for client_id in roles.get('client', None) or {})
+        for user in realm_data.get('users', []):
+            for key in ('username', 'email'):
+                if user.get(key, None):
+                    resources.append((realm_name, USERS, user[key].lower()))
+        return resources
+
     def __init__(self, name, config_file_dir, action_config_json, json_loader, *args, **kwargs):
         """
         Constructor.
@@ -33,7 +104,6 @@ class ImportRealmAction(Action):
         """
 
         super(ImportRealmAction, self).__init__(name, *args, **kwargs)
-        self.action_config_json = action_config_json
 
         if 'realmFile' not in action_config_json:
             raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmFile"'.format(name))
@@ -59,20 +129,20 @@ class ImportRealmAction(Action):
         :param keycloak_client: The client to use when interacting with Keycloak.
         """
 
-        print('==== Importing realm "{0}"...'.format(self.realm_name))
+        logger.debug('Importing realm "%s"...', self.realm_name)
         realm_path = '/admin/realms/{0}'.format(urllib.parse.quote(self.realm_name))
         import_realm = False
 
         get_response = keycloak_client.get(realm_path)
         if get_response.status_code == requests.codes.ok:
             if not self.overwrite:
-                print('==== Realm "{0}" exists, and overwrite is false.'.format(self.realm_name))
+                logger.debug('Realm "%s" exists, and overwrite is false.', self.realm_name)
             else:
                 delete_response = keycloak_client.delete(realm_path)
                 if delete_response.status_code != requests.codes.no_content:
                     raise ActionExecutionException('Unable to delete realm "{0}".'.format(self.realm_name))
                 else:
-                    print('==== Deleted existing realm "{0}".'.format(self.realm_name))
+                    logger.debug('Deleted existing realm "%s".', self.realm_name)
                     import_realm = True
         elif get_response.status_code == requests.codes.not_found:
             import_realm = True
@@ -80,9 +150,9 @@ class ImportRealmAction(Action):
             raise ActionExecutionException('Unexpected response for realm existence check ({0})'.format(get_response.status_code))
 
         if import_realm:
-            print('==== Creating realm "{0}"...'.format(self.realm_name))
+            logger.debug('Creating realm "%s"...', self.realm_name)
             post_response = keycloak_client.post('/admin/realms', json=self.realm_data)
             if post_response.status_code == requests.codes.created:
-                print('==== Realm "{0}" creation succeeded.'.format(self.realm_name))
+                logger.debug('Realm "%s" creation succeeded.', self.realm_name)
             else:
                 raise ActionExecutionException('Unexpected response for realm creation ({0})'.format(post_response.status_code))
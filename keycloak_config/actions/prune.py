@@ -0,0 +1,224 @@
+"""
+Prune action.
+~~~~~~~~~~~~~
+
+Deletes the clients, realm roles and, optionally, users of a realm which the configuration does not declare, along with
+the protocol mappers of the declared clients which their configuration does not list. Keycloak's built-in clients and
+roles are always kept, as are the resources matching the configured keep patterns.
+"""
+
+from ..cache import CLIENTS
+from ..cache import ROLES
+from ..cache import USERS
+from .action import Action
+from .action import ActionExecutionException
+from .action import InvalidActionConfigurationException
+from .action import PROTOCOL_MAPPERS
+from .utils import DEFAULT_CLIENTS
+from .utils import RESERVED_ROLES
+
+import logging
+import re
+import requests
+import urllib
+
+logger = logging.getLogger(__name__)
+
+# The kinds of resources which may be pruned, by configuration property, and whether they are pruned by default.
+PRUNED_KINDS = {
+    'clients': True,
+    'roles': True,
+    'protocolMappers': True,
+    'users': False
+}
+
+SERVICE_ACCOUNT_PREFIX = 'service-account-'
+
+
+class PruneAction(Action):
+    __slots__ = ['realm_name', 'pruned_kinds', 'keep_patterns', 'concurrency', 'managed_resources']
+
+    @staticmethod
+    def valid_deploy_env(deploy_env):
+        """
+        Returns True if the provided deployment environment is valid for this action, False otherwise
+        :param deploy_env: The target deployment environment.
+        :return: True always, as this action is valid for all environments.
+        """
+
+        return True
+
+    def __init__(self, name, config_file_dir, action_config_json, *args, **kwargs):
+        """
+        Constructor.
+        :param name: The action name.
+        :param config_file_dir: The directory containing the configuration file
+        :param action_config_json: The JSON configuration for this action
+        """
+
+        super(PruneAction, self).__init__(name, *args, **kwargs)
+
+        if 'realmName' not in action_config_json:
+            raise InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
+
+        self.realm_name = action_config_json['realmName']
+
+        if self.realm_name == 'master':
+            raise InvalidActionConfigurationException('Configuration "{0}" cannot prune the master realm'.format(name))
+
+        self.pruned_kinds = set(kind for kind, default in PRUNED_KINDS.items() if action_config_json.get(kind, default))
+
+        self.keep_patterns = {}
+        for kind, property_name in ((CLIENTS, 'keepClients'), (ROLES, 'keepRoles'), (USERS, 'keepUsers')):
+            try:
+                self.keep_patterns[kind] = [re.compile(pattern) for pattern in action_config_json.get(property_name, [])]
+            except re.error as err:
+                raise InvalidActionConfigurationException('Configuration "{0}" has an invalid {1} pattern: {2}'.format(
+                        name, property_name, err
+                ))
+
+        self.concurrency = self.read_concurrency(action_config_json)
+        # The resources declared by the whole configuration, provided by the actions engine.
+        self.managed_resources = kwargs.get('declared_resources', None)
+
+    def declared_keys(self, kind):
+        """
+        Get the keys of the resources of a kind which the configuration declares in the realm.
+        :param kind: The resource kind.
+        :return: The set of keys.
+        """
+
+        return set(key for realm_name, declared_kind, key in self.managed_resources
+                   if realm_name == self.realm_name and declared_kind == kind)
+
+    def kept(self, kind, key):
+        """
+        Returns True if a resource matches one of the keep patterns of its kind, False otherwise.
+        :param kind: The resource kind.
+        :param key: The resource key.
+        """
+
+        return any(pattern.fullmatch(key) for pattern in self.keep_patterns[kind])
+
+    def take_snapshot(self, keycloak_client):
+        """
+        List the clients, realm roles and users of the realm which may be pruned, concurrently.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: A dictionary of the lists of resource representations, by kind.
+        """
+
+        kinds = []
+        if self.pruned_kinds & {'clients', 'protocolMappers'}:
+            kinds.append(CLIENTS)
+        if 'roles' in self.pruned_kinds:
+            kinds.append(ROLES)
+        if 'users' in self.pruned_kinds:
+            kinds.append(USERS)
+
+        def list_resources(kind):
+            path = '/admin/realms/{0}/{1}'.format(urllib.parse.quote(self.realm_name), kind)
+            return list(keycloak_client.paginate(path, stream=True))
+
+        return dict(zip(kinds, keycloak_client.run_concurrently(list_resources, kinds, self.concurrency)))
+
+    def find_unmanaged(self, keycloak_client):
+        """
+        Compare a snapshot of the realm with the declared resources.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: A list of (description, deletion path) tuples, one for every unmanaged resource.
+        """
+
+        if self.managed_resources is None:
+            raise ActionExecutionException('Action "{0}" requires the resources declared by the configuration'.format(self.name))
+
+        snapshot = self.take_snapshot(keycloak_client)
+        realm_path = '/admin/realms/{0}'.format(urllib.parse.quote(self.realm_name))
+        unmanaged = []
+
+        declared_client_ids = self.declared_keys(CLIENTS)
+        declared_mapper_names = {}
+        for client_id, mapper_names in self.declared_keys(PROTOCOL_MAPPERS):
+            declared_mapper_names.setdefault(client_id, set()).update(mapper_names)
+
+        for client_data in snapshot.get(CLIENTS, []):
+            client_id = client_data['clientId']
+            client_path = '{0}/clients/{1}'.format(realm_path, urllib.parse.quote(client_data['id']))
+            if client_id in DEFAULT_CLIENTS or self.kept(CLIENTS, client_id):
+                continue
+            if client_id not in declared_client_ids:
+                if 'clients' in self.pruned_kinds:
+                    unmanaged.append(('client "{0}"'.format(client_id), client_path))
+            elif 'protocolMappers' in self.pruned_kinds and client_id in declared_mapper_names:
+                for mapper in client_data.get('protocolMappers', []):
+                    if mapper['name'] not in declared_mapper_names[client_id]:
+                        unmanaged.append((
+                                'protocol mapper "{0}" of client "{1}"'.format(mapper['name'], client_id),
+                                '{0}/protocol-mappers/models/{1}'.format(client_path, urllib.parse.quote(mapper['id']))
+                        ))
+
+        declared_role_names = self.declared_keys(ROLES)
+        default_role_name = 'default-roles-{0}'.format(self.realm_name.lower())
+        for role_data in snapshot.get(ROLES, []):
+            role_name = role_data['name']
+            if role_name in declared_role_names or role_name in RESERVED_ROLES or role_name == default_role_name or \
+                    self.kept(ROLES, role_name):
+                continue
+            unmanaged.append(('role "{0}"'.format(role_name), '{0}/roles-by-id/{1}'.format(
+                    realm_path, urllib.parse.quote(role_data['id'])
+            )))
+
+        declared_usernames = self.declared_keys(USERS)
+        for user_data in snapshot.get(USERS, []):
+            username = user_data['username'].lower()
+            if user_data.get('serviceAccountClientId', None) or username.startswith(SERVICE_ACCOUNT_PREFIX):
+                # Service accounts belong to their client.
+                continue
+            if username in declared_usernames or (user_data.get('email', None) or '').lower() in declared_usernames or \
+                    self.kept(USERS, username):
+                continue
+            unmanaged.append(('user "{0}"'.format(username), '{0}/users/{1}'.format(
+                    realm_path, urllib.parse.quote(user_data['id'])
+            )))
+
+        return unmanaged
+
+    def plan(self, keycloak_client):
+        """
+        Describe the resources the action would delete, without deleting them.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        :return: The list of change descriptions.
+        """
+
+        return ['delete {0} in realm "{1}"'.format(description, self.realm_name)
+                for description, path in self.find_unmanaged(keycloak_client)]
+
+    def execute(self, keycloak_client):
+        """
+        Execute this action. In this case, delete the unmanaged resources of the realm, concurrently.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        logger.debug('Pruning realm "%s"...', self.realm_name)
+        unmanaged = self.find_unmanaged(keycloak_client)
+        keycloak_client.run_concurrently(
+                lambda resource: self.delete_resource(resource[0], resource[1], keycloak_client), unmanaged, self.concurrency
+        )
+        logger.debug('Deleted %s unmanaged resource(s) in realm "%s".', len(unmanaged), self.realm_name)
+
+    def delete_resource(self, description, path, keycloak_client):
+        """
+        Delete an unmanaged resource.
+        :param description: The description of the resource.
+        :param path: The deletion path.
+        :param keycloak_client: The client to use when interacting with Keycloak
+        """
+
+        response = keycloak_client.delete(path)
+        if response.status_code == requests.codes.no_content:
+            logger.info('Deleted unmanaged %s in realm "%s".', description, self.realm_name)
+        elif response.status_code == requests.codes.not_found:
+            logger.debug('Unmanaged %s was already deleted.', description)
+        else:
+            raise ActionExecutionException('Unexpected response for {0} delete request ({1})'.format(
+                    description, response.status_code
+            ))
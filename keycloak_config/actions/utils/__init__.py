@@ -3,11 +3,30 @@ User utilities.
 ~~~~~~~~~~~~~~~
 """
 
+from ...cache import CLIENTS
+from ...cache import ROLES
+from ...cache import USERS
+from ...keycloak_client import UnexpectedResponseException
+
 import requests
+import urllib.parse
 
 # Roles that should not be processed.
 RESERVED_ROLES = ['offline_access', 'uma_authorization']
 
+# The cache key marking that all the roles of a realm, or of a client, have been listed.
+CATALOG = ('catalog',)
+
+# Clients that Keycloak creates in every realm, which are never matched by client patterns.
+DEFAULT_CLIENTS = [
+    'account',
+    'account-console',
+    'admin-cli',
+    'broker',
+    'realm-management',
+    'security-admin-console'
+]
+
 
 class InvalidUserResponse(Exception):
     pass
@@ -17,6 +36,24 @@ class InvalidRoleResponse(Exception):
     pass
 
 
+def get_created_id(create_response):
+    """
+    Get the ID of a created resource from the "Location" header of a creation response, which Keycloak sets to the URL
+    of the new resource.
+    :param create_response: The creation response.
+    :return: The ID of the created resource, or None if the response does not provide one.
+    """
+
+    location = create_response.headers.get('Location', None)
+    if not location:
+        return None
+
+    path = urllib.parse.urlparse(location).path.rstrip('/')
+    if not path:
+        return None
+    return urllib.parse.unquote(path.rsplit('/', 1)[-1]) or None
+
+
 def get_role_by_name(realm_name, role_name, keycloak_client):
     """
     Gets a role representation.
@@ -26,36 +63,157 @@ def get_role_by_name(realm_name, role_name, keycloak_client):
     :return: The role representation
     """
 
+    realm_cache = keycloak_client.cache.realm(realm_name)
+    if realm_cache.contains(ROLES, role_name) or realm_cache.contains(ROLES, CATALOG):
+        return realm_cache.get(ROLES, role_name)
+
+    generation = realm_cache.current_generation()
     path = '/admin/realms/{0}/roles/{1}'.format(realm_name, role_name)
     get_response = keycloak_client.get(path)
 
     if get_response.status_code == requests.codes.ok:
-        return get_response.json()
+        role = get_response.json()
+        realm_cache.put(ROLES, role_name, role, generation)
+        return role
 
     if get_response.status_code == requests.codes.not_found:
+        realm_cache.put(ROLES, role_name, None, generation)
         return None
 
     raise InvalidRoleResponse('Unexpected role get response ({0})'.format(get_response.status_code))
 
 
-def role_names_to_roles(realm_name, role_names, keycloak_client):
+def get_role_catalog(realm_name, keycloak_client):
+    """
+    List all the roles of a realm, and keep them in the realm cache until roles are modified.
+    :param realm_name: The realm of the roles
+    :param keycloak_client: The client to use when interacting with Keycloak
+    :return: The role representations, by role name
+    """
+
+    realm_cache = keycloak_client.cache.realm(realm_name)
+    catalog = realm_cache.get(ROLES, CATALOG)
+    if catalog is not None:
+        return catalog
+
+    generation = realm_cache.current_generation()
+    path = '/admin/realms/{0}/roles'.format(urllib.parse.quote(realm_name))
+    # The catalog answers role lookups, whose representations must include the role attributes.
+    params = {'briefRepresentation': 'false'}
+    try:
+        catalog = dict((role['name'], role) for role in keycloak_client.paginate(path, params, stream=True))
+    except UnexpectedResponseException as e:
+        raise InvalidRoleResponse('Unexpected role listing response ({0})'.format(e.status_code))
+
+    for role_name, role in catalog.items():
+        realm_cache.put(ROLES, role_name, role, generation)
+    realm_cache.put(ROLES, CATALOG, catalog, generation)
+    return catalog
+
+
+def get_client_role_catalog(realm_name, client_id, keycloak_client):
+    """
+    List all the roles of a client, and keep them in the realm cache until clients are modified.
+    :param realm_name: The realm of the client
+    :param client_id: The client ID (not the UUID) of the client
+    :param keycloak_client: The client to use when interacting with Keycloak
+    :return: The role representations, by role name
+    """
+
+    from ..action import Action
+
+    realm_cache = keycloak_client.cache.realm(realm_name)
+    catalog_key = (client_id,) + CATALOG
+    catalog = realm_cache.get(CLIENTS, catalog_key)
+    if catalog is not None:
+        return catalog
+
+    client_data = Action.get_client_by_client_id(realm_name, client_id, keycloak_client)
+    if not client_data:
+        raise InvalidRoleResponse('Unknown client: {0}'.format(client_id))
+
+    generation = realm_cache.current_generation()
+    path = '/admin/realms/{0}/clients/{1}/roles'.format(urllib.parse.quote(realm_name), urllib.parse.quote(client_data['id']))
+    try:
+        catalog = dict((role['name'], role) for role in keycloak_client.paginate(path, stream=True))
+    except UnexpectedResponseException as e:
+        raise InvalidRoleResponse('Unexpected client role listing response ({0})'.format(e.status_code))
+
+    realm_cache.put(CLIENTS, catalog_key, catalog, generation)
+    return catalog
+
+
+def role_names_to_roles(realm_name, role_names, keycloak_client, client_id=None):
     """
     Convert a list of role names into role representations.
     :param realm_name: The realm of the roles
     :param role_names: The name of the roles
     :param keycloak_client: The client to use when interacting with Keycloak
+    :param client_id: The client ID of the client of the roles, or None for realm roles
     :return: The role representations
     """
 
+    if client_id is None:
+        catalog = get_role_catalog(realm_name, keycloak_client)
+    else:
+        catalog = get_client_role_catalog(realm_name, client_id, keycloak_client)
+
     roles = []
     for role_name in role_names:
-        role = get_role_by_name(realm_name, role_name, keycloak_client)
+        role = catalog.get(role_name, None)
         if not role:
-            raise InvalidRoleResponse('Unknown role: {0}'.format(role_name))
+            if client_id is None:
+                raise InvalidRoleResponse('Unknown role: {0}'.format(role_name))
+            raise InvalidRoleResponse('Unknown role of client "{0}": {1}'.format(client_id, role_name))
         roles.append(role)
     return roles
 
 
+def referenced_roles(realm_name, realm_role_names, client_role_names):
+    """
+    Describe the roles referred to by an action, see Action.declared_resources.
+    :param realm_name: The realm of the roles
+    :param realm_role_names: The names of the realm roles
+    :param client_role_names: The lists of client role names, by client ID
+    :return: The list of (realm name, kind, key) tuples of the realm roles and of the clients of the client roles
+    """
+
+    resources = [(realm_name, ROLES, role_name) for role_name in realm_role_names or []]
+    resources.extend((realm_name, CLIENTS, client_id) for client_id in client_role_names or {})
+    return resources
+
+
+def prefetch_role_catalogs(realm_name, realm_role_names, client_role_names, keycloak_client):
+    """
+    Load the role catalogs needed to resolve role names, see Action.prefetch.
+    :param realm_name: The realm of the roles
+    :param realm_role_names: The names of the realm roles
+    :param client_role_names: The lists of client role names, by client ID
+    :param keycloak_client: The client to use when interacting with Keycloak
+    """
+
+    if realm_role_names:
+        get_role_catalog(realm_name, keycloak_client)
+    for client_id in sorted(client_role_names):
+        get_client_role_catalog(realm_name, client_id, keycloak_client)
+
+
+def composites_to_roles(realm_name, composites, keycloak_client):
+    """
+    Convert a composite role definition into role representations.
+    :param realm_name: The realm of the roles
+    :param composites: The composite definition, as in Keycloak role representations: a "realm" list of role names, and
+    a "client" dictionary of lists of role names, by client ID
+    :param keycloak_client: The client to use when interacting with Keycloak
+    :return: The role representations
+    """
+
+    roles = role_names_to_roles(realm_name, composites.get('realm', []), keycloak_client)
+    for client_id, role_names in sorted(composites.get('client', {}).items()):
+        roles.extend(role_names_to_roles(realm_name, role_names, keycloak_client, client_id))
+    return roles
+
+
 def get_user(realm_name, user_id, keycloak_client):
     """
     Get a user representation.
@@ -86,19 +244,28 @@ def get_user_by_email(realm_name, email, keycloak_client):
     :return: The user configuration
     """
 
-    path = '/admin/realms/{0}/users'.format(realm_name)
-    get_response = keycloak_client.get(path)
+    realm_cache = keycloak_client.cache.realm(realm_name)
+    if realm_cache.contains(USERS, email):
+        return realm_cache.get(USERS, email)
 
-    if get_response.status_code == requests.codes.ok:
-        for user_data in get_response.json():
+    generation = realm_cache.current_generation()
+    path = '/admin/realms/{0}/users'.format(realm_name)
+    found_user_data = None
+    try:
+        # The listing contains all users, so keep all of them.
+        for user_data in keycloak_client.paginate(path, prefetch=1, stream=True):
+            if user_data.get('email', None):
+                realm_cache.put(USERS, user_data['email'], user_data, generation)
             if user_data.get('email', None) == email:
-                return user_data
-        return None
+                found_user_data = user_data
+    except UnexpectedResponseException as e:
+        if e.status_code == requests.codes.not_found:
+            return None
+        raise InvalidUserResponse('Unexpected user get response ({0})'.format(e.status_code))
 
-    if get_response.status_code == requests.codes.not_found:
-        return None
-
-    raise InvalidUserResponse('Unexpected user get response ({0})'.format(get_response.status_code))
+    if not found_user_data:
+        realm_cache.put(USERS, email, None, generation)
+    return found_user_data
 
 
 def update_user(realm_name, user_id, user_config, keycloak_client):
@@ -205,3 +372,85 @@ def process_user_roles(realm_name, user_id, existing_roles, new_role_names, keyc
 
     if len(delete_roles):
         delete_user_roles(realm_name, user_id, delete_roles, keycloak_client)
+
+
+def get_user_role_mappings(realm_name, user_id, keycloak_client):
+    """
+    Get all the role mappings of a user, realm and client roles, with a single request.
+    :param realm_name: The realm of the user
+    :param user_id: The UUID of the user
+    :param keycloak_client: The client to use when interacting with Keycloak
+    :return: The realm roles, and the client roles by client ID
+    """
+
+    path = '/admin/realms/{0}/users/{1}/role-mappings'.format(urllib.parse.quote(realm_name), user_id)
+    get_response = keycloak_client.get(path)
+
+    if get_response.status_code == requests.codes.ok:
+        mappings = get_response.json()
+        client_roles = dict(
+                (client_id, client_mappings.get('mappings', []))
+                for client_id, client_mappings in mappings.get('clientMappings', {}).items()
+        )
+        return mappings.get('realmMappings', []), client_roles
+
+    if get_response.status_code == requests.codes.not_found:
+        return [], {}
+
+    raise InvalidRoleResponse('Unexpected user role mappings get response ({0})'.format(get_response.status_code))
+
+
+def update_user_role_mappings(realm_name, user_id, client_id, method, roles, keycloak_client):
+    """
+    Add or remove role mappings of a user, for the roles of a single realm or client.
+    :param realm_name: The realm of the user
+    :param user_id: The UUID of the user
+    :param client_id: The client ID of the client of the roles, or None for realm roles
+    :param method: "post" to add the roles, "delete" to remove them
+    :param roles: The role representations
+    :param keycloak_client: The client to use when interacting with Keycloak
+    """
+
+    if client_id is None:
+        path = '/admin/realms/{0}/users/{1}/role-mappings/realm'.format(urllib.parse.quote(realm_name), user_id)
+    else:
+        # Client roles carry the UUID of their client.
+        path = '/admin/realms/{0}/users/{1}/role-mappings/clients/{2}'.format(
+                urllib.parse.quote(realm_name), user_id, urllib.parse.quote(roles[0]['containerId'])
+        )
+
+    update_response = getattr(keycloak_client, method)(path, json=roles)
+    if update_response.status_code != requests.codes.no_content:
+        raise InvalidUserResponse('Unexpected user role mappings update response ({0})'.format(update_response.status_code))
+
+
+def process_user_role_mappings(realm_name, user_id, existing_mappings, realm_role_names, client_role_names, keycloak_client):
+    """
+    Process the realm and client roles for a given user, with at most one addition and one removal request per realm or
+    client. Only the roles of the clients present in `client_role_names` are processed.
+    :param realm_name: The realm of the user
+    :param user_id: The UUID of the user
+    :param existing_mappings: The existing realm roles, and client roles by client ID, of the user
+    :param realm_role_names: The new realm role names for the user
+    :param client_role_names: The new client role names for the user, by client ID
+    :param keycloak_client: The client to use when interacting with Keycloak
+    """
+
+    existing_realm_roles, existing_client_roles = existing_mappings
+    containers = [(None, existing_realm_roles, realm_role_names)]
+    for client_id, role_names in sorted(client_role_names.items()):
+        containers.append((client_id, existing_client_roles.get(client_id, []), role_names))
+
+    for client_id, existing_roles, new_role_names in containers:
+        existing_role_names = set(existing_role['name'] for existing_role in existing_roles)
+        add_role_names = [role_name for role_name in new_role_names if role_name not in existing_role_names]
+        if add_role_names:
+            add_roles = role_names_to_roles(realm_name, add_role_names, keycloak_client, client_id)
+            update_user_role_mappings(realm_name, user_id, client_id, 'post', add_roles, keycloak_client)
+
+        delete_roles = [
+            existing_role for existing_role in existing_roles
+            if existing_role['name'] not in new_role_names and (client_id is not None or existing_role['name'] not in RESERVED_ROLES)
+        ]
+        if delete_roles:
+            update_user_role_mappings(realm_name, user_id, client_id, 'delete', delete_roles, keycloak_client)
@@ -3,42 +3,129 @@ Actions Engine.
 ~~~~~~~~~~~~~~~
 """
 
-from .actions.action import InvalidActionConfigurationException
-from .actions.create_client import CreateClientAction
-from .actions.create_role import CreateRoleAction
-from .actions.create_user import CreateUserAction
-from .actions.custom_action import CustomActionWrapper
-from .actions.delete_client import DeleteClientAction
-from .actions.import_realm import ImportRealmAction
+from .actions.exceptions import ActionExecutionException
+from .actions.exceptions import InvalidActionConfigurationException
+from .deadline import deadline
+from .deadline import DeadlineExceededException
+from .fingerprint import action_fingerprint
+from .upsert import LOOKUP_FIRST
+from .upsert import UpsertStats
+
+import concurrent.futures
+import hashlib
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# The number of slowest actions reported at the end of a run.
+SLOWEST_ACTIONS_REPORTED = 5
+
+# The outcomes of the actions of a run.
+COMPLETED = 'completed'
+FAILED = 'failed'
+RESUMED = 'resumed'
+
+
+def shard_of(shard_key, shard_count):
+    """
+    Assign a shard key to a shard, the same way in every process. Actions without a shard key are all assigned to the
+    first shard.
+    :param shard_key: The shard key, or None.
+    :param shard_count: The number of shards.
+    :return: The shard number, from 1 to the number of shards.
+    """
+
+    if shard_key is None:
+        return 1
+    digest = hashlib.sha256(str(shard_key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count + 1
 
 
 class ActionsEngine(object):
+    # Action classes are referenced by module and class name, and only imported once an action of that type is
+    # configured, which keeps the start-up cost of the tool low.
     ACTIONS = {
-        'importRealm': ImportRealmAction,
-        'createClient': CreateClientAction,
-        'createUser': CreateUserAction,
-        'createRole': CreateRoleAction,
-        'deleteClient': DeleteClientAction,
-        'custom': CustomActionWrapper
+        'importRealm': ('.actions.import_realm', 'ImportRealmAction'),
+        'createClient': ('.actions.create_client', 'CreateClientAction'),
+        'createUser': ('.actions.create_user', 'CreateUserAction'),
+        'createRole': ('.actions.create_role', 'CreateRoleAction'),
+        'createGroup': ('.actions.create_group', 'CreateGroupAction'),
+        'deleteClient': ('.actions.delete_client', 'DeleteClientAction'),
+        'exportRealm': ('.actions.export_realm', 'ExportRealmAction'),
+        'prune': ('.actions.prune', 'PruneAction'),
+        'custom': ('.actions.custom_action', 'CustomActionWrapper')
     }
 
-    def __init__(self, deploy_env, config_file_dir, actions_config_json, json_loader):
-        self.actions = []
-        self.actions_by_name = {}
+    def __init__(self, deploy_env, config_file_dir, actions_config_json, json_loader, profiler=None, coalesce=False,
+                 journal=None, resume=False, ignore_fingerprints=False, prefetch_depth=0, upsert_strategy=LOOKUP_FIRST,
+                 action_timeout=None, slow_action_threshold=None, shard=None):
+        self.pending_actions = []
+        self.action_names = set()
         self.deploy_env = deploy_env
         self.config_file_dir = config_file_dir
         self.action_config_json = actions_config_json
+        self.profiler = profiler
+        self.coalesce = coalesce
+        self.journal = journal
+        self.resume = resume
+        self.fingerprints = {}
+        # The number of upcoming actions whose lookups are prefetched while an action is executed.
+        self.prefetch_depth = prefetch_depth if profiler is None else 0
+        # The actions built ahead of their execution and their prefetch futures, by pending action index.
+        self.prefetched = {}
+
+        if prefetch_depth and profiler is not None:
+            logger.warning('Prefetching is disabled while profiling.')
+
+        self.upsert_stats = UpsertStats()
+
+        # The default deadline (in seconds) of the actions, and the duration from which an action is reported as slow.
+        self.action_timeout = action_timeout
+        self.slow_action_threshold = slow_action_threshold
+        # The (elapsed time, action name, action type) tuples of the actions executed on their own.
+        self.action_durations = []
+        # The (status, elapsed time, error message) tuples of the actions which were executed, by action name.
+        self.action_results = {}
+        # The (shard number, shard count) tuple of the shard of the actions to execute, or None to execute them all.
+        self.shard = shard
+        # The names of the actions without a shard key, which are all assigned to the first shard.
+        self.keyless_action_names = []
 
         self.action_kwargs = {
-            'json_loader': json_loader
+            'json_loader': json_loader,
+            'ignore_fingerprints': ignore_fingerprints,
+            'upsert_strategy': upsert_strategy,
+            'upsert_stats': self.upsert_stats
         }
 
         for action_config_json in actions_config_json:
             self.process_action_config_json(action_config_json)
 
+        if self.keyless_action_names:
+            logger.info('%s action(s) without a realm or shard key assigned to shard 1: %s', len(self.keyless_action_names),
+                        ', '.join(self.keyless_action_names))
+
+        if any(action_config_json['action'] == 'prune' for _, _, action_config_json in self.pending_actions):
+            self.action_kwargs['declared_resources'] = self.declared_resources()
+
+    @classmethod
+    def get_action_class(cls, action_type):
+        """
+        Resolve an action type into its action class, importing the action module on first use.
+        :param action_type: The action type, as found in the action configuration.
+        :return: The action class.
+        """
+
+        module_name, class_name = cls.ACTIONS[action_type]
+        module = importlib.import_module(module_name, __package__)
+        return getattr(module, class_name)
+
     def process_action_config_json(self, action_config_json):
         """
-        Process an action configuration into an action instance.
+        Validate an action configuration and queue it for execution.
+        The action itself is only constructed when it is about to be executed.
         :param action_config_json: The action JSON configuration.
         """
 
@@ -47,7 +134,7 @@ class ActionsEngine(object):
 
         action_name = action_config_json['name']
 
-        if action_name in self.actions_by_name:
+        if action_name in self.action_names:
             raise InvalidActionConfigurationException('Action name "{0}" duplicated'.format(action_name))
 
         if 'action' not in action_config_json:
@@ -58,23 +145,314 @@ class ActionsEngine(object):
         if action_type not in self.ACTIONS:
             raise InvalidActionConfigurationException('Unknown action: "{0}"'.format(action_name))
 
-        action_class = self.ACTIONS[action_type]
+        timeout = action_config_json.get('timeout', None)
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise InvalidActionConfigurationException('Action configuration "{0}" has an invalid timeout: {1}'.format(
+                    action_name, timeout
+            ))
+
+        action_class = self.get_action_class(action_type)
 
         if action_config_json.get('ignore', False):
-            print('==== Ignoring action "{0}".'.format(action_name))
+            logger.debug('Ignoring action "%s".', action_name)
             return
 
         if not action_class.valid_deploy_env(self.deploy_env):
-            print('==== Ignoring action "{0}" due to deploy environment "{1}".'.format(action_name, self.deploy_env))
+            logger.debug('Ignoring action "%s" due to deploy environment "%s".', action_name, self.deploy_env)
             return
 
-        action = action_class(action_name, self.config_file_dir, action_config_json, **self.action_kwargs)
-        self.actions.append(action)
-        self.actions_by_name[action_name] = action
+        self.action_names.add(action_name)
+
+        if self.shard is not None:
+            # Actions are sharded by realm, unless they have an explicit shard key, so that dependent actions stay together.
+            shard_key = action_config_json.get('shardKey', None)
+            if shard_key is None:
+                shard_key = action_class.shard_key(self.config_file_dir, action_config_json)
+            if shard_key is None:
+                self.keyless_action_names.append(action_name)
+            if shard_of(shard_key, self.shard[1]) != self.shard[0]:
+                logger.debug('Ignoring action "%s", assigned to another shard.', action_name)
+                return
+
+        self.pending_actions.append((action_name, action_class, action_config_json))
+
+    def declared_resources(self):
+        """
+        Collect the resources declared by all the configured actions, including the ignored ones and those for other
+        deployment environments, which prune actions must keep.
+        :return: The frozenset of (realm name, kind, key) tuples.
+        """
+
+        resources = set()
+        for action_config_json in self.action_config_json:
+            action_class = self.get_action_class(action_config_json['action'])
+            resources.update(action_class.declared_resources(self.config_file_dir, action_config_json))
+        return frozenset(resources)
+
+    def build_action(self, action_name, action_class, action_config_json):
+        """
+        Construct an action instance.
+        :param action_name: The action name.
+        :param action_class: The action class.
+        :param action_config_json: The action JSON configuration.
+        :return: The action instance.
+        """
+
+        return action_class(action_name, self.config_file_dir, action_config_json, **self.action_kwargs)
 
     def is_empty(self):
-        return len(self.actions) == 0
+        return len(self.pending_actions) == 0
+
+    def plan(self, keycloak_client):
+        """
+        Describe the changes the pending actions would make, without executing them.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: A list of (action name, action type, change descriptions) tuples, the change descriptions being None
+        for the actions which cannot be previewed.
+        """
+
+        previews = []
+        for action_name, action_class, action_config_json in self.pending_actions:
+            action = self.build_action(action_name, action_class, action_config_json)
+            previews.append((action_name, action_config_json['action'], action.plan(keycloak_client)))
+        return previews
+
+    def execute_action(self, keycloak_client, action_name, action_class, action_config_json, action=None):
+        """
+        Construct and execute a single action, within its deadline: its `timeout` property, or the default action timeout.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :param action_name: The action name.
+        :param action_class: The action class.
+        :param action_config_json: The action JSON configuration.
+        :param action: The action instance, if it was built ahead of its execution.
+        """
+
+        start = time.perf_counter()
+        timeout = action_config_json.get('timeout', self.action_timeout)
+
+        try:
+            try:
+                with deadline(timeout):
+                    if self.profiler is None:
+                        if action is None:
+                            action = self.build_action(action_name, action_class, action_config_json)
+                        action.execute(keycloak_client)
+                    else:
+                        action = self.profiler.construct(
+                                action_name, lambda: self.build_action(action_name, action_class, action_config_json)
+                        )
+                        self.profiler.execute(action_name, lambda: action.execute(keycloak_client))
+            except DeadlineExceededException:
+                raise ActionExecutionException('Action "{0}" did not complete within its {1}s deadline'.format(
+                        action_name, timeout
+                ))
+        except Exception as e:
+            self.action_results[action_name] = (FAILED, time.perf_counter() - start, str(e))
+            raise
+
+        elapsed = time.perf_counter() - start
+        self.action_durations.append((elapsed, action_name, action_config_json['action']))
+        if self.slow_action_threshold is not None and elapsed >= self.slow_action_threshold:
+            logger.warning('Action "%s" (%s) was slow, completed in %.2fs.', action_name, action_config_json['action'],
+                           elapsed, extra={'action': action_name, 'elapsed': elapsed, 'slow': True})
+        else:
+            logger.info('Action "%s" (%s) completed in %.2fs.', action_name, action_config_json['action'], elapsed,
+                        extra={'action': action_name, 'elapsed': elapsed})
+        self.record_completion(action_name, elapsed)
+
+    def collect_batch(self, index):
+        """
+        Collect the run of consecutive pending actions, starting at an index, which can be coalesced into a single
+        partial import.
+        :param index: The index of the first pending action.
+        :return: A tuple of the partial import batch (or None) and the list of (pending action, resource key) tuples.
+        """
+
+        # Imported here, as the HTTP stack is not needed to only process the configuration.
+        from .partial_import import PartialImportBatch
+
+        batch = None
+        entries = []
+        for pending_action in self.pending_actions[index:]:
+            action_name, action_class, action_config_json = pending_action
+            if not action_class.COALESCIBLE:
+                break
+
+            try:
+                resource = self.build_action(action_name, action_class, action_config_json).partial_import()
+            except InvalidActionConfigurationException:
+                # The action fails when executed on its own.
+                resource = None
+
+            if resource is None:
+                break
+
+            realm_name, resource_type, resource_name, representation = resource
+            if batch is None:
+                batch = PartialImportBatch(realm_name)
+            elif not batch.accepts(realm_name, resource_type, resource_name):
+                break
+
+            batch.add(resource_type, resource_name, representation)
+            entries.append((pending_action, (resource_type, resource_name)))
+
+        return batch, entries
+
+    def execute_batch(self, keycloak_client, batch, entries):
+        """
+        Execute a run of actions with a single partial import. The actions whose resource was not added by the partial
+        import (because it already exists, or because the import failed) are then executed one by one.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :param batch: The partial import batch.
+        :param entries: The list of (pending action, resource key) tuples of the batch.
+        """
+
+        from .partial_import import ADDED
+
+        start = time.perf_counter()
+        results = batch.execute(keycloak_client) or {}
+        elapsed = time.perf_counter() - start
+
+        for (action_name, action_class, action_config_json), resource_key in entries:
+            if results.get(resource_key) == ADDED:
+                logger.info('Action "%s" (%s) completed in a partial import of %s action(s).', action_name,
+                            action_config_json['action'], len(entries),
+                            extra={'action': action_name, 'elapsed': elapsed, 'coalesced': len(entries)})
+                self.record_completion(action_name, elapsed)
+            else:
+                self.execute_action(keycloak_client, action_name, action_class, action_config_json)
+
+    def schedule_prefetches(self, keycloak_client, prefetch_executor, index):
+        """
+        Build the actions following an index, up to the prefetch depth, and submit their lookups to the prefetch worker.
+        Only lookups run ahead: the actions themselves are executed in order, and the cache discards the lookup results
+        which the requests of the actions executed in the meantime may have affected.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :param prefetch_executor: The executor running the prefetches.
+        :param index: The index of the action about to be executed.
+        """
+
+        for next_index in range(index + 1, min(index + 1 + self.prefetch_depth, len(self.pending_actions))):
+            if next_index in self.prefetched:
+                continue
+
+            action_name, action_class, action_config_json = self.pending_actions[next_index]
+            try:
+                action = self.build_action(action_name, action_class, action_config_json)
+            except InvalidActionConfigurationException:
+                # The action fails when executed.
+                self.prefetched[next_index] = (None, None)
+                continue
+
+            self.prefetched[next_index] = (action, prefetch_executor.submit(self.prefetch_action, action, keycloak_client))
+
+    @staticmethod
+    def prefetch_action(action, keycloak_client):
+        try:
+            action.prefetch(keycloak_client)
+        except Exception as e:
+            # The action runs into the same error when executed, and reports it then.
+            logger.debug('Prefetching for action "%s" failed: %s', action.name, e)
+
+    def take_prefetched_action(self, index):
+        """
+        Get the action built ahead of its execution, once its prefetch completed.
+        :param index: The index of the action.
+        :return: The action instance, or None if it was not built ahead.
+        """
+
+        action, future = self.prefetched.pop(index, (None, None))
+        if future is not None:
+            # Any lookup still in flight is awaited rather than issued again.
+            future.result()
+        return action
+
+    def start_journal(self):
+        """
+        Fingerprint the pending actions, and start recording the run in the journal. When resuming, the actions
+        completed by the previous run are skipped, up to the first one whose configuration changed since.
+        :return: The index of the first pending action to execute.
+        """
+
+        self.fingerprints = {}
+        for action_name, action_class, action_config_json in self.pending_actions:
+            self.fingerprints[action_name] = action_fingerprint(action_class, self.config_file_dir, action_config_json)
+
+        resume_index = 0
+        resumed_from = None
+        if self.resume:
+            completed_actions = self.journal.completed_actions()
+            if completed_actions:
+                resumed_from = self.journal.last_run_id()
+            else:
+                logger.info('No unfinished run to resume, executing all actions.')
+
+            for (completed_name, completed_fingerprint), pending_action in zip(completed_actions, self.pending_actions):
+                action_name = pending_action[0]
+                if completed_name != action_name or completed_fingerprint != self.fingerprints[action_name]:
+                    break
+                resume_index += 1
+
+            if completed_actions and resume_index < len(completed_actions):
+                logger.info('%s of the %s action(s) completed by the previous run changed since, or were reordered.',
+                            len(completed_actions) - resume_index, len(completed_actions))
+
+        self.journal.start(resumed_from)
+        for action_name, action_class, action_config_json in self.pending_actions[:resume_index]:
+            logger.info('Skipping action "%s", completed by the previous run.', action_name)
+            self.journal.record(action_name, self.fingerprints[action_name], resumed=True)
+            self.action_results[action_name] = (RESUMED, 0.0, None)
+        return resume_index
+
+    def record_completion(self, action_name, elapsed):
+        """
+        Record the completion of an action, and in the journal, if any.
+        :param action_name: The action name.
+        :param elapsed: The time (in seconds) the action took.
+        """
+
+        self.action_results[action_name] = (COMPLETED, elapsed, None)
+        if self.journal is not None:
+            self.journal.record(action_name, self.fingerprints[action_name])
 
     def execute(self, keycloak_client):
-        for action in self.actions:
-            action.execute(keycloak_client)
+        start = time.perf_counter()
+        index = self.start_journal() if self.journal is not None else 0
+        prefetch_executor = None
+        if self.prefetch_depth > 0:
+            prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        try:
+            while index < len(self.pending_actions):
+                if self.coalesce:
+                    batch, entries = self.collect_batch(index)
+                    if len(entries) > 1:
+                        for batch_index in range(index, index + len(entries)):
+                            self.take_prefetched_action(batch_index)
+                        self.execute_batch(keycloak_client, batch, entries)
+                        index += len(entries)
+                        continue
+
+                action = self.take_prefetched_action(index)
+                if prefetch_executor is not None:
+                    self.schedule_prefetches(keycloak_client, prefetch_executor, index)
+
+                action_name, action_class, action_config_json = self.pending_actions[index]
+                self.execute_action(keycloak_client, action_name, action_class, action_config_json, action)
+                index += 1
+
+            if self.journal is not None:
+                self.journal.finish()
+        finally:
+            if prefetch_executor is not None:
+                prefetch_executor.shutdown(cancel_futures=True)
+                self.prefetched = {}
+            if self.journal is not None:
+                self.journal.close()
+        logger.info('Executed %s action(s) in %.2fs.', len(self.pending_actions), time.perf_counter() - start)
+        if self.action_durations:
+            slowest = sorted(self.action_durations, reverse=True)[:SLOWEST_ACTIONS_REPORTED]
+            logger.info('Slowest action(s): %s.', ', '.join(
+                    '"{0}" ({1}) {2:.2f}s'.format(action_name, action_type, elapsed) for elapsed, action_name, action_type in slowest
+            ))
+        for realm_name, existing, total in self.upsert_stats.summary():
+            logger.info('%s of the %s resource(s) created or updated in realm "%s" already existed.', existing, total, realm_name)
@@ -0,0 +1,307 @@
+"""
+Batch Runner.
+~~~~~~~~~~~~~
+
+Applies several deployment configurations in a single process, with a single logged-in Keycloak client whose
+connections, worker pool and caches are shared by all the configurations. Configurations whose realms do not overlap are
+applied in parallel, while a configuration sharing a realm with an earlier one waits for it to finish. Configurations
+with actions whose realm is not known, such as custom actions without a `realmName`, are applied on their own.
+"""
+
+from .__main__ import validate_positive
+from .actions_engine import ActionsEngine
+from .deploy_config import DeployConfig
+from .encryption import EncryptionHelper
+from .json import JsonLoader
+from .log import configure_logging
+from .log import LOG_FORMAT_TEXT
+from .log import LOG_FORMATS
+from .log import LOG_LEVELS
+from .log import LOGGER_NAME
+
+import click
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(LOGGER_NAME)
+
+DEFAULT_PARALLELISM = 4
+
+
+class ConfigRun(object):
+    """
+    The application of a deployment configuration within a batch.
+    """
+
+    __slots__ = ['deploy_config_dir', 'deploy_env', 'actions_engine', 'realms', 'error', 'elapsed']
+
+    def __init__(self, deploy_config_dir, deploy_env):
+        self.deploy_config_dir = deploy_config_dir
+        self.deploy_env = deploy_env
+        self.actions_engine = None
+        # The realms of the actions, or None if the realm of an action is not known.
+        self.realms = set()
+        self.error = None
+        self.elapsed = 0.0
+
+    @property
+    def label(self):
+        return '{0} ({1})'.format(self.deploy_config_dir, self.deploy_env)
+
+    def load(self, json_loader, engine_kwargs):
+        """
+        Render the configuration, and find the realms of its actions.
+        :param json_loader: The object used to load JSON, decrypting encrypted values.
+        :param engine_kwargs: The options of the actions engine.
+        """
+
+        try:
+            config = DeployConfig(self.deploy_config_dir, self.deploy_env, json_loader)
+            self.actions_engine = ActionsEngine(
+                    self.deploy_env, config.get_config_dir(), config.get_json_config(), json_loader, **engine_kwargs
+            )
+        except Exception as e:
+            self.error = 'Invalid configuration: {0}'.format(e)
+            return
+
+        for action_name, action_class, action_config_json in self.actions_engine.pending_actions:
+            realm_name = action_class.shard_key(self.actions_engine.config_file_dir, action_config_json)
+            if realm_name is None:
+                self.realms = None
+                return
+            self.realms.add(realm_name)
+
+    def overlaps(self, other):
+        """
+        Returns True if the configuration may modify the same realms as another one, False otherwise.
+        :param other: The other configuration run.
+        """
+
+        return self.realms is None or other.realms is None or not self.realms.isdisjoint(other.realms)
+
+    def execute(self, keycloak_client):
+        start = time.perf_counter()
+        try:
+            self.actions_engine.execute(keycloak_client)
+        except Exception as e:
+            self.error = str(e)
+        self.elapsed = time.perf_counter() - start
+        return self
+
+
+def run_batch(runs, keycloak_client, parallelism=DEFAULT_PARALLELISM):
+    """
+    Apply the configurations of a batch, in parallel where their realms do not overlap. A configuration starts once the
+    earlier configurations it overlaps with are done, whether they succeeded or not.
+    :param runs: The configuration runs, in order, loaded.
+    :param keycloak_client: The logged-in client shared by the configurations.
+    :param parallelism: The maximum number of configurations applied at the same time.
+    """
+
+    # The indexes of the earlier runs each run waits for.
+    waits_for = [
+        set(index for index, earlier in enumerate(runs[:run_index]) if earlier.actions_engine is not None and run.overlaps(earlier))
+        for run_index, run in enumerate(runs)
+    ]
+    remaining = [index for index, run in enumerate(runs) if run.actions_engine is not None]
+    done = set(index for index, run in enumerate(runs) if run.actions_engine is None)
+    running = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix='batch') as executor:
+        while remaining or running:
+            for index in list(remaining):
+                if len(running) >= parallelism:
+                    break
+                if waits_for[index] <= done:
+                    remaining.remove(index)
+                    logger.info('Applying configuration %s...', runs[index].label)
+                    running[executor.submit(runs[index].execute, keycloak_client)] = index
+
+            completed, not_completed = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                index = running.pop(future)
+                done.add(index)
+                future.result()
+                run = runs[index]
+                if run.error is None:
+                    logger.info('Configuration %s applied in %.2fs.', run.label, run.elapsed)
+                else:
+                    logger.error('Configuration %s failed after %.2fs: %s', run.label, run.elapsed, run.error)
+
+
+def read_batch_file(path):
+    """
+    Read the configurations of a batch file: a JSON list of objects with `deployConfigDir` and `deployEnv` properties,
+    the directories being relative to the batch file.
+    :param path: The batch file path.
+    :return: The list of (deployment configuration directory, deployment environment) tuples.
+    """
+
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(path)
+    return [(os.path.join(base_dir, entry['deployConfigDir']), entry['deployEnv']) for entry in entries]
+
+
+@click.command()
+@click.option(
+        '--keycloak-base-url',
+        type=click.STRING,
+        required=True,
+        help='The base URL for the Keycloak service, or the comma-separated base URLs of the nodes of a Keycloak cluster'
+)
+@click.option(
+        '--keycloak-timeout',
+        type=click.INT,
+        default=180,
+        help='The timeout to use while waiting for Keycloak to become available'
+)
+@click.option(
+        '--keycloak-connect-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        default=10,
+        help='The timeout (in seconds) for connecting to Keycloak'
+)
+@click.option(
+        '--keycloak-read-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        default=60,
+        help='The timeout (in seconds) for receiving data from Keycloak, between two reads'
+)
+@click.option(
+        '--keycloak-username',
+        type=click.STRING,
+        required=True,
+        help='The Keycloak administrator username'
+)
+@click.option(
+        '--keycloak-password',
+        type=click.STRING,
+        required=True,
+        help='The Keycloak administrator password'
+)
+@click.option(
+        '--config',
+        type=(click.Path(exists=True, file_okay=False), click.STRING),
+        multiple=True,
+        help='A deployment configuration directory and the target deployment environment, may be repeated'
+)
+@click.option(
+        '--batch-file',
+        type=click.Path(exists=True, dir_okay=False),
+        help='A JSON file listing the configurations, as objects with deployConfigDir and deployEnv properties'
+)
+@click.option(
+        '--parallelism',
+        type=click.IntRange(min=1),
+        default=DEFAULT_PARALLELISM,
+        help='The maximum number of configurations applied at the same time'
+)
+@click.option(
+        '--encryption-prefix',
+        type=click.STRING,
+        help='Prefix of all encrypted values to be used to determine if any decryption is required'
+)
+@click.option(
+        '--aws-profile',
+        type=click.STRING,
+        help='AWS profile to be used for contacting KMS when decryption is required'
+)
+@click.option(
+        '--action-timeout',
+        type=click.FLOAT,
+        callback=validate_positive,
+        help='If supplied, the default deadline (in seconds) of each action, covering all its requests'
+)
+@click.option(
+        '--results-file',
+        type=click.Path(dir_okay=False),
+        help='If supplied, write the outcome of each configuration and of its actions to this JSON file'
+)
+@click.option(
+        '--max-workers',
+        type=click.INT,
+        default=8,
+        help='The maximum number of concurrent requests made to Keycloak'
+)
+@click.option(
+        '--log-level',
+        type=click.Choice(LOG_LEVELS),
+        default='INFO',
+        help='The minimum level of the log messages to output'
+)
+@click.option(
+        '--log-format',
+        type=click.Choice(LOG_FORMATS),
+        default=LOG_FORMAT_TEXT,
+        help='The format of the log messages, either plain text or JSON lines'
+)
+def main(
+        keycloak_base_url,
+        keycloak_timeout,
+        keycloak_connect_timeout,
+        keycloak_read_timeout,
+        keycloak_username,
+        keycloak_password,
+        config,
+        batch_file,
+        parallelism,
+        encryption_prefix,
+        aws_profile,
+        action_timeout,
+        results_file,
+        max_workers,
+        log_level,
+        log_format
+):
+    configure_logging(log_level, log_format)
+
+    configs = list(config)
+    if batch_file:
+        configs.extend(read_batch_file(batch_file))
+    if not configs:
+        raise click.UsageError('No configuration, use --config or --batch-file')
+
+    json_loader = JsonLoader(EncryptionHelper(encryption_prefix, aws_profile))
+    runs = [ConfigRun(deploy_config_dir, deploy_env) for deploy_config_dir, deploy_env in configs]
+    for run in runs:
+        run.load(json_loader, {'action_timeout': action_timeout})
+        if run.error is not None:
+            logger.error('Configuration %s: %s', run.label, run.error)
+
+    # Imported here, as the HTTP stack is not needed to only process the configuration.
+    from .keycloak_client import KeycloakClient
+
+    client = KeycloakClient(
+            keycloak_base_url, max_workers=max_workers, connect_timeout=keycloak_connect_timeout,
+            read_timeout=keycloak_read_timeout
+    )
+    try:
+        if not client.wait_for_availability(keycloak_timeout) or \
+                not client.initialize_session(keycloak_username, keycloak_password):
+            sys.exit(1)
+        run_batch(runs, client, parallelism)
+    finally:
+        client.close()
+
+    for run in runs:
+        click.echo('{0}: {1}'.format(run.label, 'OK ({0:.2f}s)'.format(run.elapsed) if run.error is None else run.error))
+
+    if results_file:
+        from .results import build_results
+        from .results import write_results
+        write_results(results_file, [
+            dict(build_results(run.actions_engine, run.elapsed, run.error) if run.actions_engine is not None else
+                 {'success': False, 'error': run.error, 'actions': []},
+                 deployConfigDir=run.deploy_config_dir)
+            for run in runs
+        ])
+
+    if any(run.error is not None for run in runs):
+        sys.exit(1)
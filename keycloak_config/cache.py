@@ -0,0 +1,193 @@
+"""
+Keycloak Cache.
+~~~~~~~~~~~~~~~
+"""
+
+import collections
+import re
+import threading
+import urllib.parse
+
+# The kinds of resources held in the cache.
+CLIENTS = 'clients'
+GROUPS = 'groups'
+ROLES = 'roles'
+USERS = 'users'
+
+# Maps the first path segment below a realm to the kind of resource it modifies.
+PATH_SEGMENT_KINDS = {
+    'clients': CLIENTS,
+    'groups': GROUPS,
+    'roles': ROLES,
+    'roles-by-id': ROLES,
+    'users': USERS
+}
+
+# Segments below a realm which may modify any kind of resource.
+REALM_WIDE_SEGMENTS = ['', 'partialImport']
+
+REALMS_PATH_PATTERN = re.compile(r'^/*admin/realms/*$')
+REALM_PATH_PATTERN = re.compile(r'^/*admin/realms/([^/?]+)/*([^/?]*)')
+USER_PATH_PATTERN = re.compile(r'^/*admin/realms/[^/?]+/+users/*([^/?]*)/*([^/?]*)')
+
+# Sub-resources of a user whose modification leaves the cached user representation unchanged.
+USER_SUB_RESOURCES = ['groups', 'reset-password', 'role-mappings']
+
+# Stands for the ID of a resource being created, which may only affect negative lookups.
+NEW_RESOURCE = object()
+
+# The number of invalidations remembered to tell whether a lookup which started before them is still valid.
+MAX_CHANGES = 1024
+
+
+class RealmCache(object):
+    """
+    A cache of resource lookups for a single realm, keyed by resource kind and a natural key (client ID, role name, ...).
+    Lookups which found nothing are cached as well, as a None value.
+    """
+
+    def __init__(self, realm_name):
+        self.realm_name = realm_name
+        self.entries = {}
+        self.lock = threading.Lock()
+        # Incremented by every invalidation, which is remembered as a (generation, kind, resource ID) tuple.
+        self.generation = 0
+        self.changes = collections.deque(maxlen=MAX_CHANGES)
+
+    def contains(self, kind, key):
+        with self.lock:
+            return (kind, key) in self.entries
+
+    def get(self, kind, key, default=None):
+        with self.lock:
+            return self.entries.get((kind, key), default)
+
+    def current_generation(self):
+        """
+        Get the generation of the cache, to be passed to put() by a lookup started now.
+        :return: The generation.
+        """
+
+        with self.lock:
+            return self.generation
+
+    def put(self, kind, key, value, generation=None):
+        """
+        Cache a lookup result.
+        :param kind: The kind of resource.
+        :param key: The natural key of the resource.
+        :param value: The resource representation, or None if the lookup found nothing.
+        :param generation: The generation of the cache when the lookup started, if it may have run concurrently with
+        modifying requests. The result is then discarded if an invalidation since may have affected it.
+        :return: True if the result was cached, False if it was discarded.
+        """
+
+        with self.lock:
+            if generation is not None and self.is_stale(kind, value, generation):
+                return False
+            self.entries[(kind, key)] = value
+            return True
+
+    def is_stale(self, kind, value, generation):
+        if generation < self.generation - len(self.changes):
+            # Some of the invalidations since were forgotten.
+            return True
+
+        for change_generation, change_kind, resource_id in self.changes:
+            if change_generation <= generation:
+                continue
+            if change_kind is None:
+                return True
+            if change_kind == kind and (resource_id is None or value is None or value.get('id', None) == resource_id):
+                return True
+        return False
+
+    def invalidate(self, kind=None, resource_id=None):
+        """
+        Drop cached entries.
+        :param kind: The kind of resource to drop, or None to drop all entries.
+        :param resource_id: The ID of the single resource of that kind to drop, along with the negative lookups, or None
+        to drop all entries of that kind. NEW_RESOURCE only drops the negative lookups.
+        """
+
+        with self.lock:
+            self.generation += 1
+            self.changes.append((self.generation, kind, resource_id))
+            if kind is None:
+                self.entries.clear()
+            elif resource_id is None:
+                for entry_key in [entry_key for entry_key in self.entries if entry_key[0] == kind]:
+                    del self.entries[entry_key]
+            else:
+                # A modified resource may no longer match its key, or now match the key of a negative lookup.
+                for entry_key in [entry_key for entry_key, value in self.entries.items() if entry_key[0] == kind and (
+                        value is None or value.get('id', None) == resource_id)]:
+                    del self.entries[entry_key]
+
+
+class KeycloakCache(object):
+    """
+    The per-realm caches of a Keycloak client.
+    """
+
+    def __init__(self):
+        self.realms = {}
+        self.lock = threading.Lock()
+
+    def realm(self, realm_name):
+        """
+        Get the cache of a realm, creating it if needed.
+        :param realm_name: The realm name.
+        :return: The realm cache.
+        """
+
+        with self.lock:
+            if realm_name not in self.realms:
+                self.realms[realm_name] = RealmCache(realm_name)
+            return self.realms[realm_name]
+
+    def clear(self, realm_name=None):
+        """
+        Drop cached entries.
+        :param realm_name: The realm to drop, or None to drop all realms.
+        """
+
+        # Realm caches are kept, so that lookups running concurrently can tell that their results may be stale.
+        with self.lock:
+            if realm_name is None:
+                realm_caches = list(self.realms.values())
+            else:
+                realm_caches = [self.realms[realm_name]] if realm_name in self.realms else []
+        for realm_cache in realm_caches:
+            realm_cache.invalidate()
+
+    def invalidate_path(self, path):
+        """
+        Drop the entries which may be affected by a modifying request.
+        :param path: The request path, relative to the base URL.
+        """
+
+        if REALMS_PATH_PATTERN.match(path):
+            # A realm import.
+            self.clear()
+            return
+
+        match = REALM_PATH_PATTERN.match(path)
+        if not match:
+            return
+
+        realm_name = urllib.parse.unquote(match.group(1))
+        segment = match.group(2)
+
+        if segment in REALM_WIDE_SEGMENTS:
+            self.clear(realm_name)
+        elif segment == 'users':
+            user_match = USER_PATH_PATTERN.match(path)
+            if not user_match.group(1):
+                # A user creation.
+                self.realm(realm_name).invalidate(USERS, NEW_RESOURCE)
+            elif user_match.group(2) not in USER_SUB_RESOURCES:
+                # A single user, or one of its sub-resources.
+                self.realm(realm_name).invalidate(USERS, urllib.parse.unquote(user_match.group(1)))
+        elif segment in PATH_SEGMENT_KINDS:
+            self.realm(realm_name).invalidate(PATH_SEGMENT_KINDS[segment])
@@ -0,0 +1,82 @@
+"""
+Deadlines.
+~~~~~~~~~~
+
+An action may be given a deadline, which bounds all the requests it makes, including the retried requests and those made
+from the worker pool on its behalf. The deadline is kept in thread-local state, and handed over to the worker threads by
+the Keycloak client.
+"""
+
+import contextlib
+import threading
+import time
+
+_state = threading.local()
+
+
+class DeadlineExceededException(Exception):
+    pass
+
+
+def current_deadline():
+    """
+    Get the deadline of the current thread.
+    :return: The deadline, as a time.monotonic() value, or None if there is no deadline.
+    """
+
+    return getattr(_state, 'deadline', None)
+
+
+def remaining_time():
+    """
+    Get the time left until the deadline of the current thread.
+    :return: The time left (in seconds), or None if there is no deadline.
+    :raise DeadlineExceededException: If the deadline has passed.
+    """
+
+    deadline_time = current_deadline()
+    if deadline_time is None:
+        return None
+    remaining = deadline_time - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededException('Deadline exceeded')
+    return remaining
+
+
+@contextlib.contextmanager
+def deadline(timeout):
+    """
+    Set a deadline for the current thread, within the current deadline, if any.
+    :param timeout: The time (in seconds) from now until the deadline, or None for no further bound.
+    """
+
+    previous = current_deadline()
+    deadline_time = previous
+    if timeout is not None:
+        deadline_time = time.monotonic() + timeout
+        if previous is not None:
+            deadline_time = min(previous, deadline_time)
+
+    _state.deadline = deadline_time
+    try:
+        yield
+    finally:
+        _state.deadline = previous
+
+
+def run_with_deadline(deadline_time, func, *args, **kwargs):
+    """
+    Call a function with the deadline of another thread, such as the thread which submitted the call to a worker pool.
+    :param deadline_time: The deadline, as returned by current_deadline().
+    :param func: The function to call.
+    :param args: The positional arguments.
+    :param kwargs: The keyword arguments.
+    :return: The result of the call.
+    """
+
+    previous = current_deadline()
+    _state.deadline = deadline_time
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _state.deadline = previous
@@ -1,16 +1,287 @@
 """
 Deployment Configuration.
 ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Besides actions, the configuration may contain foreach entries, which generate an action for every row of parameters,
+from an action template whose strings refer to the parameters as `#{each.NAME}`:
+
+    {"foreach": [{"tenant": "a"}, {"tenant": "b"}], "template": {"name": "create-#{each.tenant}", ...}}
+
+The rows are either inline, or read from a CSV file (with a header line) or a JSON lines file with `foreachFile`. The
+generated actions are expanded from the template on access, so that only the rows are kept in memory.
 """
 
+import collections.abc
+import copy
+import csv
+import io
+import json
 import os
 import re
 
+VARIABLE_PATTERN = re.compile(r'#\{([^}]+)}')
+
+# The references to the parameters of foreach templates, which are left to the expansion by the variable processing.
+EACH_PREFIX = 'each.'
+EACH_PATTERN = re.compile(r'#\{\s*each\.([^}]*?)\s*}')
+
+# The values of CSV parameters which are read as booleans, all other values being strings.
+CSV_BOOLEANS = {'true': True, 'false': False}
+
+DEFAULT_VARIABLES_FILE = 'defaults.var'
+VARIABLES_FILE_EXTENSION = '.var'
+
 
 class InvalidConfigurationException(Exception):
     pass
 
 
+class ConfigTemplate(object):
+    """
+    A configuration tokenized into literal text and variable references, which can be rendered for any number of sets of
+    variables without being parsed again.
+    """
+
+    __slots__ = ['literals', 'variable_names', 'variable_lines']
+
+    def __init__(self, raw_config):
+        """
+        Constructor.
+        :param raw_config: The configuration, before processing the variables.
+        """
+
+        # Splitting on a pattern with one group alternates literal text and variable names, starting and ending with
+        # literal text.
+        tokens = VARIABLE_PATTERN.split(raw_config)
+        self.literals = [tokens[0]]
+        self.variable_names = []
+        self.variable_lines = []
+
+        line = 1 + tokens[0].count('\n')
+        for token, literal in zip(tokens[1::2], tokens[2::2]):
+            variable = token.strip()
+            if variable.startswith(EACH_PREFIX):
+                # A foreach parameter, kept as it is.
+                self.literals[-1] += '#{' + token + '}' + literal
+            elif len(variable) == 0:
+                raise InvalidConfigurationException('Empty variable declaration in configuration (line {0})'.format(line))
+            else:
+                self.variable_names.append(variable)
+                self.variable_lines.append(line)
+                self.literals.append(literal)
+            line += token.count('\n') + literal.count('\n')
+
+    def referenced_variables(self):
+        """
+        Get the variables referenced by the configuration.
+        :return: The line numbers of the references to each variable, by variable name.
+        """
+
+        references = {}
+        for variable, line in zip(self.variable_names, self.variable_lines):
+            references.setdefault(variable, []).append(line)
+        return references
+
+    def resolve_variables(self, variables, environ=None):
+        """
+        Resolve the value of every referenced variable. Environment variables take precedence over the variable files.
+        :param variables: The variables loaded from the variable files.
+        :param environ: The environment variables, os.environ by default.
+        :return: A tuple of the values, by variable name, and the sorted list of unknown variable names.
+        """
+
+        environ = os.environ if environ is None else environ
+        values = {}
+        unknown_variables = []
+        for variable in set(self.variable_names):
+            if variable in environ:
+                values[variable] = environ[variable]
+            elif variable in variables:
+                values[variable] = variables[variable]
+            else:
+                unknown_variables.append(variable)
+        return values, sorted(unknown_variables)
+
+    def render(self, variables, environ=None):
+        """
+        Render the configuration.
+        :param variables: The variables loaded from the variable files.
+        :param environ: The environment variables, os.environ by default.
+        :return: The processed configuration.
+        """
+
+        values, unknown_variables = self.resolve_variables(variables, environ)
+        if unknown_variables:
+            raise InvalidConfigurationException('Unknown variable: {0}'.format(', '.join(unknown_variables)))
+        return self.substitute(values)
+
+    def substitute(self, values):
+        """
+        Substitute resolved values for the variable references.
+        :param values: The values, by variable name, which must include every referenced variable.
+        :return: The processed configuration.
+        """
+
+        parts = [self.literals[0]]
+        for variable, literal in zip(self.variable_names, self.literals[1:]):
+            parts.append(values[variable])
+            parts.append(literal)
+        return ''.join(parts)
+
+
+def template_parameters(value):
+    """
+    Find the foreach parameters referenced by a template.
+    :param value: The template, or a value within it.
+    :return: The set of parameter names.
+    """
+
+    if isinstance(value, str):
+        return set(EACH_PATTERN.findall(value))
+    parameters = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            parameters.update(template_parameters(key))
+            parameters.update(template_parameters(item))
+    elif isinstance(value, list):
+        for item in value:
+            parameters.update(template_parameters(item))
+    return parameters
+
+
+def expand_template(value, row):
+    """
+    Substitute the parameters of a row for their references in a template. A string consisting of a single reference
+    takes the value of the parameter as it is, which may be any JSON value for JSON lines rows.
+    :param value: The template, or a value within it.
+    :param row: The parameters, by name, which must include every referenced parameter.
+    :return: The expanded value, sharing nothing with the template.
+    """
+
+    if isinstance(value, str):
+        match = EACH_PATTERN.fullmatch(value)
+        if match:
+            parameter = row[match.group(1)]
+            return copy.deepcopy(parameter) if isinstance(parameter, (dict, list)) else parameter
+        return EACH_PATTERN.sub(lambda reference: format_parameter(row[reference.group(1)]), value)
+    if isinstance(value, dict):
+        return dict((expand_template(key, row), expand_template(item, row)) for key, item in value.items())
+    if isinstance(value, list):
+        return [expand_template(item, row) for item in value]
+    return value
+
+
+def format_parameter(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class ExpandedActionConfig(collections.abc.Mapping):
+    """
+    The configuration of an action generated by a foreach entry, expanded from the template for a row of parameters
+    whenever a property is accessed. The properties are returned as new objects, which may be modified freely.
+    """
+
+    __slots__ = ['template', 'row']
+
+    def __init__(self, template, row):
+        self.template = template
+        self.row = row
+
+    def __getitem__(self, key):
+        return expand_template(self.template[key], self.row)
+
+    def __iter__(self):
+        return iter(self.template)
+
+    def __len__(self):
+        return len(self.template)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def load_foreach_rows(path, variables=None, environ=None, json_loader=None):
+    """
+    Load the rows of parameters of a foreach entry from a CSV file, with a header line, or a JSON lines file. The
+    variables referenced by the file are processed first. CSV values are strings, except `true` and `false`.
+    :param path: The file path, whose extension is .csv, .jsonl or .ndjson.
+    :param variables: The variables loaded from the variable files.
+    :param environ: The environment variables, os.environ by default.
+    :param json_loader: The object used to load JSON, decrypting encrypted values, or None to leave them as they are.
+    :return: The list of rows.
+    """
+
+    if not os.path.isfile(path):
+        raise InvalidConfigurationException('Foreach file not found: {0}'.format(path))
+
+    with open(path, 'r', newline='') as f:
+        content = ConfigTemplate(f.read()).render(variables or {}, environ)
+
+    if path.endswith('.csv'):
+        rows = [
+            dict((name, CSV_BOOLEANS.get(value, value)) for name, value in row.items())
+            for row in csv.DictReader(io.StringIO(content, newline=''))
+        ]
+        return [json_loader.decrypt(row) for row in rows] if json_loader is not None else rows
+
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        load_json = json_loader.load_json if json_loader is not None else json.loads
+        rows = []
+        for line_number, line in enumerate(content.splitlines(), 1):
+            if line.strip():
+                try:
+                    rows.append(load_json(line))
+                except ValueError as e:
+                    raise InvalidConfigurationException('Invalid JSON in foreach file {0} (line {1}): {2}'.format(
+                            path, line_number, e
+                    ))
+        return rows
+
+    raise InvalidConfigurationException('Unsupported foreach file, expected a .csv or .jsonl file: {0}'.format(path))
+
+
+def expand_foreach(actions_config_json, config_file_dir, variables=None, environ=None, json_loader=None):
+    """
+    Replace the foreach entries of a configuration with the actions they generate.
+    :param actions_config_json: The parsed configuration.
+    :param config_file_dir: The directory containing the configuration file, which foreach file paths are relative to.
+    :param variables: The variables loaded from the variable files, for the foreach files.
+    :param environ: The environment variables, os.environ by default.
+    :param json_loader: The object used to load JSON, decrypting encrypted values, or None to leave them as they are.
+    :return: The list of action configurations.
+    """
+
+    if not isinstance(actions_config_json, list):
+        return actions_config_json
+
+    expanded = []
+    for index, entry in enumerate(actions_config_json):
+        if not isinstance(entry, dict) or ('foreach' not in entry and 'foreachFile' not in entry):
+            expanded.append(entry)
+            continue
+
+        template = entry.get('template', None)
+        if not isinstance(template, dict):
+            raise InvalidConfigurationException('Foreach entry {0} missing property "template"'.format(index))
+
+        if 'foreachFile' in entry:
+            rows = load_foreach_rows(os.path.join(config_file_dir, entry['foreachFile']), variables, environ, json_loader)
+        else:
+            rows = entry['foreach']
+
+        parameters = template_parameters(template)
+        for row_index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                raise InvalidConfigurationException('Foreach entry {0} row {1} is not an object'.format(index, row_index))
+            missing = parameters.difference(row)
+            if missing:
+                raise InvalidConfigurationException('Foreach entry {0} row {1} missing parameter: {2}'.format(
+                        index, row_index, ', '.join(sorted(missing))
+                ))
+            expanded.append(ExpandedActionConfig(template, row))
+    return expanded
+
+
 class DeployConfig(object):
 
     def __init__(self, deploy_config_dir, deploy_env, json_loader):
@@ -31,12 +302,24 @@ class DeployConfig(object):
         if not os.path.isfile(self.deploy_config_file):
             raise InvalidConfigurationException('Configuration file not found: {0}'.format(self.deploy_config_file))
 
-        with open(self.deploy_config_file, 'r') as f:
-            self.raw_config = f.read()
-
         self.variables = self.load_variables()
-        self.processed_config = self.process_config_variables()
-        self.json_config = json_loader.load_json(self.processed_config)
+        # Only the parsed configuration is kept, the raw and processed texts are rendered again when needed.
+        json_config = json_loader.load_json(self.process_config_variables(self.read_raw_config()))
+        # The files of the foreach entries, which the configuration is rendered from as well.
+        self.foreach_files = [
+            os.path.join(self.deploy_src_dir, entry['foreachFile']) for entry in json_config
+            if isinstance(entry, dict) and 'foreachFile' in entry
+        ] if isinstance(json_config, list) else []
+        self.json_config = expand_foreach(json_config, self.deploy_src_dir, self.variables, json_loader=json_loader)
+
+    def read_raw_config(self):
+        """
+        Read the configuration file.
+        :return: The configuration, before processing the variables.
+        """
+
+        with open(self.deploy_config_file, 'r') as f:
+            return f.read()
 
     def load_variables(self):
         """
@@ -44,15 +327,31 @@ class DeployConfig(object):
         :return: A dictionary containing all loaded variables.
         """
 
-        default_variables_file = os.path.join(self.deploy_keycloak_var_dir, 'defaults.var')
+        default_variables_file = os.path.join(self.deploy_keycloak_var_dir, DEFAULT_VARIABLES_FILE)
         default_variables = self.load_variables_file(default_variables_file)
 
-        deploy_env_variables_file = os.path.join(self.deploy_keycloak_var_dir, '{0}.var'.format(self.deploy_env))
+        deploy_env_variables_file = os.path.join(self.deploy_keycloak_var_dir, self.deploy_env + VARIABLES_FILE_EXTENSION)
         deploy_env_variables = self.load_variables_file(deploy_env_variables_file)
 
         default_variables.update(deploy_env_variables)
         return default_variables
 
+    @staticmethod
+    def list_deploy_envs(deploy_config_dir):
+        """
+        List the deployment environments which have a variable file.
+        :param deploy_config_dir: The base directory for the deployment configuration.
+        :return: The sorted list of deployment environment names.
+        """
+
+        deploy_keycloak_var_dir = os.path.join(deploy_config_dir, 'var', 'keycloak')
+        if not os.path.isdir(deploy_keycloak_var_dir):
+            return []
+        return sorted(
+                file_name[:-len(VARIABLES_FILE_EXTENSION)] for file_name in os.listdir(deploy_keycloak_var_dir)
+                if file_name.endswith(VARIABLES_FILE_EXTENSION) and file_name != DEFAULT_VARIABLES_FILE
+        )
+
     @staticmethod
     def load_variables_file(path):
         """
@@ -77,23 +376,14 @@ class DeployConfig(object):
 
         return variables
 
-    def process_config_variables(self):
+    def process_config_variables(self, raw_config):
         """
         Process the variables contained in the configuration.
+        :param raw_config: The configuration, before processing the variables.
         :return: The processed configuration.
         """
 
-        def replacement(matchobj):
-            variable = matchobj.group(1).strip()
-            if len(variable) == 0:
-                raise InvalidConfigurationException('Empty variable declaration in configuration')
-            if variable in os.environ:
-                return os.environ[variable]
-            if variable in self.variables:
-                return self.variables[variable]
-            raise InvalidConfigurationException('Unknown variable: {0}'.format(variable))
-
-        return re.sub(r'#\{([^}]+)}', replacement, self.raw_config)
+        return ConfigTemplate(raw_config).render(self.variables)
 
     def get_json_config(self):
         return self.json_config
@@ -102,4 +392,4 @@ class DeployConfig(object):
         return self.deploy_src_dir
 
     def get_processed_config(self):
-        return self.processed_config
+        return self.process_config_variables(self.read_raw_config())
@@ -1,4 +1,29 @@
-from kmsencryption import decrypt as kmsdecrypt
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def kmsdecrypt(**kwargs):
+    """
+    Decrypt a value with the KMS toolbox.
+    The toolbox pulls in boto3 and botocore, so it is only imported once an encrypted value is actually found.
+    :param kwargs: The arguments for the KMS toolbox decrypt function.
+    :return: The decrypted value.
+    """
+
+    from kmsencryption import decrypt
+    return decrypt(**kwargs)
+
+
+def kmsencrypt(**kwargs):
+    """
+    Encrypt a value with the KMS toolbox.
+    :param kwargs: The arguments for the KMS toolbox encrypt function.
+    :return: The encrypted value, starting with the encryption prefix.
+    """
+
+    from kmsencryption import encrypt
+    return encrypt(**kwargs)
 
 
 class EncryptionHelper(object):
@@ -23,18 +48,42 @@ class EncryptionHelper(object):
 
     def decrypt_string(self, string_content):
         if string_content.startswith(self.encryption_prefix):
-            print('==== DECRYPTING VALUE "{0}".'.format(string_content))
+            logger.debug('Decrypting value.')
             return kmsdecrypt(data=string_content, profile=self.aws_profile, prefix=self.encryption_prefix, env=None)
         return string_content
 
+    def encrypt_string(self, string_content, key_id):
+        """
+        Encrypt a value, so that it is transparently decrypted when loaded back.
+        :param string_content: The value to encrypt.
+        :param key_id: The ARN of the KMS key to encrypt with.
+        :return: The encrypted value.
+        """
+
+        if string_content.startswith(self.encryption_prefix):
+            return string_content
+        logger.debug('Encrypting value.')
+        return kmsencrypt(
+                cmk_arn=key_id, data=string_content, env=None, path=None, profile=self.aws_profile, prefix=self.encryption_prefix
+        )
+
     def decrypt_dict(self, dict_content):
-        result = {}
+        # Containers are only copied along the paths leading to encrypted values, everything else is shared.
+        result = dict_content
         for key, value in dict_content.items():
-            result[key] = self.decrypt(value)
+            decrypted = self.decrypt(value)
+            if decrypted is not value:
+                if result is dict_content:
+                    result = dict(dict_content)
+                result[key] = decrypted
         return result
 
     def decrypt_list(self, list_content):
-        result = []
-        for elem in list_content:
-            result.append(self.decrypt(elem))
+        result = list_content
+        for index, elem in enumerate(list_content):
+            decrypted = self.decrypt(elem)
+            if decrypted is not elem:
+                if result is list_content:
+                    result = list(list_content)
+                result[index] = decrypted
         return result
@@ -0,0 +1,62 @@
+"""
+Fingerprints.
+~~~~~~~~~~~~~
+"""
+
+import collections.abc
+import hashlib
+import json
+
+
+def fingerprint(obj):
+    """
+    Compute a stable fingerprint of a JSON-compatible object.
+    :param obj: The object to fingerprint, which may contain mappings, such as the actions generated by foreach entries.
+    :return: The hexadecimal SHA-256 digest of the canonical JSON serialization of the object.
+    """
+
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=serialize_mapping)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def serialize_mapping(obj):
+    if isinstance(obj, collections.abc.Mapping):
+        return dict(obj)
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(obj).__name__))
+
+
+def file_fingerprint(path):
+    """
+    Compute the fingerprint of a file's contents.
+    :param path: The path of the file.
+    :return: The hexadecimal SHA-256 digest of the file contents, or None if the file does not exist.
+    """
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def action_fingerprint(action_class, config_file_dir, action_config_json, get_file_fingerprint=file_fingerprint):
+    """
+    Compute the fingerprint of an action from its rendered configuration and the files it references.
+    :param action_class: The action class.
+    :param config_file_dir: The directory containing the configuration file.
+    :param action_config_json: The JSON configuration for the action.
+    :param get_file_fingerprint: The function computing the fingerprint of a referenced file.
+    :return: The action fingerprint.
+    """
+
+    file_fingerprints = {}
+    for path in action_class.referenced_files(config_file_dir, action_config_json):
+        file_fingerprints[path] = get_file_fingerprint(path)
+
+    return fingerprint({
+        'config': fingerprint(action_config_json),
+        'files': file_fingerprints
+    })
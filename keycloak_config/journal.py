@@ -0,0 +1,125 @@
+"""
+Run Journal.
+~~~~~~~~~~~~
+
+An append-only file of JSON lines, recording the start of every run, each action completed during the run together with
+the fingerprint of its configuration, and the end of the run. A failed run can then be resumed from its first action
+which did not complete.
+"""
+
+import datetime
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EVENT_START = 'start'
+EVENT_COMPLETED = 'completed'
+EVENT_FINISHED = 'finished'
+
+
+class RunJournal(object):
+
+    def __init__(self, path):
+        """
+        Constructor.
+        :param path: The path of the journal file.
+        """
+
+        self.path = path
+        self.run_id = None
+        self.file = None
+
+    def read_last_run(self):
+        """
+        Read the events of the last run recorded in the journal.
+        A truncated last line, left by a run which was killed while writing it, is ignored.
+        :return: The list of events of the last run, starting with its start event, or an empty list.
+        """
+
+        events = []
+        if not os.path.isfile(self.path):
+            return events
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logger.warning('Ignoring malformed journal entry in "%s".', self.path)
+                    continue
+                if event.get('event') == EVENT_START:
+                    events = []
+                events.append(event)
+        return events
+
+    def completed_actions(self):
+        """
+        Get the actions completed by the last run, if it did not finish.
+        :return: A list of (action name, fingerprint) tuples, in completion order. The list is empty if the last run
+        finished, or if there is no previous run.
+        """
+
+        events = self.read_last_run()
+        if not events or events[-1].get('event') == EVENT_FINISHED:
+            return []
+        return [(event['action'], event['fingerprint']) for event in events if event.get('event') == EVENT_COMPLETED]
+
+    def start(self, resumed_from=None):
+        """
+        Record the start of a run.
+        :param resumed_from: The ID of the run being resumed, if any.
+        """
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.run_id = uuid.uuid4().hex
+        self.file = open(self.path, 'a')
+        self.write({'event': EVENT_START, 'run': self.run_id, 'resumedFrom': resumed_from})
+
+    def record(self, action_name, fingerprint, resumed=False):
+        """
+        Record the completion of an action.
+        :param action_name: The action name.
+        :param fingerprint: The fingerprint of the action configuration.
+        :param resumed: True if the action was completed by the resumed run, and not executed again.
+        """
+
+        self.write({'event': EVENT_COMPLETED, 'run': self.run_id, 'action': action_name, 'fingerprint': fingerprint,
+                    'resumed': resumed})
+
+    def finish(self):
+        """
+        Record the successful end of a run.
+        """
+
+        self.write({'event': EVENT_FINISHED, 'run': self.run_id})
+
+    def last_run_id(self):
+        """
+        Get the ID of the last run recorded in the journal.
+        :return: The run ID, or None.
+        """
+
+        events = self.read_last_run()
+        return events[0].get('run') if events else None
+
+    def write(self, event):
+        """
+        Append an event to the journal, and make sure it reaches the disk before going on.
+        :param event: The event.
+        """
+
+        event['time'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
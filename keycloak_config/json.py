@@ -12,3 +12,6 @@ class JsonLoader():
     def load_json(self, json_content):
         content = json.loads(json_content)
         return self.encryption_helper.decrypt(content)
+
+    def decrypt(self, content):
+        return self.encryption_helper.decrypt(content)
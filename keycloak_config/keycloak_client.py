@@ -3,34 +3,154 @@ Keycloak Client.
 ~~~~~~~~~~~~~~~~
 """
 
+from .cache import KeycloakCache
+from .deadline import current_deadline
+from .deadline import remaining_time
+from .deadline import run_with_deadline
+from .nodes import NodePool
+from .nodes import parse_base_urls
+from .nodes import UNAVAILABLE_STATUS_CODES
+
+import codecs
+import concurrent.futures
+import json
+import logging
 import re
 import requests
+import requests.adapters
+import threading
 import time
 
+logger = logging.getLogger(__name__)
+
+
+# The size of the chunks read from streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = ' \t\n\r'
+
+# Methods whose requests may be sent again to another node after a connection error.
+IDEMPOTENT_METHODS = ('get', 'head', 'put', 'delete')
+
 
 class NoSessionException(Exception):
     pass
 
 
+class UnexpectedResponseException(Exception):
+    """
+    A request of the Keycloak client itself received an unexpected response.
+    """
+
+    def __init__(self, method, path, status_code):
+        super(UnexpectedResponseException, self).__init__('Unexpected response for {0} {1} ({2})'.format(method.upper(), path, status_code))
+        self.status_code = status_code
+
+
+def iterate_json_array(chunks):
+    """
+    Decode the items of a JSON array incrementally, as its text arrives.
+    :param chunks: The chunks of text of the array.
+    :return: A generator of the items.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                position += 1
+            elif buffer[position] == ',':
+                position += 1
+            elif buffer[position] == ']':
+                return
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # The item is incomplete.
+                    break
+                if end == len(buffer):
+                    # A number may continue in the next chunk.
+                    break
+                yield item
+                position = end
+
+    raise ValueError('Truncated or malformed JSON array')
+
+
+def iterate_response_items(response):
+    """
+    Decode the items of a streamed JSON array response incrementally, and close the response once done.
+    :param response: The streamed response.
+    :return: A generator of the items.
+    """
+
+    # JSON is encoded in UTF-8.
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        chunks = (text_decoder.decode(chunk) for chunk in response.iter_content(STREAM_CHUNK_SIZE))
+        yield from iterate_json_array(chunks)
+    finally:
+        response.close()
+
+
 class KeycloakClient(object):
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_READ_TIMEOUT = 60
     ADMIN_LOGIN_CLIENT_ID = 'admin-cli'
     RELATIVE_HEALTH_CHECK_ENDPOINT = '/realms/master'
     RELATIVE_TOKEN_ENDPOINT = '/realms/master/protocol/openid-connect/token'
     HEALTH_CHECK_INTERVAL = 5
     ACCESS_TOKEN_KEY = 'access_token'
+    DEFAULT_PAGE_SIZE = 100
     REFRESH_TOKEN_KEY = 'refresh_token'
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
         """
         Constructor.
-        :param base_url: The base URL of the Keycloak service.
+        :param base_url: The base URL of the Keycloak service, or the base URLs of the nodes of a Keycloak cluster, as a
+        list or comma-separated, to spread the requests across (see the nodes module).
+        :param max_workers: The maximum number of concurrent requests, which is also the size of the connection pool.
+        :param connect_timeout: The timeout (in seconds) for establishing a connection.
+        :param read_timeout: The timeout (in seconds) for receiving data once connected, between two reads.
         :return: The Keycloak client.
         """
 
-        self.base_url = re.sub(r'/+$', '', base_url)
-        self.health_check_endpoint = self.base_url + self.RELATIVE_HEALTH_CHECK_ENDPOINT
-        self.token_endpoint = self.base_url + self.RELATIVE_TOKEN_ENDPOINT
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.nodes = NodePool(parse_base_urls(base_url))
+        self.base_url = self.nodes.nodes[0].base_url
         self.session_data = None
+        self.credentials = None
+        self.cache = KeycloakCache()
+
+        self.max_workers = max(1, max_workers)
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.session_lock = threading.Lock()
+        self.worker_state = threading.local()
+
+        # Connections are kept alive and shared by all requests, including those made from worker threads.
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.nodes), pool_maxsize=self.max_workers)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
 
     # Wait for Keycloak to become available.
     def wait_for_availability(self, timeout):
@@ -43,30 +163,49 @@ class KeycloakClient(object):
         end_time = time.time() + timeout
         while time.time() < end_time:
             if self.check_availability():
-                print('==== Keycloak is available.')
+                logger.info('Keycloak is available.')
                 return True
             else:
-                print('==== Keycloak is not yet available.')
+                logger.info('Keycloak is not yet available.')
                 sleep_duration = min(end_time - time.time(), self.HEALTH_CHECK_INTERVAL)
                 time.sleep(sleep_duration)
 
-        print('==== Keycloak never became available.')
+        logger.error('Keycloak never became available.')
         return False
 
     # Check Keycloak availability by requesting the master realm data.
     def check_availability(self):
         """
-        Check Keycloak availability by requesting the master realm data.
-        :return: True if the Keycloak service is available, False otherwise
+        Check Keycloak availability by requesting the master realm data from every node, ejecting the unavailable nodes
+        and readmitting the available ones.
+        :return: True if at least one node of the Keycloak service is available, False otherwise
+        """
+
+        available = False
+        for node in self.nodes.nodes:
+            available = self.check_node(node) or available
+        return available
+
+    def check_node(self, node):
+        """
+        Check the availability of a node, and report it to the node pool.
+        :param node: The node.
+        :return: True if the node is available, False otherwise
         """
 
         available = False
         try:
-            response = requests.get(self.health_check_endpoint)
+            response = self.http.get(node.base_url + self.RELATIVE_HEALTH_CHECK_ENDPOINT,
+                                     timeout=(self.connect_timeout, self.read_timeout))
             available = response.status_code == requests.codes.ok
         except Exception:
             pass
 
+        if self.nodes.set_health(node, available) and len(self.nodes) > 1:
+            if available:
+                logger.info('Keycloak node %s is available again.', node.base_url)
+            else:
+                logger.warning('Keycloak node %s is unavailable, ejected.', node.base_url)
         return available
 
     def initialize_session(self, username, password):
@@ -85,16 +224,17 @@ class KeycloakClient(object):
         }
 
         try:
-            response = requests.post(self.token_endpoint, data=login_data)
+            response = self.send('post', self.RELATIVE_TOKEN_ENDPOINT, data=login_data)
             if response.status_code == requests.codes.ok:
                 self.session_data = response.json()
-                print('==== Login succeeded.')
+                self.credentials = (username, password)
+                logger.info('Login succeeded.')
                 return True
             else:
-                print('==== Login failed ({0}): {1}'.format(response.status_code, response.text))
+                logger.error('Login failed (%s): %s', response.status_code, response.text)
                 return False
         except Exception as err:
-            print('==== Login failed: {0}'.format(err))
+            logger.error('Login failed: %s', err)
             return False
 
     def refresh_session(self):
@@ -113,18 +253,216 @@ class KeycloakClient(object):
         }
 
         try:
-            response = requests.post(self.token_endpoint, data=login_data)
+            response = self.send('post', self.RELATIVE_TOKEN_ENDPOINT, data=login_data)
             if response.status_code == requests.codes.ok:
                 self.session_data = response.json()
-                print('==== Session refresh succeeded.')
+                logger.debug('Session refresh succeeded.')
                 return True
             else:
-                print('==== Session refresh failed ({0}): {1}'.format(response.status_code, response.text))
+                logger.warning('Session refresh failed (%s): %s', response.status_code, response.text)
                 return False
         except Exception as err:
-            print('==== Session refresh failed: {0}'.format(err))
+            logger.warning('Session refresh failed: %s', err)
+            return False
+
+    def renew_session(self):
+        """
+        Renew the admin session, first with the refresh token, then by logging in again with the original credentials.
+        :return: True if the session could be renewed, False otherwise
+        """
+
+        if self.refresh_session():
+            return True
+
+        if not self.credentials:
             return False
 
+        return self.initialize_session(*self.credentials)
+
+    def renew_session_once(self, session_data):
+        """
+        Renew the admin session after a request was rejected, unless another thread already renewed it.
+        :param session_data: The session data the rejected request was made with.
+        :return: True if a renewed session is available, False otherwise
+        """
+
+        with self.session_lock:
+            if self.session_data is not session_data:
+                return True
+            return self.renew_session()
+
+    def reconnect(self, timeout):
+        """
+        Wait for Keycloak to become available again (e.g. after a restart), and log in again.
+        :param timeout: The maximum amount of time to wait for Keycloak to become available.
+        :return: True if Keycloak is available and the login succeeded, False otherwise
+        """
+
+        if not self.credentials:
+            raise NoSessionException()
+
+        return self.wait_for_availability(timeout) and self.initialize_session(*self.credentials)
+
+    def get_executor(self):
+        """
+        Get the worker pool used to perform requests concurrently, creating it on first use.
+        :return: The executor.
+        """
+
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def run_concurrently(self, func, items, max_concurrency=None):
+        """
+        Apply a function to every item using the worker pool, with at most `max_concurrency` calls in flight.
+        If a call fails, the calls which have not started yet are cancelled, and the error is raised. The calls share the
+        deadline of the calling thread, if any: once it passes, the calls which have not started yet are cancelled, and
+        the requests of those in progress fail.
+        Calls made from a worker thread are executed serially in that thread, so that the pool cannot deadlock.
+        :param func: The function to apply.
+        :param items: The items.
+        :param max_concurrency: The maximum number of concurrent calls, defaults to the size of the worker pool.
+        :return: The results, in the order of the items.
+        """
+
+        items = list(items)
+        limit = min(max_concurrency or self.max_workers, self.max_workers)
+
+        if limit <= 1 or len(items) <= 1 or self.in_worker():
+            return [func(item) for item in items]
+
+        deadline_time = current_deadline()
+
+        def work(item):
+            return run_with_deadline(deadline_time, self.run_as_worker, func, item)
+
+        executor = self.get_executor()
+        results = [None] * len(items)
+        pending = {}
+        remaining = iter(enumerate(items))
+        try:
+            while True:
+                while len(pending) < limit:
+                    next_item = next(remaining, None)
+                    if next_item is None:
+                        break
+                    index, item = next_item
+                    pending[executor.submit(work, item)] = index
+
+                if not pending:
+                    return results
+
+                done, not_done = concurrent.futures.wait(
+                        pending, timeout=remaining_time(), return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def in_worker(self):
+        return getattr(self.worker_state, 'active', False)
+
+    def run_as_worker(self, func, *args, **kwargs):
+        self.worker_state.active = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.worker_state.active = False
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedule a single call on the worker pool.
+        A call made from a worker thread is executed immediately in that thread, so that the pool cannot deadlock.
+        The call has the deadline of the calling thread, if any.
+        :param func: The function to call.
+        :param args: The positional arguments.
+        :param kwargs: The keyword arguments.
+        :return: A future of the result.
+        """
+
+        if not self.in_worker():
+            return self.get_executor().submit(run_with_deadline, current_deadline(), self.run_as_worker, func, *args, **kwargs)
+
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def paginate(self, path, params=None, page_size=DEFAULT_PAGE_SIZE, prefetch=0, stream=False):
+        """
+        Iterate over the items of a list endpoint, walking its pages with the `first` and `max` query parameters. The
+        iteration stops after the first page with less than `page_size` items.
+        :param path: The request path, relative to the base URL.
+        :param params: The other query parameters.
+        :param page_size: The number of items requested per page.
+        :param prefetch: The number of following pages fetched on the worker pool while the items of a page are
+        consumed. Pages are not prefetched from worker threads.
+        :param stream: If True, the items of the pages which are not prefetched are decoded as the response arrives,
+        rather than once it is complete.
+        :return: A generator of the items.
+        :raise UnexpectedResponseException: If a page request does not succeed.
+        """
+
+        def get_page(first):
+            page_params = dict(params or {})
+            page_params['first'] = first
+            page_params['max'] = page_size
+            response = self.get(path, page_params, stream=stream)
+            if response.status_code != requests.codes.ok:
+                response.close()
+                raise UnexpectedResponseException('get', path, response.status_code)
+            return iterate_response_items(response) if stream else response.json()
+
+        def get_page_items(first):
+            return list(get_page(first))
+
+        prefetch = 0 if self.in_worker() else max(prefetch, 0)
+        next_pages = []
+        first = 0
+        page = None
+        try:
+            while True:
+                page = next_pages.pop(0).result() if next_pages else get_page(first)
+
+                # Whether a page is the last one is only known in advance once it has been decoded whole.
+                if prefetch and (stream or len(page) == page_size):
+                    next_first = first + (len(next_pages) + 1) * page_size
+                    while len(next_pages) < prefetch:
+                        next_pages.append(self.submit(get_page_items, next_first))
+                        next_first += page_size
+
+                count = 0
+                for item in page:
+                    count += 1
+                    yield item
+
+                if count < page_size:
+                    return
+                first += page_size
+        finally:
+            if hasattr(page, 'close'):
+                # A streamed page which was not consumed whole.
+                page.close()
+            for future in next_pages:
+                future.cancel()
+
+    def close(self):
+        """
+        Release the worker pool and the pooled connections.
+        """
+
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+        self.http.close()
+
     def get(self, path, params=None, **kwargs):
         """
         Performs a GET request.
@@ -193,12 +531,81 @@ class KeycloakClient(object):
         :return: The resulting response.
         """
 
+        session_data = self.session_data
         new_kwargs = self.add_bearer_token(**kwargs)
-        url = self.base_url + '/' + re.sub(r'^/+', '', path)
-        response = requests.request(method, url, **new_kwargs)
+        response = self.send(method, path, **new_kwargs)
         # We may need to perform a token refresh.
-        if response.status_code == requests.codes.unauthorized and self.refresh_session():
+        if response.status_code == requests.codes.unauthorized and self.renew_session_once(session_data):
             new_kwargs = self.add_bearer_token(**kwargs)
-            response = requests.request(method, url, **new_kwargs)
+            response = self.send(method, path, **new_kwargs)
+
+        # Modifying requests make the cached lookups of the affected resources stale.
+        if method.lower() not in ('get', 'head'):
+            self.cache.invalidate_path(path)
 
         return response
+
+    def send(self, method, path, **kwargs):
+        """
+        Send a request to a node: the healthy node with the fewest requests in flight. After a connection error,
+        idempotent requests are sent again to another node, if any. Requests time out after the connect and read
+        timeouts, or once the deadline of the current thread passes.
+        :param method: The request method.
+        :param path: The request path, relative to the base URL.
+        :param kwargs: The request parameters.
+        :return: The resulting response.
+        """
+
+        for node in self.nodes.nodes_to_check():
+            self.check_node(node)
+
+        path = '/' + re.sub(r'^/+', '', path)
+        tried = []
+        while True:
+            request_kwargs = dict(kwargs)
+            request_kwargs.setdefault('timeout', self.get_timeout())
+            node = self.nodes.acquire(tried)
+            start = time.perf_counter()
+            try:
+                response = self.http.request(method, node.base_url + path, **request_kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                self.release_node(node, time.perf_counter() - start, True)
+                # A request cut short by the deadline fails with the deadline error.
+                remaining_time()
+                tried.append(node)
+                if not isinstance(err, requests.exceptions.ConnectionError) or method.lower() not in IDEMPOTENT_METHODS or \
+                        len(tried) >= len(self.nodes):
+                    raise
+                logger.warning('Request to Keycloak node %s failed, retrying on another node: %s', node.base_url, err)
+                continue
+
+            self.release_node(node, time.perf_counter() - start, response.status_code in UNAVAILABLE_STATUS_CODES)
+            return response
+
+    def get_timeout(self):
+        """
+        Get the connect and read timeouts of a request, bounded by the deadline of the current thread.
+        :return: The (connect timeout, read timeout) tuple.
+        :raise DeadlineExceededException: If the deadline has passed.
+        """
+
+        remaining = remaining_time()
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def release_node(self, node, latency, failed):
+        if self.nodes.release(node, latency, failed):
+            logger.warning('Keycloak node %s failed repeatedly, ejected.', node.base_url)
+
+    def log_node_summary(self):
+        """
+        Log the number of requests made to every node, and their latency.
+        """
+
+        for base_url, request_count, failure_count, mean_latency, max_latency, healthy in self.nodes.summary():
+            logger.info('Keycloak node %s: %s request(s), %s failure(s), %.1fms mean latency, %.1fms max latency%s.',
+                        base_url, request_count, failure_count, mean_latency * 1000, max_latency * 1000,
+                        '' if healthy else ', ejected',
+                        extra={'node': base_url, 'requests': request_count, 'failures': failure_count,
+                               'mean_latency': mean_latency, 'max_latency': max_latency})
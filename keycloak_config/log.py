@@ -0,0 +1,177 @@
+"""
+Logging.
+~~~~~~~~
+
+Log records are handed off to a background thread through a queue, so that the code executing actions never waits on
+I/O. The background thread writes the records through the buffer of the output stream, which is flushed when a warning
+or an error is logged, when the tool exits, and at least once every flush interval.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOGGER_NAME = 'keycloak_config'
+
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+LOG_FORMATS = [LOG_FORMAT_TEXT, LOG_FORMAT_JSON]
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Attributes of every log record, which are not reported as extra fields in JSON lines.
+RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+_listener = None
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formats records in the historical "==== message" style, prefixing warnings and errors with their level.
+    """
+
+    def format(self, record):
+        message = super(TextFormatter, self).format(record)
+        if record.levelno >= logging.WARNING:
+            return '==== {0}: {1}'.format(record.levelname, message)
+        return '==== {0}'.format(message)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects. Values passed with the `extra` logging argument become fields.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    A stream handler which leaves the flushing of the stream to the stream's own buffering, except for warnings and
+    errors, and at most every flush interval.
+    """
+
+    def __init__(self, stream=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super(BufferedStreamHandler, self).__init__(stream)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.force_flush = False
+
+    def emit(self, record):
+        self.force_flush = record.levelno >= logging.WARNING
+        super(BufferedStreamHandler, self).emit(record)
+
+    def flush(self):
+        now = time.monotonic()
+        if self.force_flush or now - self.last_flush >= self.flush_interval:
+            self.flush_now()
+
+    def flush_now(self):
+        self.acquire()
+        try:
+            self.force_flush = False
+            self.last_flush = time.monotonic()
+            if self.stream and hasattr(self.stream, 'flush'):
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush_now()
+        super(BufferedStreamHandler, self).close()
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """
+    A queue listener which flushes its handlers whenever no record arrived for a flush interval.
+    """
+
+    def __init__(self, log_queue, *handlers, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super(FlushingQueueListener, self).__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        if not block:
+            return self.queue.get(False)
+
+        while True:
+            try:
+                return self.queue.get(True, self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    if isinstance(handler, BufferedStreamHandler):
+                        handler.flush_now()
+                    else:
+                        handler.flush()
+
+
+def configure_logging(level='INFO', log_format=LOG_FORMAT_TEXT, stream=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+    """
+    Configure the tool's logging.
+    :param level: The minimum level of the records to output.
+    :param log_format: Either "text" or "json" (JSON lines).
+    :param stream: The stream to write to, defaults to the standard output.
+    :param flush_interval: The maximum amount of time (in seconds) that records stay buffered.
+    :return: The tool's root logger.
+    """
+
+    global _listener
+
+    shutdown_logging()
+
+    handler = BufferedStreamHandler(stream or sys.stdout, flush_interval=flush_interval)
+    if log_format == LOG_FORMAT_JSON:
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(TextFormatter())
+
+    log_queue = queue.Queue(-1)
+    _listener = FlushingQueueListener(log_queue, handler, flush_interval=flush_interval)
+    _listener.start()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for existing_handler in list(logger.handlers):
+        logger.removeHandler(existing_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def shutdown_logging():
+    """
+    Write out all pending records, and stop the background thread.
+    """
+
+    global _listener
+
+    if _listener is not None:
+        listener = _listener
+        _listener = None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(shutdown_logging)
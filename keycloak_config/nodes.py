@@ -0,0 +1,182 @@
+"""
+Keycloak Nodes.
+~~~~~~~~~~~~~~~
+
+The Keycloak client may spread its requests across the nodes of a Keycloak cluster, bypassing the sticky sessions of the
+load balancer in front of it. Each request goes to the healthy node with the fewest requests in flight. A node which fails
+repeatedly (connection errors, or responses telling that it is unavailable) is ejected, and only readmitted once a health
+check succeeds after the ejection period, which doubles with every ejection in a row.
+"""
+
+import re
+import threading
+import time
+
+# Responses of a node which is unavailable, such as a node being restarted behind a proxy.
+UNAVAILABLE_STATUS_CODES = (502, 503, 504)
+
+# The number of failures in a row after which a node is ejected.
+MAX_CONSECUTIVE_FAILURES = 2
+
+# The initial and maximum duration (in seconds) a node stays ejected before it is health-checked again.
+EJECTION_DURATION = 10
+MAX_EJECTION_DURATION = 300
+
+
+def parse_base_urls(base_urls):
+    """
+    Normalize the base URLs of the Keycloak nodes.
+    :param base_urls: A list of base URLs, or a string of comma-separated base URLs.
+    :return: The list of base URLs, without trailing slashes.
+    """
+
+    if isinstance(base_urls, str):
+        base_urls = base_urls.split(',')
+    base_urls = [re.sub(r'/+$', '', base_url.strip()) for base_url in base_urls if base_url.strip()]
+    if not base_urls:
+        raise ValueError('No Keycloak base URL')
+    return base_urls
+
+
+class Node(object):
+    """
+    A Keycloak node, with its request statistics.
+    """
+
+    __slots__ = ['base_url', 'outstanding', 'requests', 'failures', 'consecutive_failures', 'total_latency',
+                 'max_latency', 'ejections', 'ejected_until', 'checking']
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        # The number of ejections in a row, and the time until which the node is ejected (None if it is healthy).
+        self.ejections = 0
+        self.ejected_until = None
+        # Whether a health check of the ejected node is in progress.
+        self.checking = False
+
+    @property
+    def healthy(self):
+        return self.ejected_until is None
+
+
+class NodePool(object):
+    """
+    Picks the node of each request, and tracks the health and latency of the nodes. Thread-safe.
+    """
+
+    def __init__(self, base_urls):
+        """
+        Constructor.
+        :param base_urls: The base URLs of the nodes.
+        """
+
+        self.nodes = [Node(base_url) for base_url in base_urls]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def acquire(self, excluded=()):
+        """
+        Pick the node of a request: the healthy node with the fewest requests in flight, or, if all nodes are ejected,
+        the one to be readmitted first. The request must be reported with release().
+        :param excluded: The nodes the request already failed on, only picked when no other node is left.
+        :return: The node.
+        """
+
+        with self.lock:
+            candidates = [node for node in self.nodes if node not in excluded] or self.nodes
+            healthy = [node for node in candidates if node.healthy]
+            if healthy:
+                node = min(healthy, key=lambda candidate: (candidate.outstanding, candidate.requests))
+            else:
+                node = min(candidates, key=lambda candidate: candidate.ejected_until)
+            node.outstanding += 1
+            return node
+
+    def release(self, node, latency, failed):
+        """
+        Report the completion of a request.
+        :param node: The node of the request.
+        :param latency: The time (in seconds) the node took to answer.
+        :param failed: True if the request failed because of the node.
+        :return: True if the node was ejected following this request.
+        """
+
+        with self.lock:
+            node.outstanding -= 1
+            node.requests += 1
+            node.total_latency += latency
+            node.max_latency = max(node.max_latency, latency)
+            if not failed:
+                node.consecutive_failures = 0
+                return False
+
+            node.failures += 1
+            node.consecutive_failures += 1
+            if node.healthy and len(self.nodes) > 1 and node.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                self.eject(node)
+                return True
+            return False
+
+    def eject(self, node):
+        # Called with the lock held.
+        node.ejections += 1
+        duration = min(EJECTION_DURATION * 2 ** (node.ejections - 1), MAX_EJECTION_DURATION)
+        node.ejected_until = time.monotonic() + duration
+
+    def nodes_to_check(self):
+        """
+        Get the ejected nodes whose ejection period is over, and which are not being health-checked yet. The health
+        check result must be reported with set_health().
+        :return: The list of nodes.
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            nodes = [node for node in self.nodes if not node.healthy and not node.checking and node.ejected_until <= now]
+            for node in nodes:
+                node.checking = True
+            return nodes
+
+    def set_health(self, node, available):
+        """
+        Report the result of a health check: an available node is readmitted, an unavailable node is ejected.
+        :param node: The node.
+        :param available: True if the node is available.
+        :return: True if the health of the node changed.
+        """
+
+        with self.lock:
+            node.checking = False
+            if available:
+                changed = not node.healthy
+                node.ejected_until = None
+                node.ejections = 0
+                node.consecutive_failures = 0
+                return changed
+            if node.healthy and len(self.nodes) == 1:
+                return False
+            changed = node.healthy
+            self.eject(node)
+            return changed
+
+    def summary(self):
+        """
+        Describe the requests made to every node.
+        :return: A list of (base URL, request count, failure count, mean latency, max latency, healthy) tuples, the
+        latencies being in seconds.
+        """
+
+        with self.lock:
+            return [
+                (node.base_url, node.requests, node.failures, node.total_latency / node.requests if node.requests else 0.0,
+                 node.max_latency, node.healthy)
+                for node in self.nodes
+            ]
@@ -0,0 +1,97 @@
+"""
+Partial Import Batches.
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Consecutive actions creating simple resources in the same realm can be coalesced into a single partial import request.
+Resources which already exist are skipped by Keycloak, and the corresponding actions are then executed one by one, so
+that existing resources keep being updated in place rather than overwritten (which would re-create them).
+"""
+
+import logging
+import requests
+import urllib
+
+logger = logging.getLogger(__name__)
+
+# Keycloak resource types, as reported in partial import results.
+REALM_ROLE = 'REALM_ROLE'
+USER = 'USER'
+
+# Partial import result actions.
+ADDED = 'ADDED'
+SKIPPED = 'SKIPPED'
+
+IF_RESOURCE_EXISTS = 'SKIP'
+
+MAX_BATCH_SIZE = 500
+
+
+class PartialImportBatch(object):
+    """
+    A batch of resources to create in a realm with a single partial import request.
+    """
+
+    def __init__(self, realm_name):
+        self.realm_name = realm_name
+        self.roles = []
+        self.users = []
+        self.resource_keys = set()
+
+    def __len__(self):
+        return len(self.resource_keys)
+
+    def accepts(self, realm_name, resource_type, resource_name):
+        """
+        Returns True if a resource can be added to the batch, False otherwise.
+        :param realm_name: The realm of the resource.
+        :param resource_type: The Keycloak resource type.
+        :param resource_name: The resource name, as reported in partial import results.
+        """
+
+        return realm_name == self.realm_name and len(self) < MAX_BATCH_SIZE and \
+            (resource_type, resource_name) not in self.resource_keys
+
+    def add(self, resource_type, resource_name, representation):
+        """
+        Add a resource to the batch.
+        :param resource_type: The Keycloak resource type.
+        :param resource_name: The resource name, as reported in partial import results.
+        :param representation: The resource representation.
+        """
+
+        if resource_type == REALM_ROLE:
+            self.roles.append(representation)
+        elif resource_type == USER:
+            self.users.append(representation)
+        else:
+            raise ValueError('Unsupported partial import resource type: {0}'.format(resource_type))
+        self.resource_keys.add((resource_type, resource_name))
+
+    def execute(self, keycloak_client):
+        """
+        Send the partial import request.
+        :param keycloak_client: The client to use when interacting with Keycloak.
+        :return: The result action (ADDED, SKIPPED, ...) of each resource, keyed by (resource type, resource name), or
+        None if the request failed as a whole.
+        """
+
+        payload = {'ifResourceExists': IF_RESOURCE_EXISTS}
+        if self.roles:
+            payload['roles'] = {'realm': self.roles}
+        if self.users:
+            payload['users'] = self.users
+
+        logger.debug('Importing %s role(s) and %s user(s) into realm "%s"...', len(self.roles), len(self.users), self.realm_name)
+        path = '/admin/realms/{0}/partialImport'.format(urllib.parse.quote(self.realm_name))
+        response = keycloak_client.post(path, json=payload)
+        if response.status_code != requests.codes.ok:
+            logger.warning('Partial import into realm "%s" failed (%s).', self.realm_name, response.status_code)
+            return None
+
+        results = {}
+        for result in response.json().get('results', []):
+            resource_name = result.get('resourceName')
+            if result.get('resourceType') == USER and resource_name:
+                resource_name = resource_name.lower()
+            results[(result.get('resourceType'), resource_name)] = result.get('action')
+        return results
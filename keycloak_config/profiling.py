@@ -0,0 +1,330 @@
+"""
+Action Profiling.
+~~~~~~~~~~~~~~~~~
+
+Profiles the construction and execution of each action separately. For every action, the execution is profiled with
+cProfile, and the peak memory allocated while constructing and executing the action is sampled with tracemalloc.
+
+Only the thread executing the action is profiled by cProfile; work an action hands off to worker threads is accounted
+for as time spent waiting on those threads.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+# Time categories used in the summary.
+CATEGORY_KEYCLOAK = 'keycloak'
+CATEGORY_CLIENT = 'client'
+CATEGORY_CUSTOM = 'custom'
+CATEGORY_TOOL = 'tool'
+CATEGORY_OTHER = 'other'
+CATEGORIES = [CATEGORY_KEYCLOAK, CATEGORY_CLIENT, CATEGORY_CUSTOM, CATEGORY_TOOL, CATEGORY_OTHER]
+
+# Built-in functions in which the client blocks while waiting on Keycloak.
+KEYCLOAK_WAIT_PATTERN = re.compile(r"_socket\.socket|_ssl\._SSLSocket|'getaddrinfo'|'select'|'poll'")
+
+# Libraries doing client-side HTTP work.
+CLIENT_LIBRARY_PATTERN = re.compile(r'[/\\](requests|urllib3|urllib|http|email|ssl\.py|socket\.py|idna|certifi|charset_normalizer|chardet)')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_MODULE = os.path.join(PACKAGE_DIR, 'keycloak_client.py')
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+MAX_FLAME_GRAPH_DEPTH = 200
+MIN_FLAME_GRAPH_FRACTION = 0.0001
+
+
+class ActionProfile(object):
+    """
+    The profiling results of a single action.
+    """
+
+    def __init__(self, index, action_name):
+        self.index = index
+        self.action_name = action_name
+        self.construct_seconds = 0.0
+        self.construct_peak_bytes = 0
+        self.execute_seconds = 0.0
+        self.execute_cpu_seconds = 0.0
+        self.execute_peak_bytes = 0
+        self.stats = None
+        self.categories = dict((category, 0.0) for category in CATEGORIES)
+
+    @property
+    def file_prefix(self):
+        return '{0:03d}-{1}'.format(self.index, re.sub(r'[^A-Za-z0-9_.-]+', '_', self.action_name))
+
+
+class ActionProfiler(object):
+
+    def __init__(self, output_dir, custom_code_dir=None, top=20):
+        """
+        Constructor.
+        :param output_dir: The directory to write the profiling results to.
+        :param custom_code_dir: The directory containing custom action code, used to categorize time.
+        :param top: The number of entries to display in the summary tables.
+        """
+
+        self.output_dir = output_dir
+        self.custom_code_dir = os.path.abspath(custom_code_dir) if custom_code_dir else None
+        self.top = top
+        self.profiles = []
+        self.current = None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @staticmethod
+    def start_memory_sampling():
+        """
+        Start tracing memory allocations, or reset the peak if tracing is already active.
+        """
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.stop()
+            tracemalloc.start()
+
+    @staticmethod
+    def stop_memory_sampling():
+        """
+        Stop tracing memory allocations.
+        :return: The peak traced memory (in bytes) since tracing started.
+        """
+
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    def construct(self, action_name, build):
+        """
+        Construct an action, sampling the elapsed time and peak memory.
+        :param action_name: The action name.
+        :param build: A callable constructing the action.
+        :return: The action instance.
+        """
+
+        self.current = ActionProfile(len(self.profiles) + 1, action_name)
+        self.profiles.append(self.current)
+
+        self.start_memory_sampling()
+        start = time.perf_counter()
+        try:
+            return build()
+        finally:
+            self.current.construct_seconds = time.perf_counter() - start
+            self.current.construct_peak_bytes = self.stop_memory_sampling()
+
+    def execute(self, action_name, execute):
+        """
+        Execute an action under cProfile, sampling the peak memory, and write the profiling results.
+        :param action_name: The action name.
+        :param execute: A callable executing the action.
+        """
+
+        if self.current is None or self.current.action_name != action_name:
+            self.current = ActionProfile(len(self.profiles) + 1, action_name)
+            self.profiles.append(self.current)
+
+        profile = self.current
+        profiler = cProfile.Profile()
+
+        self.start_memory_sampling()
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        profiler.enable()
+        try:
+            execute()
+        finally:
+            profiler.disable()
+            profile.execute_seconds = time.perf_counter() - start
+            profile.execute_cpu_seconds = time.process_time() - start_cpu
+            profile.execute_peak_bytes = self.stop_memory_sampling()
+            profile.stats = pstats.Stats(profiler)
+            self.categorize(profile)
+            self.write_action_results(profile)
+            self.current = None
+
+    def categorize(self, profile):
+        """
+        Split the time spent in an action into categories, based on where each function lives.
+        :param profile: The action profile.
+        """
+
+        for func, (cc, nc, tt, ct, callers) in profile.stats.stats.items():
+            profile.categories[self.category(func)] += tt
+
+    def category(self, func):
+        """
+        Get the time category of a profiled function.
+        :param func: The pstats function key, a (file name, line number, function name) tuple.
+        :return: The category.
+        """
+
+        file_name, line, function_name = func
+
+        if file_name == '~':
+            if KEYCLOAK_WAIT_PATTERN.search(function_name):
+                return CATEGORY_KEYCLOAK
+            return CATEGORY_OTHER
+
+        path = os.path.abspath(file_name)
+        if self.custom_code_dir and path.startswith(self.custom_code_dir + os.sep):
+            return CATEGORY_CUSTOM
+        if path == CLIENT_MODULE or CLIENT_LIBRARY_PATTERN.search(path):
+            return CATEGORY_CLIENT
+        if path.startswith(PACKAGE_DIR + os.sep):
+            return CATEGORY_TOOL
+        return CATEGORY_OTHER
+
+    def write_action_results(self, profile):
+        """
+        Write the pstats file and the speedscope flame graph of an action.
+        :param profile: The action profile.
+        """
+
+        prefix = os.path.join(self.output_dir, profile.file_prefix)
+        profile.stats.dump_stats(prefix + '.pstats')
+
+        with open(prefix + '.speedscope.json', 'w') as f:
+            json.dump(to_speedscope(profile.stats, profile.action_name), f)
+
+    def summary(self):
+        """
+        Build the summary tables of the profiled actions.
+        :return: The summary text.
+        """
+
+        lines = []
+        slowest = sorted(self.profiles, key=lambda p: p.execute_seconds, reverse=True)[:self.top]
+
+        lines.append('Top {0} actions by execution time:'.format(len(slowest)))
+        header = '{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12}'.format(
+                'action', 'exec ms', 'cpu ms', 'peak KiB', 'build ms', 'build KiB'
+        ) + ''.join(' {0:>9}'.format(category + '%') for category in CATEGORIES)
+        lines.append(header)
+        lines.append('-' * len(header))
+
+        for profile in slowest:
+            profiled_seconds = sum(profile.categories.values()) or 1.0
+            lines.append('{0:<40} {1:>10.1f} {2:>10.1f} {3:>10.1f} {4:>10.1f} {5:>12.1f}'.format(
+                    profile.action_name[:40],
+                    profile.execute_seconds * 1000,
+                    profile.execute_cpu_seconds * 1000,
+                    profile.execute_peak_bytes / 1024.0,
+                    profile.construct_seconds * 1000,
+                    profile.construct_peak_bytes / 1024.0
+            ) + ''.join(
+                    ' {0:>9.1f}'.format(100.0 * profile.categories[category] / profiled_seconds)
+                    for category in CATEGORIES
+            ))
+
+        all_stats = [profile.stats for profile in self.profiles if profile.stats is not None]
+        if all_stats:
+            combined = pstats.Stats()
+            for stats in all_stats:
+                combined.add(stats)
+
+            functions = sorted(combined.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+            lines.append('')
+            lines.append('Top {0} functions by own time, across all actions:'.format(len(functions)))
+            lines.append('{0:>10} {1:>10} {2:>10} {3:<9} {4}'.format('own ms', 'cum ms', 'calls', 'category', 'function'))
+            for func, (cc, nc, tt, ct, callers) in functions:
+                lines.append('{0:>10.1f} {1:>10.1f} {2:>10} {3:<9} {4}'.format(
+                        tt * 1000, ct * 1000, nc, self.category(func), pstats.func_std_string(func)
+                ))
+
+        return '\n'.join(lines)
+
+    def write_summary(self):
+        """
+        Write the summary tables to the output directory.
+        :return: The summary text.
+        """
+
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as f:
+            f.write(summary + '\n')
+        return summary
+
+
+def to_speedscope(stats, name):
+    """
+    Convert profiling statistics into a speedscope "sampled" profile.
+    cProfile only records caller/callee pairs, so the call stacks are reconstructed by distributing the time of every
+    function among its callers, proportionally to the time spent in each call edge.
+    :param stats: The pstats statistics.
+    :param name: The profile name.
+    :return: The speedscope document.
+    """
+
+    frames = []
+    frame_indexes = {}
+
+    def frame_index(func):
+        if func not in frame_indexes:
+            file_name, line, function_name = func
+            frame_indexes[func] = len(frames)
+            frames.append({'name': function_name, 'file': file_name, 'line': line})
+        return frame_indexes[func]
+
+    callees = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    samples = []
+    weights = []
+    # Edges accounting for less than this much time are folded into their caller, to bound the size of the graph.
+    min_time = sum(stats.stats[root][3] for root in roots) * MIN_FLAME_GRAPH_FRACTION
+
+    def walk(func, budget, path):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        ratio = min(1.0, budget / ct) if ct > 0 else 0.0
+        path = path + (func,)
+
+        children_time = 0.0
+        if len(path) < MAX_FLAME_GRAPH_DEPTH:
+            for callee, edge_time in callees.get(func, []):
+                if callee in path:
+                    # Recursive calls are folded into the outermost occurrence.
+                    continue
+                child_budget = edge_time * ratio
+                if child_budget > min_time:
+                    children_time += child_budget
+                    walk(callee, child_budget, path)
+
+        own_time = max(budget - children_time, 0.0)
+        if own_time > 0:
+            samples.append([frame_index(f) for f in path])
+            weights.append(own_time)
+
+    for root in roots:
+        walk(root, stats.stats[root][3], ())
+
+    return {
+        '$schema': SPEEDSCOPE_SCHEMA,
+        'name': name,
+        'exporter': 'keycloak-config-tool',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights
+        }]
+    }
@@ -0,0 +1,227 @@
+"""
+Multi-Environment Rendering.
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Renders and validates the configuration for several deployment environments in a single process: the configuration
+file is read and tokenized once, every variable file is read once, and each environment is then rendered from the
+tokenized configuration, parsed and checked by the actions engine. Encrypted values are left as they are.
+"""
+
+from .actions.exceptions import InvalidActionConfigurationException
+from .actions_engine import ActionsEngine
+from .deploy_config import ConfigTemplate
+from .deploy_config import DEFAULT_VARIABLES_FILE
+from .deploy_config import DeployConfig
+from .deploy_config import expand_foreach
+from .deploy_config import InvalidConfigurationException
+from .deploy_config import VARIABLES_FILE_EXTENSION
+
+import click
+import concurrent.futures
+import json
+import os
+import sys
+
+# The tokenized configuration and default variables shared by the worker processes, set once per process.
+_worker_state = {}
+
+
+class EnvResult(object):
+    """
+    The outcome of rendering the configuration for a deployment environment.
+    """
+
+    __slots__ = ['deploy_env', 'processed_config', 'errors', 'unknown_variables', 'action_count']
+
+    def __init__(self, deploy_env):
+        self.deploy_env = deploy_env
+        self.processed_config = None
+        self.errors = []
+        # The line numbers of the references to each unknown variable, by variable name.
+        self.unknown_variables = {}
+        self.action_count = 0
+
+    @property
+    def valid(self):
+        return not self.errors
+
+
+class PlainJsonLoader(object):
+    """
+    Loads JSON contents, leaving encrypted values as they are.
+    """
+
+    def load_json(self, json_content):
+        return json.loads(json_content)
+
+    def decrypt(self, content):
+        return content
+
+
+def render_env(template, default_variables, deploy_env, env_variables, config_file_dir, environ=None):
+    """
+    Render and validate the configuration for a deployment environment.
+    :param template: The tokenized configuration.
+    :param default_variables: The variables of the default variable file.
+    :param deploy_env: The deployment environment.
+    :param env_variables: The variables of the environment variable file.
+    :param config_file_dir: The directory of the configuration file.
+    :param environ: The environment variables, os.environ by default.
+    :return: The result, an EnvResult.
+    """
+
+    result = EnvResult(deploy_env)
+    variables = dict(default_variables)
+    variables.update(env_variables)
+
+    values, unknown_variables = template.resolve_variables(variables, environ)
+    if unknown_variables:
+        references = template.referenced_variables()
+        for variable in unknown_variables:
+            result.unknown_variables[variable] = references[variable]
+            result.errors.append('Unknown variable: {0} (line {1})'.format(
+                    variable, ', '.join(str(line) for line in references[variable])
+            ))
+        return result
+
+    result.processed_config = template.substitute(values)
+    try:
+        actions_config_json = json.loads(result.processed_config)
+    except ValueError as e:
+        result.errors.append('Invalid JSON: {0}'.format(e))
+        return result
+
+    try:
+        actions_config_json = expand_foreach(actions_config_json, config_file_dir, variables, environ)
+    except InvalidConfigurationException as e:
+        result.errors.append('Invalid foreach entry: {0}'.format(e))
+        return result
+
+    try:
+        actions_engine = ActionsEngine(deploy_env, config_file_dir, actions_config_json, PlainJsonLoader())
+    except (InvalidActionConfigurationException, ImportError, KeyError, TypeError) as e:
+        result.errors.append('Invalid action configuration: {0}'.format(e))
+        return result
+
+    # The actions are built as they would be before their execution, which checks their properties and referenced files.
+    for action_name, action_class, action_config_json in actions_engine.pending_actions:
+        try:
+            actions_engine.build_action(action_name, action_class, action_config_json)
+        except (InvalidActionConfigurationException, ImportError, ValueError) as e:
+            result.errors.append('Invalid action configuration: {0}'.format(e))
+        except (AttributeError, KeyError, TypeError) as e:
+            # Raised by the actions reading a missing or mistyped property without checking it first.
+            result.errors.append('Invalid action configuration: Configuration "{0}" has a missing or invalid property: {1}'.format(
+                    action_name, e
+            ))
+
+    result.action_count = len(actions_engine.pending_actions)
+    return result
+
+
+def initialize_worker(template, default_variables, config_file_dir):
+    _worker_state['template'] = template
+    _worker_state['default_variables'] = default_variables
+    _worker_state['config_file_dir'] = config_file_dir
+
+
+def render_worker_env(deploy_env, env_variables):
+    return render_env(
+            _worker_state['template'],
+            _worker_state['default_variables'],
+            deploy_env,
+            env_variables,
+            _worker_state['config_file_dir']
+    )
+
+
+def render_envs(deploy_config_dir, deploy_envs=None, jobs=1):
+    """
+    Render and validate the configuration for several deployment environments.
+    :param deploy_config_dir: The base directory for the deployment configuration.
+    :param deploy_envs: The deployment environments, all the environments with a variable file by default.
+    :param jobs: The number of worker processes; the environments are rendered in this process when 1.
+    :return: The results, in the order of the deployment environments.
+    """
+
+    deploy_src_dir = os.path.join(deploy_config_dir, 'src')
+    deploy_keycloak_var_dir = os.path.join(deploy_config_dir, 'var', 'keycloak')
+    deploy_config_file = os.path.join(deploy_src_dir, 'keycloak.json')
+    if not os.path.isfile(deploy_config_file):
+        raise InvalidConfigurationException('Configuration file not found: {0}'.format(deploy_config_file))
+
+    with open(deploy_config_file, 'r') as f:
+        template = ConfigTemplate(f.read())
+
+    if deploy_envs is None:
+        deploy_envs = DeployConfig.list_deploy_envs(deploy_config_dir)
+    default_variables = DeployConfig.load_variables_file(os.path.join(deploy_keycloak_var_dir, DEFAULT_VARIABLES_FILE))
+    env_variables = [
+        DeployConfig.load_variables_file(os.path.join(deploy_keycloak_var_dir, deploy_env + VARIABLES_FILE_EXTENSION))
+        for deploy_env in deploy_envs
+    ]
+
+    if jobs <= 1 or len(deploy_envs) <= 1:
+        return [
+            render_env(template, default_variables, deploy_env, variables, deploy_src_dir)
+            for deploy_env, variables in zip(deploy_envs, env_variables)
+        ]
+
+    # The tokenized configuration is sent once to each worker, rather than with every environment.
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(deploy_envs)),
+            initializer=initialize_worker,
+            initargs=(template, default_variables, deploy_src_dir)
+    ) as executor:
+        return list(executor.map(render_worker_env, deploy_envs, env_variables))
+
+
+@click.command()
+@click.option(
+        '--deploy-config-dir',
+        type=click.Path(exists=True),
+        required=True,
+        help='The path to the deployment configuration directory'
+)
+@click.option(
+        '--deploy-env',
+        type=click.STRING,
+        multiple=True,
+        help='A deployment environment to render; all the environments with a variable file by default'
+)
+@click.option(
+        '--output-dir',
+        type=click.Path(file_okay=False),
+        help='If supplied, write the configuration of each valid environment to <env>.json in this directory'
+)
+@click.option(
+        '--jobs',
+        type=click.IntRange(min=1),
+        default=os.cpu_count() or 1,
+        help='The number of worker processes rendering environments in parallel'
+)
+def main(deploy_config_dir, deploy_env, output_dir, jobs):
+    results = render_envs(deploy_config_dir, list(deploy_env) or None, jobs)
+    if not results:
+        click.echo('No deployment environment found.', err=True)
+        sys.exit(1)
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    for result in results:
+        if result.valid:
+            click.echo('{0}: OK ({1} action(s))'.format(result.deploy_env, result.action_count))
+            if output_dir:
+                with open(os.path.join(output_dir, result.deploy_env + '.json'), 'w') as f:
+                    f.write(result.processed_config)
+        else:
+            for error in result.errors:
+                click.echo('{0}: {1}'.format(result.deploy_env, error))
+
+    if not all(result.valid for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Run Results.
+~~~~~~~~~~~~
+
+With `--results-file`, a run writes the outcome of each of its actions to a JSON file. The results of the runners of the
+shards of a configuration are then merged into a single report by the `keycloak-config-summary` command. Batch runs
+write a list of results, one per configuration, which the command merges the same way.
+"""
+
+from .actions_engine import COMPLETED
+from .actions_engine import FAILED
+
+import click
+import json
+import os
+import sys
+
+# The outcome of the actions which were not executed, because the run stopped before them.
+PENDING = 'pending'
+
+# The number of slowest actions listed by the summary.
+SLOWEST_ACTIONS_LISTED = 10
+
+
+def build_results(actions_engine, elapsed, error=None):
+    """
+    Describe the outcome of a run.
+    :param actions_engine: The actions engine of the run.
+    :param elapsed: The duration (in seconds) of the run.
+    :param error: The error which stopped the run, if any.
+    :return: The JSON-compatible results.
+    """
+
+    actions = []
+    for action_name, action_class, action_config_json in actions_engine.pending_actions:
+        status, action_elapsed, action_error = actions_engine.action_results.get(action_name, (PENDING, None, None))
+        actions.append({
+            'name': action_name,
+            'action': action_config_json['action'],
+            'status': status,
+            'elapsed': action_elapsed,
+            'error': action_error
+        })
+
+    return {
+        'deployEnv': actions_engine.deploy_env,
+        'shard': '{0}/{1}'.format(*actions_engine.shard) if actions_engine.shard is not None else None,
+        'success': error is None and all(action['status'] != FAILED for action in actions),
+        'error': str(error) if error is not None else None,
+        'elapsed': elapsed,
+        'actions': actions
+    }
+
+
+def write_results(path, results):
+    """
+    Write the results of a run to a file, replacing it once complete.
+    :param path: The file path.
+    :param results: The results.
+    """
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def merge_results(results_list):
+    """
+    Merge the results of the runners of several shards of a configuration, or of the configurations of a batch run.
+    :param results_list: The results of each runner, or of each configuration, with its `deployConfigDir`.
+    :return: A dictionary with the merged `actions` and the `errors` found while merging them, along with the
+    `success` of the whole run, the `elapsed` time of the slowest runner, and the `shards` which were merged.
+    """
+
+    errors = []
+    actions = []
+    shards = []
+    shard_count = None
+    for results in results_list:
+        shard = results.get('shard', None)
+        deploy_config_dir = results.get('deployConfigDir', None)
+        label = ' '.join(part for part in (deploy_config_dir, shard) if part) or 'unsharded run'
+        if shard is not None:
+            shard_number, count = (int(part) for part in shard.split('/'))
+            if shard_count is not None and count != shard_count:
+                errors.append('Shard {0} is from a run with a different shard count'.format(shard))
+            shard_count = shard_count or count
+            if shard_number in shards:
+                errors.append('Shard {0} was reported more than once'.format(shard))
+            shards.append(shard_number)
+        if results.get('error', None):
+            errors.append('{0}: {1}'.format(label, results['error']))
+        for action in results['actions']:
+            actions.append(dict(action, shard=shard, deployConfigDir=deploy_config_dir))
+
+    if shard_count is not None:
+        missing = sorted(set(range(1, shard_count + 1)).difference(shards))
+        if missing:
+            errors.append('Missing shard(s): {0}'.format(', '.join('{0}/{1}'.format(number, shard_count) for number in missing)))
+
+    return {
+        'success': not errors and all(results.get('success', False) for results in results_list),
+        'elapsed': max([results.get('elapsed', 0) or 0 for results in results_list] or [0]),
+        'shards': sorted(shards),
+        'errors': errors,
+        'actions': actions
+    }
+
+
+def format_summary(merged):
+    """
+    Describe merged results.
+    :param merged: The merged results, as returned by merge_results().
+    :return: The lines of the report.
+    """
+
+    counts = {}
+    for action in merged['actions']:
+        counts[action['status']] = counts.get(action['status'], 0) + 1
+
+    lines = ['{0}: {1} action(s), {2} in {3:.2f}s.'.format(
+            'SUCCESS' if merged['success'] else 'FAILURE', len(merged['actions']),
+            ', '.join('{0} {1}'.format(count, status) for status, count in sorted(counts.items())) or 'none executed',
+            merged['elapsed']
+    )]
+    lines.extend(merged['errors'])
+
+    for action in merged['actions']:
+        if action['status'] == FAILED:
+            lines.append('Action "{0}" ({1}) failed{2}{3}: {4}'.format(
+                    action['name'], action['action'], ' in shard {0}'.format(action['shard']) if action['shard'] else '',
+                    ' of {0}'.format(action['deployConfigDir']) if action.get('deployConfigDir') else '', action['error']
+            ))
+
+    slowest = sorted((action for action in merged['actions'] if action['status'] == COMPLETED and action['elapsed']),
+                     key=lambda action: action['elapsed'], reverse=True)[:SLOWEST_ACTIONS_LISTED]
+    if slowest:
+        lines.append('Slowest action(s):')
+        lines.extend('  "{0}" ({1}) {2:.2f}s'.format(action['name'], action['action'], action['elapsed']) for action in slowest)
+    return lines
+
+
+@click.command()
+@click.argument(
+        'results_files',
+        nargs=-1,
+        required=True,
+        type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+        '--output',
+        type=click.Path(dir_okay=False),
+        help='If supplied, write the merged results to this file'
+)
+def main(results_files, output):
+    results_list = []
+    for path in results_files:
+        with open(path, 'r') as f:
+            results = json.load(f)
+        # Batch runs write a list of results, one per configuration.
+        results_list.extend(results if isinstance(results, list) else [results])
+
+    merged = merge_results(results_list)
+    for line in format_summary(merged):
+        click.echo(line)
+
+    if output:
+        write_results(output, merged)
+
+    if not merged['success']:
+        sys.exit(1)
@@ -0,0 +1,74 @@
+"""
+Upsert Strategies.
+~~~~~~~~~~~~~~~~~~
+
+Create actions either look their resource up first and then create or update it (lookup-first), or send the creation
+request straight away and only look the resource up when it already exists (create-first). Looking up first costs a
+request for every resource, while creating first costs one for every resource which already exists, so the auto
+strategy picks one for each realm from the share of existing resources seen so far in the run.
+"""
+
+import threading
+
+LOOKUP_FIRST = 'lookup-first'
+CREATE_FIRST = 'create-first'
+AUTO = 'auto'
+
+UPSERT_STRATEGIES = (LOOKUP_FIRST, CREATE_FIRST, AUTO)
+
+# The auto strategy looks resources up until this many resources were upserted in a realm.
+AUTO_MIN_SAMPLES = 4
+
+
+class UpsertStats(object):
+    """
+    Counts the upserted resources which already existed, per realm.
+    """
+
+    def __init__(self):
+        # Lists of [existing resource count, resource count], by realm name.
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, realm_name, existed):
+        """
+        Record an upserted resource.
+        :param realm_name: The realm of the resource.
+        :param existed: True if the resource already existed.
+        """
+
+        with self.lock:
+            counts = self.counts.setdefault(realm_name, [0, 0])
+            if existed:
+                counts[0] += 1
+            counts[1] += 1
+
+    def hit_rate(self, realm_name):
+        """
+        Get the share of the resources upserted in a realm which already existed.
+        :param realm_name: The realm name.
+        :return: The share, between 0 and 1, or None if no resource was upserted in the realm.
+        """
+
+        with self.lock:
+            existing, total = self.counts.get(realm_name, (0, 0))
+        return existing / total if total else None
+
+    def creates_first(self, realm_name):
+        """
+        Returns True if the auto strategy should create the resources of a realm first, False otherwise.
+        :param realm_name: The realm name.
+        """
+
+        with self.lock:
+            existing, total = self.counts.get(realm_name, (0, 0))
+        return total >= AUTO_MIN_SAMPLES and existing * 2 < total
+
+    def summary(self):
+        """
+        Describe the hit rate of every realm.
+        :return: A list of (realm name, existing resource count, resource count) tuples, sorted by realm name.
+        """
+
+        with self.lock:
+            return [(realm_name, counts[0], counts[1]) for realm_name, counts in sorted(self.counts.items())]
@@ -0,0 +1,227 @@
+"""
+Watch Mode.
+~~~~~~~~~~~
+"""
+
+from .actions_engine import ActionsEngine
+from .deploy_config import DeployConfig
+from .fingerprint import action_fingerprint
+from .fingerprint import file_fingerprint
+
+import copy
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher(object):
+    """
+    Keeps Keycloak in sync with a deployment configuration directory.
+    The directory is polled for changes, and only the actions whose rendered configuration (or referenced files)
+    changed are executed again. A periodic full resynchronization catches drift made outside of the tool.
+    """
+
+    DEFAULT_POLL_INTERVAL = 2
+    DEFAULT_RESYNC_INTERVAL = 600
+    RETRY_INTERVAL = 30
+
+    def __init__(self, deploy_config_dir, deploy_env, json_loader, keycloak_client, keycloak_timeout,
+                 poll_interval=DEFAULT_POLL_INTERVAL, resync_interval=DEFAULT_RESYNC_INTERVAL, engine_kwargs=None):
+        """
+        Constructor.
+        :param deploy_config_dir: The base directory for the deployment configuration.
+        :param deploy_env: The target deployment environment.
+        :param json_loader: An object able to load JSON contents into a Python object.
+        :param keycloak_client: A logged-in client to use when interacting with Keycloak.
+        :param keycloak_timeout: The timeout to use while waiting for Keycloak to become available again.
+        :param poll_interval: The interval (in seconds) between two scans of the configuration directory.
+        :param resync_interval: The interval (in seconds) between two full resynchronizations.
+        :param engine_kwargs: The other options of the actions engine, such as the default action timeout.
+        """
+
+        self.deploy_config_dir = deploy_config_dir
+        self.deploy_env = deploy_env
+        self.json_loader = json_loader
+        self.keycloak_client = keycloak_client
+        self.keycloak_timeout = keycloak_timeout
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.engine_kwargs = engine_kwargs or {}
+
+        self.config = None
+        self.render_pending = True
+        self.file_states = {}
+        self.file_fingerprints = {}
+        self.applied_fingerprints = {}
+
+    def scan(self):
+        """
+        Scan the configuration directory.
+        :return: A dictionary of the modification time and size of every file, keyed by path.
+        """
+
+        states = {}
+        for dir_path, dir_names, file_names in os.walk(self.deploy_config_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                states[path] = (stat.st_mtime_ns, stat.st_size)
+        return states
+
+    def is_template_file(self, path):
+        """
+        Returns True if the file is used to render the configuration, False otherwise.
+        :param path: The file path.
+        """
+
+        if self.config is None:
+            return True
+
+        var_dir = os.path.join(self.config.deploy_keycloak_var_dir, '')
+        return os.path.abspath(path) == os.path.abspath(self.config.deploy_config_file) or \
+            os.path.abspath(path).startswith(os.path.abspath(var_dir)) or \
+            any(os.path.abspath(path) == os.path.abspath(foreach_file) for foreach_file in self.config.foreach_files)
+
+    def render_config(self, changed_paths):
+        """
+        Render the configuration again, if any of the files it is rendered from changed.
+        :param changed_paths: The paths of the files that changed since the last scan.
+        """
+
+        if not self.render_pending and not any(self.is_template_file(path) for path in changed_paths):
+            return
+
+        logger.debug('Rendering configuration...')
+        self.render_pending = True
+        self.config = DeployConfig(self.deploy_config_dir, self.deploy_env, self.json_loader)
+        self.render_pending = False
+
+    def get_file_fingerprint(self, path):
+        """
+        Get the fingerprint of a file, only reading it again if it changed since it was last read.
+        :param path: The file path.
+        :return: The file fingerprint.
+        """
+
+        state = self.file_states.get(path)
+        cached = self.file_fingerprints.get(path)
+        if cached is not None and state is not None and cached[0] == state:
+            return cached[1]
+
+        value = file_fingerprint(path)
+        self.file_fingerprints[path] = (state, value)
+        return value
+
+    def action_fingerprint(self, action_class, config_file_dir, action_config_json):
+        """
+        Compute the fingerprint of an action from its rendered configuration and referenced files.
+        :return: The action fingerprint.
+        """
+
+        return action_fingerprint(action_class, config_file_dir, action_config_json, self.get_file_fingerprint)
+
+    def synchronize(self, changed_paths, full_resync):
+        """
+        Execute the actions which changed since they were last applied.
+        :param changed_paths: The paths of the files that changed since the last scan.
+        :param full_resync: If True, all actions are executed, with cold caches.
+        :return: True if all actions were executed successfully, False otherwise.
+        """
+
+        try:
+            self.render_config(changed_paths)
+        except Exception as err:
+            logger.error('Unable to render configuration: %s', err)
+            return False
+
+        if not self.keycloak_client.check_availability():
+            logger.warning('Keycloak is unavailable, reconnecting...')
+            if not self.keycloak_client.reconnect(self.keycloak_timeout):
+                return False
+            # Keycloak may have come back with a different state.
+            full_resync = True
+
+        if full_resync:
+            logger.info('Performing full resynchronization...')
+            self.keycloak_client.cache.clear()
+            self.applied_fingerprints = {}
+
+        config_file_dir = self.config.get_config_dir()
+        try:
+            # Fingerprints stored in Keycloak do not reveal changes made outside of the tool, so full resynchronizations
+            # ignore them.
+            engine_kwargs = dict(self.engine_kwargs)
+            engine_kwargs['ignore_fingerprints'] = full_resync or engine_kwargs.get('ignore_fingerprints', False)
+            actions_engine = ActionsEngine(
+                    self.deploy_env, config_file_dir, self.config.get_json_config(), self.json_loader, **engine_kwargs
+            )
+        except Exception as err:
+            logger.error('Invalid configuration: %s', err)
+            return False
+
+        action_names = set()
+        executed = 0
+        for action_name, action_class, action_config_json in actions_engine.pending_actions:
+            action_names.add(action_name)
+            # Actions are executed on a copy of their configuration, which keeps the rendered configuration unaltered.
+            current_fingerprint = self.action_fingerprint(action_class, config_file_dir, action_config_json)
+            if self.applied_fingerprints.get(action_name) == current_fingerprint:
+                continue
+
+            try:
+                actions_engine.execute_action(
+                        self.keycloak_client, action_name, action_class, copy.deepcopy(action_config_json)
+                )
+            except Exception as err:
+                # The cached lookups may not reflect what was applied before the failure.
+                logger.error('Action "%s" failed: %s', action_name, err)
+                self.keycloak_client.cache.clear()
+                return False
+
+            self.applied_fingerprints[action_name] = current_fingerprint
+            executed += 1
+
+        # Forget about actions which were removed from the configuration.
+        for action_name in list(self.applied_fingerprints):
+            if action_name not in action_names:
+                del self.applied_fingerprints[action_name]
+
+        logger.info('Synchronization completed, %s action(s) executed.', executed)
+        return True
+
+    def run(self):
+        """
+        Watch the configuration directory until interrupted.
+        """
+
+        logger.info('Watching "%s" for changes...', self.deploy_config_dir)
+        next_resync = 0
+        next_retry = None
+
+        while True:
+            previous_states = self.file_states
+            self.file_states = self.scan()
+            changed_paths = [
+                path for path in set(previous_states) | set(self.file_states)
+                if previous_states.get(path) != self.file_states.get(path)
+            ]
+
+            now = time.time()
+            full_resync = now >= next_resync
+            retry = next_retry is not None and now >= next_retry
+
+            if changed_paths or full_resync or retry:
+                if self.synchronize(changed_paths, full_resync):
+                    next_retry = None
+                else:
+                    next_retry = now + self.RETRY_INTERVAL
+
+                if full_resync:
+                    next_resync = now + self.resync_interval
+
+            time.sleep(self.poll_interval)
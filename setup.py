@@ -38,7 +38,10 @@ setup(
     install_requires=install_requires,
     entry_points={
         "console_scripts":
-            ["keycloak-config-tool=keycloak_config.__main__:main"]
+            ["keycloak-config-tool=keycloak_config.__main__:main",
+             "keycloak-config-render=keycloak_config.render:main",
+             "keycloak-config-summary=keycloak_config.results:main",
+             "keycloak-config-batch=keycloak_config.batch:main"]
     },
     # Include VERSION file in sdist. This is mostly for the benefit of tox
     data_files=[
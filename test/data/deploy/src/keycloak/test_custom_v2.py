@@ -0,0 +1,21 @@
+import asyncio
+
+
+class CustomAction(object):
+    API_VERSION = 2
+
+    def __init__(self, name, config_file_dir, action_config_json, context):
+        self.name = name
+
+        if 'realmName' not in action_config_json:
+            raise context.InvalidActionConfigurationException('Configuration "{0}" missing property "realmName"'.format(name))
+
+        self.realm_name = action_config_json['realmName']
+
+    async def execute_async(self, context):
+        # Both listings are walked concurrently, on the worker pool of the tool.
+        users, roles = await asyncio.gather(
+                context.call(list, context.paginate('/admin/realms/{0}/users'.format(self.realm_name))),
+                context.call(list, context.paginate('/admin/realms/{0}/roles'.format(self.realm_name), stream=True))
+        )
+        context.logger.info('Realm "%s" has %s user(s) and %s role(s).', self.realm_name, len(users), len(roles))
@@ -0,0 +1,69 @@
+from keycloak_config.actions.utils import get_created_id
+from keycloak_config.actions.utils import process_user_role_mappings
+from keycloak_config.cache import KeycloakCache
+from keycloak_config.keycloak_client import KeycloakClient
+
+import functools
+import json
+import mock
+import unittest
+
+
+class GetCreatedIdTests(unittest.TestCase):
+
+    @staticmethod
+    def response(location):
+        response = mock.Mock()
+        response.headers = {'Location': location} if location is not None else {}
+        return response
+
+    def test_id_is_last_path_segment(self):
+        response = self.response('http://localhost:8080/auth/admin/realms/test/users/2d3c-41f0')
+        self.assertEqual('2d3c-41f0', get_created_id(response))
+
+    def test_id_is_unquoted(self):
+        response = self.response('http://localhost:8080/auth/admin/realms/test/roles/my%20role')
+        self.assertEqual('my role', get_created_id(response))
+
+    def test_missing_location(self):
+        self.assertIsNone(get_created_id(self.response(None)))
+        self.assertIsNone(get_created_id(self.response('')))
+
+
+class UserRoleMappingsTests(unittest.TestCase):
+
+    @staticmethod
+    def response(status_code, body=None):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = body
+        response.iter_content.return_value = [json.dumps(body).encode('utf-8')]
+        return response
+
+    def test_one_request_per_container_and_change(self):
+        realm_roles = [{'id': 'r{0}'.format(index), 'name': 'role-{0}'.format(index)} for index in range(4)]
+        client_roles = [{'id': 'c{0}'.format(index), 'name': 'app-{0}'.format(index), 'containerId': 'app-id'} for index in range(3)]
+        keycloak_client = mock.Mock()
+        keycloak_client.cache = KeycloakCache()
+        keycloak_client.paginate.side_effect = functools.partial(KeycloakClient.paginate, keycloak_client)
+        keycloak_client.get.side_effect = lambda path, params=None, **kwargs: {
+            '/admin/realms/test/roles': self.response(200, realm_roles),
+            '/admin/realms/test/clients': self.response(200, [{'id': 'app-id', 'clientId': 'app'}]),
+            '/admin/realms/test/clients/app-id/roles': self.response(200, client_roles)
+        }[path]
+        keycloak_client.post.return_value = self.response(204)
+        keycloak_client.delete.return_value = self.response(204)
+
+        existing_mappings = ([realm_roles[0], realm_roles[1]], {'app': [client_roles[0]], 'other': [{'name': 'kept'}]})
+        process_user_role_mappings('test', 'user-id', existing_mappings, ['role-1', 'role-2', 'role-3'],
+                                   {'app': ['app-1', 'app-2']}, keycloak_client)
+
+        self.assertEqual([
+            mock.call('/admin/realms/test/users/user-id/role-mappings/realm', json=realm_roles[2:]),
+            mock.call('/admin/realms/test/users/user-id/role-mappings/clients/app-id', json=client_roles[1:])
+        ], keycloak_client.post.call_args_list)
+        self.assertEqual([
+            mock.call('/admin/realms/test/users/user-id/role-mappings/realm', json=[realm_roles[0]]),
+            mock.call('/admin/realms/test/users/user-id/role-mappings/clients/app-id', json=[client_roles[0]])
+        ], keycloak_client.delete.call_args_list)
+        # Role catalogs are listed once, however many roles are resolved.
+        self.assertEqual(3, keycloak_client.get.call_count)
@@ -0,0 +1,52 @@
+from keycloak_config.batch import ConfigRun
+from keycloak_config.batch import run_batch
+
+import mock
+import threading
+import time
+import unittest
+
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.active = set()
+        self.overlaps = []
+        self.order = []
+
+    def config_run(self, name, realms, fail=False):
+        run = ConfigRun(name, 'local')
+        run.realms = realms
+        run.actions_engine = mock.Mock()
+
+        def execute(keycloak_client):
+            with self.lock:
+                self.order.append(name)
+                self.overlaps.extend((name, other) for other in self.active)
+                self.active.add(name)
+            time.sleep(0.05)
+            with self.lock:
+                self.active.remove(name)
+            if fail:
+                raise ValueError('{0} failed'.format(name))
+
+        run.actions_engine.execute.side_effect = execute
+        return run
+
+    def test_overlapping_configs_run_in_order(self):
+        runs = [
+            self.config_run('a', {'realm-1'}, fail=True),
+            self.config_run('b', {'realm-2'}),
+            self.config_run('c', {'realm-1', 'realm-3'}),
+            self.config_run('d', None)
+        ]
+        run_batch(runs, mock.Mock(), parallelism=4)
+
+        # c shares a realm with a, and d, whose realms are not known, overlaps with all the others.
+        self.assertIn(('b', 'a'), self.overlaps)
+        self.assertFalse(any(set(pair) == {'a', 'c'} for pair in self.overlaps))
+        self.assertLess(self.order.index('a'), self.order.index('c'))
+        self.assertEqual('d', self.order[-1])
+        self.assertFalse(any('d' in pair for pair in self.overlaps))
+        self.assertEqual(['a failed', None, None, None], [run.error for run in runs])
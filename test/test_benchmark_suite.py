@@ -0,0 +1,21 @@
+from benchmarks.suite import compare
+from benchmarks.suite import run_suite
+from benchmarks.suite import STAGES
+from benchmarks.synthetic import Scale
+
+import unittest
+
+
+class BenchmarkSuiteTests(unittest.TestCase):
+
+    def test_all_stages_are_measured(self):
+        results = run_suite(Scale(users=4, clients=4, roles=3, mappers=1, variables=2, encrypted_fields=2, realm_users=2), repeat=1)
+        self.assertEqual(sorted(STAGES), sorted(results['stages']))
+        self.assertEqual(4, results['scale']['users'])
+
+    def test_regressions_are_flagged(self):
+        baseline = {'stages': {'decrypt': {'seconds': 1.0, 'peak_bytes': 1000}}}
+        results = {'stages': {'decrypt': {'seconds': 1.2, 'peak_bytes': 1200}}}
+
+        self.assertEqual([('decrypt', 'peak_bytes', 1000, 1200)], compare(results, baseline, 0.25, 0.1))
+        self.assertEqual([], compare(results, baseline, 0.25, 0.25))
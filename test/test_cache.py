@@ -0,0 +1,75 @@
+from keycloak_config.cache import CLIENTS
+from keycloak_config.cache import KeycloakCache
+from keycloak_config.cache import ROLES
+from keycloak_config.cache import USERS
+
+import unittest
+
+
+class KeycloakCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = KeycloakCache()
+        realm_cache = self.cache.realm('test')
+        realm_cache.put(CLIENTS, 'test-client', {'id': '1'})
+        realm_cache.put(ROLES, 'test-role', {'id': '2'})
+        realm_cache.put(USERS, 'test@example.com', None)
+
+    def test_negative_lookups_are_cached(self):
+        realm_cache = self.cache.realm('test')
+        self.assertTrue(realm_cache.contains(USERS, 'test@example.com'))
+        self.assertIsNone(realm_cache.get(USERS, 'test@example.com'))
+        self.assertFalse(realm_cache.contains(USERS, 'other@example.com'))
+
+    def test_invalidate_path_by_kind(self):
+        self.cache.invalidate_path('/admin/realms/test/clients/1/protocol-mappers/models')
+        realm_cache = self.cache.realm('test')
+        self.assertFalse(realm_cache.contains(CLIENTS, 'test-client'))
+        self.assertTrue(realm_cache.contains(USERS, 'test@example.com'))
+        self.assertTrue(realm_cache.contains(ROLES, 'test-role'))
+
+    def test_invalidate_path_by_user(self):
+        realm_cache = self.cache.realm('test')
+        realm_cache.put(USERS, 'a@example.com', {'id': 'a'})
+        realm_cache.put(USERS, 'b@example.com', {'id': 'b'})
+
+        self.cache.invalidate_path('/admin/realms/test/users/a/role-mappings/realm')
+        self.assertTrue(realm_cache.contains(USERS, 'a@example.com'))
+
+        self.cache.invalidate_path('/admin/realms/test/users/a')
+        self.assertFalse(realm_cache.contains(USERS, 'a@example.com'))
+        self.assertFalse(realm_cache.contains(USERS, 'test@example.com'))
+        self.assertTrue(realm_cache.contains(USERS, 'b@example.com'))
+
+        realm_cache.put(USERS, 'test@example.com', None)
+        self.cache.invalidate_path('/admin/realms/test/users')
+        self.assertFalse(realm_cache.contains(USERS, 'test@example.com'))
+        self.assertTrue(realm_cache.contains(USERS, 'b@example.com'))
+
+    def test_concurrent_lookup_results_are_discarded(self):
+        realm_cache = self.cache.realm('test')
+        generation = realm_cache.current_generation()
+        self.cache.invalidate_path('/admin/realms/test/users/a')
+
+        self.assertFalse(realm_cache.put(USERS, 'a@example.com', {'id': 'a'}, generation))
+        self.assertFalse(realm_cache.put(USERS, 'new@example.com', None, generation))
+        self.assertTrue(realm_cache.put(USERS, 'b@example.com', {'id': 'b'}, generation))
+        self.assertTrue(realm_cache.put(CLIENTS, 'other-client', {'id': '3'}, generation))
+
+        self.cache.invalidate_path('/admin/realms/test')
+        self.assertFalse(realm_cache.put(CLIENTS, 'other-client', {'id': '3'}, generation))
+        self.assertTrue(realm_cache.put(CLIENTS, 'other-client', {'id': '3'}, realm_cache.current_generation()))
+
+    def test_invalidate_path_for_realm(self):
+        self.cache.realm('other').put(ROLES, 'test-role', {'id': '3'})
+        self.cache.invalidate_path('/admin/realms/test')
+        self.assertFalse(self.cache.realm('test').contains(ROLES, 'test-role'))
+        self.assertTrue(self.cache.realm('other').contains(ROLES, 'test-role'))
+
+    def test_invalidate_path_for_realm_import(self):
+        self.cache.invalidate_path('/admin/realms')
+        self.assertFalse(self.cache.realm('test').contains(CLIENTS, 'test-client'))
+
+    def test_invalidate_path_outside_realms(self):
+        self.cache.invalidate_path('/realms/test/clients-custom/1/client-secret')
+        self.assertTrue(self.cache.realm('test').contains(CLIENTS, 'test-client'))
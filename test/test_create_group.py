@@ -0,0 +1,59 @@
+from keycloak_config.actions.create_group import CreateGroupAction
+from keycloak_config.actions.exceptions import ActionExecutionException
+from keycloak_config.actions.exceptions import InvalidActionConfigurationException
+from keycloak_config.cache import KeycloakCache
+from keycloak_config.keycloak_client import KeycloakClient
+
+import functools
+import json
+import mock
+import unittest
+
+
+def response(status_code, body=None):
+    result = mock.Mock(status_code=status_code)
+    result.json.return_value = body
+    result.iter_content.return_value = [json.dumps(body).encode('utf-8')]
+    return result
+
+
+class CreateGroupActionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keycloak_client = mock.Mock()
+        self.keycloak_client.cache = KeycloakCache()
+        self.keycloak_client.paginate.side_effect = functools.partial(KeycloakClient.paginate, self.keycloak_client)
+        self.keycloak_client.run_concurrently.side_effect = lambda func, items, max_concurrency=None: [func(item) for item in items]
+        self.keycloak_client.put.return_value = response(204)
+        self.keycloak_client.delete.return_value = response(204)
+
+    def action(self, members):
+        return CreateGroupAction('group', '/tmp', {'realmName': 'test', 'group': {'name': 'team'}, 'members': members})
+
+    @mock.patch('keycloak_config.actions.create_group.MEMBERS_PAGE_SIZE', 2)
+    def test_only_membership_changes_are_applied(self):
+        members = [{'id': 'id-a', 'email': 'a@example.com'}, {'id': 'id-b', 'email': 'b@example.com'}, {'id': 'id-c', 'email': 'c@example.com'}]
+        self.keycloak_client.get.side_effect = lambda path, params=None, **kwargs: {
+            '/admin/realms/test/groups': response(200, [{'id': 'group-id', 'name': 'team', 'path': '/team'}]),
+            '/admin/realms/test/groups/group-id/members': response(200, members[params.get('first', 0):][:2]),
+            '/admin/realms/test/users': response(200, [{'id': 'id-d', 'email': params.get('email')}])
+        }[path]
+
+        self.action(['A@example.com', 'c@example.com', 'd@example.com']).execute(self.keycloak_client)
+
+        self.assertEqual([mock.call('/admin/realms/test/users/id-d/groups/group-id')], self.keycloak_client.put.call_args_list[1:])
+        self.assertEqual([mock.call('/admin/realms/test/users/id-b/groups/group-id')], self.keycloak_client.delete.call_args_list)
+        member_pages = [c for c in self.keycloak_client.get.call_args_list if c[0][0].endswith('/members')]
+        self.assertEqual(2, len(member_pages))
+
+    def test_unknown_members_are_reported(self):
+        self.keycloak_client.get.side_effect = lambda path, params=None, **kwargs: response(200, [])
+        self.keycloak_client.post.return_value = response(201)
+        self.keycloak_client.post.return_value.headers = {'Location': 'http://keycloak/admin/realms/test/groups/group-id'}
+
+        with self.assertRaisesRegex(ActionExecutionException, 'a@example.com'):
+            self.action(['a@example.com']).execute(self.keycloak_client)
+
+    def test_invalid_membership_concurrency(self):
+        with self.assertRaisesRegex(InvalidActionConfigurationException, 'invalid membershipConcurrency: 0'):
+            CreateGroupAction('group', '/tmp', {'realmName': 'test', 'group': {'name': 'team'}, 'membershipConcurrency': 0})
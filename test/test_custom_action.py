@@ -0,0 +1,58 @@
+from keycloak_config.actions.custom_action import CustomActionContext
+from keycloak_config.actions.custom_action import CustomActionWrapper
+from keycloak_config.actions.custom_action import load_custom_module
+from keycloak_config.actions.exceptions import ActionExecutionException
+from keycloak_config.keycloak_client import KeycloakClient
+
+import json
+import mock
+import os
+import requests
+import unittest
+
+CONFIG_FILE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'deploy', 'src')
+
+
+def response(status_code, body=None):
+    result = mock.Mock(status_code=status_code)
+    result.json.return_value = body
+    result.iter_content.return_value = [json.dumps(body).encode('utf-8')]
+    return result
+
+
+class CustomActionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keycloak_client = KeycloakClient('http://keycloak', max_workers=2)
+        self.addCleanup(self.keycloak_client.close)
+
+    def test_module_is_loaded_once(self):
+        file_path = os.path.join(CONFIG_FILE_DIR, 'keycloak', 'test_custom.py')
+        self.assertIs(load_custom_module(file_path), load_custom_module(file_path))
+
+        first = CustomActionWrapper('first', CONFIG_FILE_DIR, {'file': 'keycloak/test_custom.py', 'realmName': 'test'})
+        second = CustomActionWrapper('second', CONFIG_FILE_DIR, {'file': 'keycloak/test_custom.py', 'realmName': 'test'})
+        self.assertIs(type(first.custom_action), type(second.custom_action))
+
+    def test_version_1(self):
+        action = CustomActionWrapper('v1', CONFIG_FILE_DIR, {'file': 'keycloak/test_custom.py', 'realmName': 'test'})
+        self.assertEqual(1, action.api_version)
+
+        with mock.patch.object(self.keycloak_client, 'get', return_value=response(requests.codes.forbidden)):
+            with self.assertRaises(ActionExecutionException):
+                action.execute(self.keycloak_client)
+
+    def test_version_2(self):
+        action = CustomActionWrapper('v2', CONFIG_FILE_DIR, {'file': 'keycloak/test_custom_v2.py', 'realmName': 'test'})
+        self.assertEqual(2, action.api_version)
+        self.assertIsInstance(action.context, CustomActionContext)
+
+        with mock.patch.object(self.keycloak_client, 'get', return_value=response(requests.codes.ok, [])) as get:
+            action.execute(self.keycloak_client)
+        page_params = {'first': 0, 'max': KeycloakClient.DEFAULT_PAGE_SIZE}
+        self.assertEqual(
+                [mock.call('/admin/realms/test/users', page_params, stream=False),
+                 mock.call('/admin/realms/test/roles', page_params, stream=True)],
+                sorted(get.call_args_list, key=str, reverse=True)
+        )
+        self.assertIs(self.keycloak_client.cache, action.context.cache)
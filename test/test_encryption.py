@@ -113,3 +113,17 @@ class EncryptionHelperTests(unittest.TestCase):
 
         output = self.encryption_helper.decrypt("decrypt:ASDF1234")
         self.assertEqual("valueXYZ", output)
+
+    @mock.patch('keycloak_config.encryption.kmsdecrypt')
+    def test_only_paths_to_encrypted_values_are_copied(self, decrypt):
+        decrypt.return_value = "valueXYZ"
+
+        unchanged = {"key": ["val1", {"key2": "val2"}]}
+        input = {"plain": unchanged, "secret": {"key1": ["decrypt:ASDF1234"]}}
+
+        self.assertIs(unchanged, self.encryption_helper.decrypt(unchanged))
+
+        output = self.encryption_helper.decrypt(input)
+        self.assertIs(unchanged, output["plain"])
+        self.assertEqual({"key1": ["valueXYZ"]}, output["secret"])
+        self.assertEqual({"key1": ["decrypt:ASDF1234"]}, input["secret"], "The input should not be modified.")
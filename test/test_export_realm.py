@@ -0,0 +1,55 @@
+from keycloak_config.actions.exceptions import InvalidActionConfigurationException
+from keycloak_config.actions.export_realm import ExportRealmAction
+from keycloak_config.encryption import EncryptionHelper
+from keycloak_config.json import JsonLoader
+
+import mock
+import unittest
+
+
+class ExportRealmActionTests(unittest.TestCase):
+
+    def action(self, **config):
+        action_config_json = {'realmName': 'test', 'exportFile': 'test-realm.json.gz'}
+        action_config_json.update(config)
+        return ExportRealmAction('export', '/tmp', action_config_json, JsonLoader(EncryptionHelper(None, None)))
+
+    def test_encryption_key_is_required(self):
+        with self.assertRaises(InvalidActionConfigurationException):
+            self.action(encryptFields=['secret'])
+
+    def test_concurrency_must_be_positive(self):
+        for concurrency in (0, -1, '4', True):
+            with self.assertRaisesRegex(InvalidActionConfigurationException, 'invalid concurrency'):
+                self.action(concurrency=concurrency)
+        self.assertEqual(4, self.action(concurrency=4).concurrency)
+
+    def test_compression_follows_file_name(self):
+        self.assertTrue(self.action().compress)
+        self.assertFalse(self.action(exportFile='test-realm.json').compress)
+
+    @mock.patch('keycloak_config.encryption.kmsencrypt')
+    def test_only_configured_fields_are_encrypted(self, mock_encrypt):
+        mock_encrypt.side_effect = lambda **kwargs: kwargs['prefix'] + kwargs['data'].upper()
+        action = self.action(encryptFields=['secret', 'value'], encryptionKey='arn')
+
+        exported = action.encrypt(None, {
+            'clientId': 'test-client',
+            'secret': 'abc',
+            'credentials': [{'type': 'password', 'value': 'def'}, {'value': 'decrypt:already'}]
+        })
+
+        self.assertEqual({
+            'clientId': 'test-client',
+            'secret': 'decrypt:ABC',
+            'credentials': [{'type': 'password', 'value': 'decrypt:DEF'}, {'value': 'decrypt:already'}]
+        }, exported)
+        self.assertEqual(2, mock_encrypt.call_count)
+
+    def test_role_names(self):
+        realm_roles, client_roles = ExportRealmAction.role_names({
+            'realmMappings': [{'name': 'admin'}],
+            'clientMappings': {'test-client': {'mappings': [{'name': 'viewer'}]}}
+        })
+        self.assertEqual(['admin'], realm_roles)
+        self.assertEqual({'test-client': ['viewer']}, client_roles)
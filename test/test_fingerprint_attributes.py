@@ -0,0 +1,104 @@
+from keycloak_config.actions.action import FINGERPRINT_ATTRIBUTE
+from keycloak_config.actions.create_role import CreateRoleAction
+from keycloak_config.actions.create_user import CreateUserAction
+from keycloak_config.actions.exceptions import ActionExecutionException
+from keycloak_config.actions.utils import get_role_catalog
+from keycloak_config.cache import KeycloakCache
+
+import mock
+import unittest
+
+
+def response(status_code, body=None):
+    result = mock.Mock(status_code=status_code)
+    result.json.return_value = body
+    return result
+
+
+class FingerprintAttributeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keycloak_client = mock.Mock()
+        self.keycloak_client.cache = KeycloakCache()
+        self.keycloak_client.post.return_value = response(201)
+        self.keycloak_client.put.return_value = response(204)
+
+    @staticmethod
+    def action(description, **kwargs):
+        return CreateRoleAction('role', '/tmp', {'realmName': 'test', 'role': {'name': 'role', 'description': description}}, **kwargs)
+
+    def applied_role(self, description):
+        self.keycloak_client.get.return_value = response(404)
+        self.action(description).execute(self.keycloak_client)
+        role_data = self.keycloak_client.post.call_args[1]['json']
+        self.keycloak_client.reset_mock()
+        self.keycloak_client.cache.clear()
+        return dict(role_data, id='role-id')
+
+    def test_unchanged_resource_is_not_updated(self):
+        role_data = self.applied_role('Role')
+        self.assertIn(FINGERPRINT_ATTRIBUTE, role_data['attributes'])
+
+        self.keycloak_client.get.return_value = response(200, role_data)
+        self.action('Role').execute(self.keycloak_client)
+        self.keycloak_client.put.assert_not_called()
+
+    def test_changed_resource_is_updated(self):
+        role_data = self.applied_role('Role')
+
+        self.keycloak_client.get.return_value = response(200, role_data)
+        self.action('Changed').execute(self.keycloak_client)
+        self.keycloak_client.put.assert_called_once()
+        self.assertNotEqual(role_data['attributes'], self.keycloak_client.put.call_args[1]['json']['attributes'])
+
+    def test_fingerprints_can_be_ignored(self):
+        role_data = self.applied_role('Role')
+
+        self.keycloak_client.get.return_value = response(200, role_data)
+        self.action('Role', ignore_fingerprints=True).execute(self.keycloak_client)
+        self.keycloak_client.put.assert_called_once()
+
+    def test_unchanged_resource_is_not_updated_after_catalog_listing(self):
+        role_data = self.applied_role('Role')
+
+        def paginate(path, params=None, **kwargs):
+            # Keycloak lists brief role representations, without attributes, unless asked otherwise.
+            if (params or {}).get('briefRepresentation') == 'false':
+                return iter([role_data])
+            return iter([dict((key, value) for key, value in role_data.items() if key != 'attributes')])
+
+        self.keycloak_client.paginate.side_effect = paginate
+        get_role_catalog('test', self.keycloak_client)
+        self.action('Role').execute(self.keycloak_client)
+        self.keycloak_client.get.assert_not_called()
+        self.keycloak_client.put.assert_not_called()
+
+    @mock.patch('keycloak_config.actions.create_user.get_user_role_mappings', return_value={})
+    @mock.patch('keycloak_config.actions.create_user.process_user_role_mappings')
+    @mock.patch('keycloak_config.actions.create_user.get_user_by_email')
+    def test_failed_role_mapping_is_retried(self, get_user_by_email, process_user_role_mappings, get_user_role_mappings):
+        stored = {}
+
+        def store(path, json=None, **kwargs):
+            stored.update(json, id='user-id')
+            result = response(201 if path.endswith('/users') else 204)
+            result.headers = {'Location': 'http://keycloak/admin/realms/test/users/user-id'}
+            return result
+
+        get_user_by_email.side_effect = lambda realm_name, email, keycloak_client: dict(stored) if stored else None
+        self.keycloak_client.post.side_effect = store
+        self.keycloak_client.put.side_effect = store
+        process_user_role_mappings.side_effect = [ActionExecutionException('Role not found'), None, None]
+
+        def action():
+            return CreateUserAction('user', '/tmp', {'realmName': 'test', 'user': {'email': 'a@example.com'}, 'roles': ['admin']})
+
+        with self.assertRaises(ActionExecutionException):
+            action().execute(self.keycloak_client)
+
+        # The user was created, but its roles were not mapped, so the next run maps them again.
+        action().execute(self.keycloak_client)
+        self.assertEqual(2, process_user_role_mappings.call_count)
+
+        action().execute(self.keycloak_client)
+        self.assertEqual(2, process_user_role_mappings.call_count)
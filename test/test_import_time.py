@@ -0,0 +1,12 @@
+from benchmarks.import_time import eagerly_loaded
+from benchmarks.import_time import measure_import
+
+import unittest
+
+
+class ImportTimeTests(unittest.TestCase):
+
+    def test_heavy_modules_are_lazy(self):
+        elapsed_ms, loaded_modules = measure_import()
+        self.assertIn('keycloak_config.actions_engine', loaded_modules)
+        self.assertEqual([], eagerly_loaded(loaded_modules))
@@ -0,0 +1,78 @@
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.journal import RunJournal
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class RunJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @staticmethod
+    def create_role(name, description='Test role'):
+        return {'name': name, 'action': 'createRole', 'realmName': 'test', 'role': {'name': name, 'description': description}}
+
+    def record_run(self, engine, completed, finished=False):
+        journal = RunJournal(self.path)
+        journal.start()
+        for action_name in completed:
+            journal.record(action_name, engine.fingerprints[action_name])
+        if finished:
+            journal.finish()
+        journal.close()
+
+    def engine(self, actions_config_json):
+        engine = ActionsEngine('local', self.temp_dir, actions_config_json, mock.Mock(), journal=RunJournal(self.path), resume=True)
+        engine.fingerprints = dict((name, 'unused') for name, action_class, action_config_json in engine.pending_actions)
+        return engine
+
+    def test_unfinished_run_is_resumed(self):
+        actions_config_json = [self.create_role('role-1'), self.create_role('role-2'), self.create_role('role-3')]
+        previous = self.engine(actions_config_json)
+        previous.start_journal()
+        previous.journal.close()
+        self.record_run(previous, ['role-1', 'role-2'])
+
+        engine = self.engine(actions_config_json)
+        self.assertEqual(2, engine.start_journal())
+        engine.journal.close()
+
+    def test_changed_action_is_executed_again(self):
+        previous = self.engine([self.create_role('role-1'), self.create_role('role-2'), self.create_role('role-3')])
+        previous.start_journal()
+        previous.journal.close()
+        self.record_run(previous, ['role-1', 'role-2'])
+
+        engine = self.engine([self.create_role('role-1'), self.create_role('role-2', 'Changed'), self.create_role('role-3')])
+        self.assertEqual(1, engine.start_journal())
+        engine.journal.close()
+
+    def test_finished_run_is_not_resumed(self):
+        actions_config_json = [self.create_role('role-1'), self.create_role('role-2')]
+        previous = self.engine(actions_config_json)
+        previous.start_journal()
+        previous.journal.close()
+        self.record_run(previous, ['role-1', 'role-2'], finished=True)
+
+        engine = self.engine(actions_config_json)
+        self.assertEqual(0, engine.start_journal())
+        engine.journal.close()
+
+    def test_truncated_entry_is_ignored(self):
+        journal = RunJournal(self.path)
+        journal.start()
+        journal.record('role-1', 'abc')
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"event": "compl')
+
+        self.assertEqual([('role-1', 'abc')], RunJournal(self.path).completed_actions())
@@ -0,0 +1,170 @@
+from keycloak_config.deadline import deadline
+from keycloak_config.deadline import DeadlineExceededException
+from keycloak_config.keycloak_client import iterate_json_array
+from keycloak_config.keycloak_client import KeycloakClient
+from keycloak_config.keycloak_client import UnexpectedResponseException
+
+import json
+import mock
+import requests
+import threading
+import time
+import unittest
+
+
+class RunConcurrentlyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = KeycloakClient('http://localhost:8080/auth/', max_workers=4)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_results_keep_item_order(self):
+        results = self.client.run_concurrently(lambda item: item * 2, range(20))
+        self.assertEqual([item * 2 for item in range(20)], results)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        state = {'active': 0, 'max': 0}
+
+        def work(item):
+            with lock:
+                state['active'] += 1
+                state['max'] = max(state['max'], state['active'])
+            time.sleep(0.01)
+            with lock:
+                state['active'] -= 1
+
+        self.client.run_concurrently(work, range(12), max_concurrency=2)
+        self.assertEqual(2, state['max'])
+
+    def test_errors_are_raised(self):
+        def work(item):
+            if item == 3:
+                raise ValueError('failed')
+            return item
+
+        with self.assertRaises(ValueError):
+            self.client.run_concurrently(work, range(10))
+
+    def test_nested_calls_run_serially(self):
+        def work(item):
+            return sum(self.client.run_concurrently(lambda value: value, range(item)))
+
+        self.assertEqual([sum(range(item)) for item in range(8)], self.client.run_concurrently(work, range(8)))
+
+
+class PaginateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = KeycloakClient('http://localhost:8080/auth/', max_workers=4)
+        self.items = [{'id': index, 'name': 'itém-{0}'.format(index)} for index in range(25)]
+        self.client.get = mock.Mock(side_effect=self.get_page)
+
+    def tearDown(self):
+        self.client.close()
+
+    def get_page(self, path, params=None, **kwargs):
+        page = self.items[params['first']:params['first'] + params['max']]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = page
+        body = json.dumps(page, ensure_ascii=False).encode('utf-8')
+        # Chunks split within items and within multi-byte characters.
+        response.iter_content.return_value = [body[index:index + 7] for index in range(0, len(body), 7)]
+        return response
+
+    def test_pages_are_walked(self):
+        for prefetch in (0, 2):
+            for stream in (False, True):
+                self.assertEqual(self.items, list(self.client.paginate('/items', page_size=10, prefetch=prefetch, stream=stream)))
+
+    def test_walk_stops_after_short_page(self):
+        self.assertEqual(self.items, list(self.client.paginate('/items', {'q': 'x'}, page_size=5, stream=True)))
+        self.assertEqual(6, self.client.get.call_count)
+        self.assertEqual({'q': 'x', 'first': 25, 'max': 5}, self.client.get.call_args[0][1])
+
+    def test_unexpected_response(self):
+        self.client.get = mock.Mock(return_value=mock.Mock(status_code=403))
+        with self.assertRaises(UnexpectedResponseException) as context:
+            list(self.client.paginate('/items'))
+        self.assertEqual(403, context.exception.status_code)
+
+    def test_incremental_decoding(self):
+        text = json.dumps([1, 23.5, 'caf\u00e9 ,]', {'a': [1, 2]}, None, True, []])
+        chunks = [text[index:index + 3] for index in range(0, len(text), 3)]
+        self.assertEqual(json.loads(text), list(iterate_json_array(chunks)))
+
+        with self.assertRaises(ValueError):
+            list(iterate_json_array(['[1, 2']))
+
+
+class NodeBalancingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = KeycloakClient('http://node-1:8080/auth/, http://node-2:8080/auth', max_workers=4)
+        self.client.session_data = {'access_token': 'token'}
+        self.client.http = mock.Mock()
+        self.down = set()
+        self.client.http.request.side_effect = self.request
+        self.client.http.get.side_effect = lambda url, **kwargs: self.request('get', url)
+
+    def tearDown(self):
+        self.client.close()
+
+    def request(self, method, url, **kwargs):
+        node = url.split('/')[2]
+        if node in self.down:
+            raise requests.exceptions.ConnectionError('{0} is down'.format(node))
+        return mock.Mock(status_code=200, node=node)
+
+    def test_requests_are_spread_across_nodes(self):
+        nodes = [self.client.get('/admin/realms').node for i in range(4)]
+        self.assertEqual(['node-1:8080', 'node-2:8080'] * 2, nodes)
+
+    def test_failing_node_is_ejected_and_readmitted(self):
+        self.down.add('node-2:8080')
+        nodes = [self.client.get('/admin/realms').node for i in range(4)]
+        self.assertEqual(['node-1:8080'] * 4, nodes)
+        self.assertEqual([True, False], [healthy for *_, healthy in self.client.nodes.summary()])
+
+        # A failed health check keeps the node ejected, a successful one readmits it.
+        self.assertTrue(self.client.check_availability())
+        self.assertEqual([True, False], [healthy for *_, healthy in self.client.nodes.summary()])
+        self.down.clear()
+        self.client.check_availability()
+        self.assertEqual([True, True], [healthy for *_, healthy in self.client.nodes.summary()])
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        self.down.add('node-1:8080')
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.post('/admin/realms', json={})
+        self.assertEqual(1, self.client.http.request.call_count)
+
+
+class DeadlineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = KeycloakClient('http://localhost:8080/auth/', max_workers=4, connect_timeout=5, read_timeout=30)
+        self.client.session_data = {'access_token': 'token'}
+        self.client.http = mock.Mock()
+        self.client.http.request.side_effect = lambda method, url, **kwargs: time.sleep(0.02) or mock.Mock(status_code=200)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_requests_have_timeouts(self):
+        self.client.get('/admin/realms')
+        self.assertEqual((5, 30), self.client.http.request.call_args[1]['timeout'])
+
+        with deadline(2):
+            self.client.get('/admin/realms')
+        connect_timeout, read_timeout = self.client.http.request.call_args[1]['timeout']
+        self.assertLessEqual(read_timeout, 2)
+
+    def test_deadline_covers_concurrent_requests(self):
+        with self.assertRaises(DeadlineExceededException):
+            with deadline(0.1):
+                self.client.run_concurrently(lambda item: self.client.get('/admin/realms'), range(100), max_concurrency=2)
+        # The requests which had not started when the deadline passed were cancelled.
+        self.assertLess(self.client.http.request.call_count, 20)
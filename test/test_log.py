@@ -0,0 +1,44 @@
+from keycloak_config.log import BufferedStreamHandler
+from keycloak_config.log import JsonLinesFormatter
+from keycloak_config.log import TextFormatter
+
+import json
+import logging
+import mock
+import unittest
+
+
+class LogTests(unittest.TestCase):
+
+    def make_record(self, level, message, *args, **extra):
+        record = logging.LogRecord('keycloak_config.test', level, __file__, 1, message, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_text_format(self):
+        formatter = TextFormatter()
+        self.assertEqual('==== Client "a" created.', formatter.format(self.make_record(logging.INFO, 'Client "%s" created.', 'a')))
+        self.assertEqual('==== WARNING: Careful', formatter.format(self.make_record(logging.WARNING, 'Careful')))
+
+    def test_json_lines_format(self):
+        formatter = JsonLinesFormatter()
+        line = formatter.format(self.make_record(logging.INFO, 'Action "%s" completed.', 'x', action='x', elapsed=0.5))
+        entry = json.loads(line)
+        self.assertEqual('INFO', entry['level'])
+        self.assertEqual('Action "x" completed.', entry['message'])
+        self.assertEqual('x', entry['action'])
+        self.assertEqual(0.5, entry['elapsed'])
+        self.assertNotIn('\n', line)
+
+    def test_buffered_handler_flushes_on_warnings(self):
+        stream = mock.Mock()
+        handler = BufferedStreamHandler(stream, flush_interval=3600)
+        handler.setFormatter(TextFormatter())
+
+        handler.handle(self.make_record(logging.INFO, 'first'))
+        handler.handle(self.make_record(logging.DEBUG, 'second'))
+        stream.flush.assert_not_called()
+
+        handler.handle(self.make_record(logging.ERROR, 'third'))
+        stream.flush.assert_called_once_with()
+        self.assertEqual(3, stream.write.call_count)
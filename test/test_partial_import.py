@@ -0,0 +1,83 @@
+from keycloak_config.actions.action import FINGERPRINT_ATTRIBUTE
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.cache import KeycloakCache
+
+import mock
+import unittest
+
+
+def response(status_code, body=None):
+    return mock.Mock(status_code=status_code, json=mock.Mock(return_value=body), headers={})
+
+
+class CoalescingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keycloak_client = mock.Mock()
+        self.keycloak_client.cache = KeycloakCache()
+
+    @staticmethod
+    def engine(actions_config_json):
+        return ActionsEngine('local', '/tmp', actions_config_json, mock.Mock(), coalesce=True)
+
+    @staticmethod
+    def create_role(name, realm_name='test'):
+        return {'name': realm_name + '-' + name, 'action': 'createRole', 'realmName': realm_name, 'role': {'name': name}}
+
+    def test_existing_resources_are_executed_one_by_one(self):
+        self.keycloak_client.post.return_value = response(200, {'results': [
+            {'action': 'SKIPPED', 'resourceType': 'REALM_ROLE', 'resourceName': 'role-1'},
+            {'action': 'ADDED', 'resourceType': 'REALM_ROLE', 'resourceName': 'role-2'},
+            {'action': 'ADDED', 'resourceType': 'USER', 'resourceName': 'user@example.com'}
+        ]})
+        self.keycloak_client.get.return_value = response(200, {'id': '1', 'name': 'role-1'})
+        self.keycloak_client.put.return_value = response(204)
+
+        self.engine([
+            self.create_role('role-1'),
+            self.create_role('role-2'),
+            {'name': 'user', 'action': 'createUser', 'realmName': 'test', 'roles': ['role-2'], 'user': {'email': 'User@example.com'}}
+        ]).execute(self.keycloak_client)
+
+        self.keycloak_client.post.assert_called_once()
+        payload = self.keycloak_client.post.call_args[1]['json']
+        # Every representation carries the fingerprint of its configuration.
+        for representation in payload['roles']['realm'] + payload['users'] + [self.keycloak_client.put.call_args[1]['json']]:
+            self.assertIn(FINGERPRINT_ATTRIBUTE, representation.pop('attributes'))
+
+        self.assertEqual({
+            'ifResourceExists': 'SKIP',
+            'roles': {'realm': [{'name': 'role-1'}, {'name': 'role-2'}]},
+            'users': [{'email': 'User@example.com', 'username': 'User@example.com', 'realmRoles': ['role-2']}]
+        }, payload)
+        self.keycloak_client.put.assert_called_once_with('/admin/realms/test/roles/role-1', json={'name': 'role-1'})
+
+    def test_runs_are_split_by_realm(self):
+        self.keycloak_client.post.return_value = response(200, {'results': [
+            {'action': 'ADDED', 'resourceType': 'REALM_ROLE', 'resourceName': 'role-1'},
+            {'action': 'ADDED', 'resourceType': 'REALM_ROLE', 'resourceName': 'role-2'}
+        ]})
+
+        self.engine([
+            self.create_role('role-1'),
+            self.create_role('role-2'),
+            self.create_role('role-1', 'other'),
+            self.create_role('role-2', 'other')
+        ]).execute(self.keycloak_client)
+
+        self.assertEqual(
+                ['/admin/realms/test/partialImport', '/admin/realms/other/partialImport'],
+                [call[0][0] for call in self.keycloak_client.post.call_args_list]
+        )
+        self.keycloak_client.put.assert_not_called()
+
+    def test_failed_import_falls_back_to_actions(self):
+        self.keycloak_client.post.side_effect = [response(500), response(201), response(201)]
+        self.keycloak_client.get.return_value = response(404)
+
+        self.engine([self.create_role('role-1'), self.create_role('role-2')]).execute(self.keycloak_client)
+
+        self.assertEqual(
+                ['/admin/realms/test/partialImport', '/admin/realms/test/roles', '/admin/realms/test/roles'],
+                [call[0][0] for call in self.keycloak_client.post.call_args_list]
+        )
@@ -0,0 +1,67 @@
+from keycloak_config.actions.utils import InvalidRoleResponse
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.cache import KeycloakCache
+
+import mock
+import requests
+import threading
+import unittest
+
+
+class FakeRoleClient(object):
+    """
+    Serves the realm roles of a single realm, recording the modifying requests.
+    """
+
+    def __init__(self):
+        self.cache = KeycloakCache()
+        self.roles = {}
+        self.created = []
+        self.lock = threading.Lock()
+
+    def get(self, path, params=None):
+        role_name = path.rsplit('/', 1)[-1]
+        with self.lock:
+            role = self.roles.get(role_name)
+        return mock.Mock(status_code=requests.codes.ok if role else requests.codes.not_found, json=lambda: role)
+
+    def post(self, path, json=None):
+        with self.lock:
+            self.roles[json['name']] = dict(json, id=json['name'])
+            self.created.append(json['name'])
+        self.cache.invalidate_path(path)
+        return mock.Mock(status_code=requests.codes.created, headers={})
+
+    def put(self, path, json=None):
+        self.cache.invalidate_path(path)
+        return mock.Mock(status_code=requests.codes.no_content)
+
+
+class PrefetchTests(unittest.TestCase):
+
+    @staticmethod
+    def create_role(name):
+        return {'name': name, 'action': 'createRole', 'realmName': 'test', 'role': {'name': name}}
+
+    def test_actions_are_executed_in_order(self):
+        role_names = ['role-{0}'.format(i) for i in range(10)]
+        # role-5 is configured twice, and must only be created once despite the prefetched lookup which found nothing.
+        actions_config_json = [self.create_role(role_name) for role_name in role_names]
+        actions_config_json.append(dict(self.create_role('role-5'), name='role-5-again'))
+
+        client = FakeRoleClient()
+        engine = ActionsEngine('local', '.', actions_config_json, mock.Mock(), prefetch_depth=3)
+        engine.execute(client)
+
+        self.assertEqual(role_names, client.created)
+        self.assertEqual({}, engine.prefetched)
+
+    def test_prefetch_errors_are_left_to_the_action(self):
+        engine = ActionsEngine('local', '.', [self.create_role('role-1'), self.create_role('role-2')], mock.Mock(),
+                               prefetch_depth=1)
+        client = FakeRoleClient()
+        client.get = mock.Mock(return_value=mock.Mock(status_code=requests.codes.server_error))
+
+        with self.assertRaises(InvalidRoleResponse):
+            engine.execute(client)
+        self.assertEqual([], client.created)
@@ -0,0 +1,62 @@
+from keycloak_config.profiling import ActionProfiler
+from keycloak_config.profiling import CATEGORY_CUSTOM
+from keycloak_config.profiling import CATEGORY_KEYCLOAK
+from keycloak_config.profiling import CATEGORY_TOOL
+from keycloak_config.profiling import to_speedscope
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def leaf(n):
+    return sum(range(n))
+
+
+def branch():
+    return leaf(20000) + leaf(40000)
+
+
+class ActionProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.profiler = ActionProfiler(self.output_dir, custom_code_dir=os.path.dirname(__file__), top=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_profile_action(self):
+        action = self.profiler.construct('my action', lambda: [0] * 10000)
+        self.profiler.execute('my action', lambda: branch() + len(action))
+
+        profile = self.profiler.profiles[0]
+        self.assertGreater(profile.construct_peak_bytes, 0)
+        self.assertGreater(profile.execute_seconds, 0)
+        self.assertGreater(profile.categories[CATEGORY_CUSTOM], 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, '001-my_action.pstats')))
+        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, '001-my_action.speedscope.json')))
+
+        summary = self.profiler.write_summary()
+        self.assertIn('my action', summary)
+        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, 'summary.txt')))
+
+    def test_speedscope_stacks(self):
+        self.profiler.execute('stacks', branch)
+        stats = self.profiler.profiles[0].stats
+        document = to_speedscope(stats, 'stacks')
+
+        frames = document['shared']['frames']
+        profile = document['profiles'][0]
+        self.assertEqual(len(profile['samples']), len(profile['weights']))
+
+        stacks = [[frames[index]['name'] for index in sample] for sample in profile['samples']]
+        self.assertTrue(any(stack[-2:] == ['leaf', "<built-in method builtins.sum>"] for stack in stacks))
+        self.assertTrue(all(stack.index('leaf') > stack.index('branch') for stack in stacks if 'leaf' in stack))
+
+    def test_category(self):
+        tool_file = to_speedscope.__code__.co_filename
+        self.assertEqual(CATEGORY_TOOL, self.profiler.category((tool_file, 1, 'to_speedscope')))
+        self.assertEqual(CATEGORY_CUSTOM, self.profiler.category((__file__, 1, 'leaf')))
+        self.assertEqual(CATEGORY_KEYCLOAK, self.profiler.category(('~', 0, "<method 'recv_into' of '_socket.socket' objects>")))
@@ -0,0 +1,78 @@
+from keycloak_config.actions.action import InvalidActionConfigurationException
+from keycloak_config.actions_engine import ActionsEngine
+
+import mock
+import requests
+import unittest
+
+
+class PruneActionTests(unittest.TestCase):
+
+    SNAPSHOT = {
+        '/admin/realms/test/clients': [
+            {'id': 'c1', 'clientId': 'account'},
+            {'id': 'c2', 'clientId': 'managed-client', 'protocolMappers': [
+                {'id': 'm1', 'name': 'email'},
+                {'id': 'm2', 'name': 'stale-mapper'}
+            ]},
+            {'id': 'c3', 'clientId': 'stale-client'},
+            {'id': 'c4', 'clientId': 'kept-client'}
+        ],
+        '/admin/realms/test/roles': [
+            {'id': 'r1', 'name': 'offline_access'},
+            {'id': 'r2', 'name': 'default-roles-test'},
+            {'id': 'r3', 'name': 'managed-role'},
+            {'id': 'r4', 'name': 'stale-role'}
+        ],
+        '/admin/realms/test/users': [
+            {'id': 'u1', 'username': 'user@example.com', 'email': 'user@example.com'},
+            {'id': 'u2', 'username': 'service-account-managed-client'},
+            {'id': 'u3', 'username': 'stale-user'}
+        ]
+    }
+
+    def setUp(self):
+        self.keycloak_client = mock.Mock()
+        self.keycloak_client.paginate.side_effect = lambda path, params=None, **kwargs: iter(self.SNAPSHOT[path])
+        self.keycloak_client.run_concurrently.side_effect = lambda func, items, max_concurrency=None: [func(item) for item in items]
+        self.keycloak_client.delete.return_value = mock.Mock(status_code=requests.codes.no_content)
+
+    @staticmethod
+    def engine(**prune_config_json):
+        actions_config_json = [
+            {'name': 'client', 'action': 'createClient', 'realmName': 'test', 'roles': ['managed-role'], 'client': {
+                'clientId': 'managed-client', 'protocolMappers': [{'name': 'email'}]
+            }},
+            {'name': 'user', 'action': 'createUser', 'realmName': 'test', 'ignore': True, 'user': {'email': 'User@example.com'}},
+            # An action for another deployment environment, whose realm file does not exist here.
+            {'name': 'import', 'action': 'importRealm', 'ignore': True, 'realmFile': 'missing-realm.json'},
+            dict({'name': 'prune', 'action': 'prune', 'realmName': 'test', 'keepClients': ['kept-.*']}, **prune_config_json)
+        ]
+        return ActionsEngine('local', '.', actions_config_json, mock.Mock())
+
+    def deleted_paths(self):
+        return sorted(call[0][0] for call in self.keycloak_client.delete.call_args_list)
+
+    def test_unmanaged_resources_are_deleted(self):
+        engine = self.engine(users=True)
+        engine.execute_action(self.keycloak_client, *engine.pending_actions[-1])
+
+        self.assertEqual([
+            '/admin/realms/test/clients/c2/protocol-mappers/models/m2',
+            '/admin/realms/test/clients/c3',
+            '/admin/realms/test/roles-by-id/r4',
+            '/admin/realms/test/users/u3'
+        ], self.deleted_paths())
+
+    def test_plan_does_not_delete(self):
+        previews = dict((name, changes) for name, action_type, changes in self.engine(protocolMappers=False).plan(self.keycloak_client))
+
+        self.assertIsNone(previews['client'])
+        self.assertEqual(['delete client "stale-client" in realm "test"', 'delete role "stale-role" in realm "test"'], previews['prune'])
+        self.keycloak_client.delete.assert_not_called()
+        self.keycloak_client.post.assert_not_called()
+
+    def test_master_realm_is_refused(self):
+        engine = self.engine(realmName='master')
+        with self.assertRaises(InvalidActionConfigurationException):
+            engine.build_action(*engine.pending_actions[-1])
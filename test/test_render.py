@@ -0,0 +1,138 @@
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.deploy_config import ConfigTemplate
+from keycloak_config.deploy_config import expand_foreach
+from keycloak_config.deploy_config import InvalidConfigurationException
+from keycloak_config.fingerprint import fingerprint
+from keycloak_config.render import render_env
+from keycloak_config.render import render_envs
+
+import copy
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+DEPLOY_CONFIG_DIR = os.path.join(os.path.dirname(__file__), 'data', 'deploy')
+
+
+class ConfigTemplateTests(unittest.TestCase):
+
+    def test_render(self):
+        template = ConfigTemplate('{"a": "#{A}",\n "b": "#{ B }-#{A}"}')
+        self.assertEqual('{"a": "1",\n "b": "2-1"}', template.render({'A': '1', 'B': '2'}, environ={}))
+        self.assertEqual('{"a": "3",\n "b": "2-3"}', template.render({'A': '1', 'B': '2'}, environ={'A': '3'}))
+
+    def test_unknown_variables(self):
+        template = ConfigTemplate('"#{A}"\n"#{B}"\n"#{C}"\n"#{B}"')
+        with self.assertRaisesRegex(InvalidConfigurationException, 'Unknown variable: B, C'):
+            template.render({'A': '1'}, environ={})
+        self.assertEqual({'A': [1], 'B': [2, 4], 'C': [3]}, template.referenced_variables())
+
+    def test_foreach_parameters_are_kept(self):
+        template = ConfigTemplate('{"a": "#{A}-#{each.b}",\n "c": "#{ each.c }"}')
+        self.assertEqual('{"a": "1-#{each.b}",\n "c": "#{ each.c }"}', template.render({'A': '1'}, environ={}))
+        self.assertEqual({'A': [1]}, template.referenced_variables())
+
+    def test_empty_variable(self):
+        with self.assertRaisesRegex(InvalidConfigurationException, 'line 2'):
+            ConfigTemplate('{\n"a": "#{ }"}')
+
+
+class RenderTests(unittest.TestCase):
+
+    def test_render_all_envs(self):
+        results = render_envs(DEPLOY_CONFIG_DIR)
+        self.assertEqual(['integration', 'local'], [result.deploy_env for result in results])
+        self.assertTrue(all(result.valid for result in results))
+        self.assertIn('OVERRIDDEN_DXLOCAL', results[1].processed_config)
+
+    def test_render_envs_in_parallel(self):
+        sequential = render_envs(DEPLOY_CONFIG_DIR, jobs=1)
+        parallel = render_envs(DEPLOY_CONFIG_DIR, jobs=2)
+        self.assertEqual([result.processed_config for result in sequential], [result.processed_config for result in parallel])
+        self.assertEqual([result.action_count for result in sequential], [result.action_count for result in parallel])
+
+    def test_render_env_errors(self):
+        template = ConfigTemplate('[{"name": "a", "action": "#{ACTION}"}]')
+        result = render_env(template, {}, 'test', {}, DEPLOY_CONFIG_DIR, environ={})
+        self.assertEqual({'ACTION': [1]}, result.unknown_variables)
+        self.assertFalse(result.valid)
+
+        result = render_env(template, {}, 'test', {'ACTION': 'unknown'}, DEPLOY_CONFIG_DIR, environ={})
+        self.assertEqual(['Invalid action configuration: Unknown action: "a"'], result.errors)
+
+    def test_render_env_action_errors(self):
+        template = ConfigTemplate(json.dumps([
+            {'name': 'a', 'action': 'createRole', 'role': {'name': 'admin'}},
+            {'name': 'b', 'action': 'createRole', 'realmName': 'test', 'role': {'name': 'admin'}}
+        ]))
+        result = render_env(template, {}, 'test', {}, DEPLOY_CONFIG_DIR, environ={})
+        self.assertEqual(['Invalid action configuration: Configuration "a" missing property "realmName"'], result.errors)
+
+        template = ConfigTemplate(json.dumps([{'name': 'a', 'action': 'createUser', 'realmName': 'test', 'user': 'a'}]))
+        result = render_env(template, {}, 'test', {}, DEPLOY_CONFIG_DIR, environ={})
+        self.assertEqual(1, len(result.errors))
+        self.assertIn('Configuration "a" has a missing or invalid property', result.errors[0])
+
+
+class ForeachTests(unittest.TestCase):
+
+    TEMPLATE = {
+        'name': 'role-#{each.tenant}',
+        'action': 'createRole',
+        'realmName': '#{each.tenant}',
+        'ignore': '#{each.skip}',
+        'role': {'name': 'admin', 'description': 'Admin of #{each.tenant} (#{PREFIX})'}
+    }
+
+    def setUp(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.config_dir.cleanup()
+
+    def write(self, file_name, content):
+        with open(os.path.join(self.config_dir.name, file_name), 'w') as f:
+            f.write(content)
+
+    def expand(self, entry):
+        return expand_foreach([entry], self.config_dir.name, {'PREFIX': 'p'}, environ={})
+
+    def test_rows_files(self):
+        self.write('tenants.csv', 'tenant,skip\na,\nb,yes\nc,false\nd,true\n')
+        self.write('tenants.jsonl', '{"tenant": "a", "skip": false}\n\n{"tenant": "#{PREFIX}-b", "skip": true}\n')
+
+        csv_actions = self.expand({'foreachFile': 'tenants.csv', 'template': self.TEMPLATE})
+        jsonl_actions = self.expand({'foreachFile': 'tenants.jsonl', 'template': self.TEMPLATE})
+
+        self.assertEqual(['role-a', 'role-b', 'role-c', 'role-d'], [action['name'] for action in csv_actions])
+        self.assertEqual(['', 'yes', False, True], [action['ignore'] for action in csv_actions])
+        self.assertEqual(['role-a', 'role-p-b'], [action['name'] for action in jsonl_actions])
+        self.assertEqual([False, True], [action['ignore'] for action in jsonl_actions])
+        self.assertEqual({'name': 'admin', 'description': 'Admin of a (#{PREFIX})'}, jsonl_actions[0]['role'])
+
+    def test_actions_are_expanded_on_access(self):
+        template = json.loads(json.dumps(self.TEMPLATE))
+        actions = self.expand({'foreach': [{'tenant': 'a', 'skip': False}, {'tenant': 'b', 'skip': False}], 'template': template})
+
+        actions[0]['role']['name'] = 'modified'
+        self.assertEqual('admin', actions[0]['role']['name'])
+        self.assertEqual(self.TEMPLATE, template)
+        self.assertEqual(fingerprint(dict(actions[1])), fingerprint(copy.deepcopy(actions[1])))
+
+        engine = ActionsEngine('local', self.config_dir.name, actions, mock.Mock())
+        self.assertEqual(['role-a', 'role-b'], [name for name, action_class, action_config_json in engine.pending_actions])
+
+    def test_parameter_values_are_copied(self):
+        template = dict(self.TEMPLATE, role='#{each.role}')
+        rows = [{'tenant': 'a', 'skip': False, 'role': {'name': 'admin', 'attributes': {'level': ['1']}}}]
+        actions = self.expand({'foreach': rows, 'template': template})
+
+        actions[0]['role']['attributes']['level'].append('2')
+        self.assertEqual({'name': 'admin', 'attributes': {'level': ['1']}}, actions[0]['role'])
+        self.assertEqual(['1'], rows[0]['role']['attributes']['level'])
+
+    def test_missing_parameter(self):
+        with self.assertRaisesRegex(InvalidConfigurationException, 'row 1 missing parameter: skip'):
+            self.expand({'foreach': [{'tenant': 'a', 'skip': False}, {'tenant': 'b'}], 'template': self.TEMPLATE})
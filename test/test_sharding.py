@@ -0,0 +1,85 @@
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.results import build_results
+from keycloak_config.results import main
+from keycloak_config.results import merge_results
+
+import click.testing
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+
+class ShardingTests(unittest.TestCase):
+
+    ACTIONS_CONFIG_JSON = [
+        {'name': 'role-{0}-{1}'.format(realm_index, index), 'action': 'createRole', 'realmName': 'realm-{0}'.format(realm_index),
+         'role': {'name': 'role-{0}'.format(index)}}
+        for realm_index in range(6) for index in range(3)
+    ] + [
+        {'name': 'custom', 'action': 'custom', 'file': 'custom.py', 'shardKey': 'realm-0'}
+    ]
+
+    def engine(self, shard):
+        return ActionsEngine('local', '.', self.ACTIONS_CONFIG_JSON, mock.Mock(), shard=shard)
+
+    def test_keyless_actions_are_reported(self):
+        actions_config_json = self.ACTIONS_CONFIG_JSON + [{'name': 'keyless', 'action': 'custom', 'file': 'custom.py'}]
+        with self.assertLogs('keycloak_config.actions_engine', 'INFO') as logs:
+            ActionsEngine('local', '.', actions_config_json, mock.Mock(), shard=(2, 3))
+        self.assertEqual(['1 action(s) without a realm or shard key assigned to shard 1: keyless'],
+                         [record.getMessage() for record in logs.records])
+
+    def test_shards_partition_the_actions_by_realm(self):
+        shards = [[name for name, action_class, action_config_json in self.engine((number, 3)).pending_actions]
+                  for number in range(1, 4)]
+
+        all_names = [name for shard in shards for name in shard]
+        self.assertEqual(sorted(action['name'] for action in self.ACTIONS_CONFIG_JSON), sorted(all_names))
+        for realm_index in range(6):
+            self.assertEqual(1, sum(1 for shard in shards if 'role-{0}-0'.format(realm_index) in shard))
+            shard = next(shard for shard in shards if 'role-{0}-0'.format(realm_index) in shard)
+            self.assertIn('role-{0}-2'.format(realm_index), shard)
+        self.assertTrue(any('custom' in shard and 'role-0-1' in shard for shard in shards))
+
+    def test_merged_results(self):
+        results_list = []
+        for number in (1, 3):
+            engine = self.engine((number, 3))
+            for action_name, action_class, action_config_json in engine.pending_actions:
+                engine.record_completion(action_name, 0.5)
+            results_list.append(build_results(engine, 1.0))
+
+        engine = self.engine((3, 3))
+        failed_name = engine.pending_actions[0][0]
+        engine.action_results[failed_name] = ('failed', 0.1, 'Unexpected response')
+        results_list[1] = build_results(engine, 2.0, 'Unexpected response')
+
+        merged = merge_results(results_list)
+        self.assertFalse(merged['success'])
+        self.assertEqual(2.0, merged['elapsed'])
+        self.assertEqual(['3/3: Unexpected response', 'Missing shard(s): 2/3'], merged['errors'])
+        self.assertEqual({'completed': len(merged['actions']) - len(engine.pending_actions), 'failed': 1,
+                          'pending': len(engine.pending_actions) - 1},
+                         dict((status, sum(1 for action in merged['actions'] if action['status'] == status))
+                              for status in ('completed', 'failed', 'pending')))
+
+    def test_batch_results_summary(self):
+        engine = self.engine(None)
+        engine.action_results[engine.pending_actions[0][0]] = ('failed', 0.1, 'Unexpected response')
+        batch_results = [
+            dict(build_results(self.engine(None), 1.0), deployConfigDir='team-a'),
+            dict(build_results(engine, 2.0, 'Unexpected response'), deployConfigDir='team-b')
+        ]
+
+        with tempfile.TemporaryDirectory() as results_dir:
+            path = os.path.join(results_dir, 'batch-results.json')
+            with open(path, 'w') as f:
+                json.dump(batch_results, f)
+            result = click.testing.CliRunner().invoke(main, [path])
+
+        self.assertEqual(1, result.exit_code)
+        self.assertIn('FAILURE: {0} action(s)'.format(2 * len(engine.pending_actions)), result.output)
+        self.assertIn('team-b: Unexpected response', result.output)
+        self.assertIn('failed of team-b: Unexpected response', result.output)
@@ -0,0 +1,56 @@
+from keycloak_config.actions.action import InvalidActionConfigurationException
+from keycloak_config.actions.create_role import CreateRoleAction
+from keycloak_config.cache import KeycloakCache
+from keycloak_config.upsert import AUTO_MIN_SAMPLES
+from keycloak_config.upsert import UpsertStats
+
+import mock
+import requests
+import unittest
+
+
+class UpsertStrategyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keycloak_client = mock.Mock()
+        self.keycloak_client.cache = KeycloakCache()
+        self.keycloak_client.get.return_value = mock.Mock(status_code=requests.codes.ok, json=lambda: {'id': '1', 'name': 'test-role'})
+        self.keycloak_client.put.return_value = mock.Mock(status_code=requests.codes.no_content)
+
+    @staticmethod
+    def action(upsert_strategy=None, **kwargs):
+        action_config_json = {'realmName': 'test', 'role': {'name': 'test-role'}}
+        if upsert_strategy:
+            action_config_json['upsertStrategy'] = upsert_strategy
+        return CreateRoleAction('test', '.', action_config_json, **kwargs)
+
+    def test_create_first_skips_the_lookup(self):
+        self.keycloak_client.post.return_value = mock.Mock(status_code=requests.codes.created)
+        self.action('create-first').execute(self.keycloak_client)
+        self.keycloak_client.get.assert_not_called()
+
+    def test_create_first_updates_on_conflict(self):
+        self.keycloak_client.post.return_value = mock.Mock(status_code=requests.codes.conflict)
+        self.action('create-first').execute(self.keycloak_client)
+        self.keycloak_client.get.assert_called_once_with('/admin/realms/test/roles/test-role')
+        self.keycloak_client.put.assert_called_once()
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(InvalidActionConfigurationException):
+            self.action('create-later')
+
+    def test_auto_strategy_follows_hit_rate(self):
+        upsert_stats = UpsertStats()
+        action = self.action('auto', upsert_stats=upsert_stats)
+        for i in range(AUTO_MIN_SAMPLES - 1):
+            upsert_stats.record('test', False)
+        self.assertFalse(action.creates_first('test'))
+
+        upsert_stats.record('test', False)
+        self.assertTrue(action.creates_first('test'))
+        self.assertFalse(action.creates_first('other'))
+
+        for i in range(AUTO_MIN_SAMPLES):
+            upsert_stats.record('test', True)
+        self.assertFalse(action.creates_first('test'))
+        self.assertEqual(0.5, upsert_stats.hit_rate('test'))
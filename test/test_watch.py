@@ -0,0 +1,120 @@
+from keycloak_config.actions_engine import ActionsEngine
+from keycloak_config.actions_engine import shard_of
+from keycloak_config.encryption import EncryptionHelper
+from keycloak_config.json import JsonLoader
+from keycloak_config.watch import ConfigWatcher
+
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+
+class StopWatching(Exception):
+    pass
+
+
+class ConfigWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.config_dir.name, 'src'))
+        os.makedirs(os.path.join(self.config_dir.name, 'var', 'keycloak'))
+        self.config_file = os.path.join(self.config_dir.name, 'src', 'keycloak.json')
+        with open(os.path.join(self.config_dir.name, 'var', 'keycloak', 'defaults.var'), 'w') as f:
+            f.write('DESCRIPTION=Reader\n')
+        self.write_config('#{DESCRIPTION}')
+
+        self.client = mock.Mock()
+        self.client.check_availability.return_value = True
+        self.watcher = ConfigWatcher(
+                self.config_dir.name, 'local', JsonLoader(EncryptionHelper(None, None)), self.client, 10, poll_interval=0
+        )
+
+        self.executed = []
+        self.engines = []
+        patcher = mock.patch.object(ActionsEngine, 'execute_action', autospec=True, side_effect=self.execute_action)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.config_dir.cleanup()
+
+    def execute_action(self, engine, keycloak_client, action_name, *args):
+        self.executed.append(action_name)
+        self.engines.append(engine)
+
+    def write_config(self, reader_description):
+        with open(self.config_file, 'w') as f:
+            json.dump([
+                {'name': 'createAdmin', 'action': 'createRole', 'realmName': 'test', 'role': {'name': 'admin'}},
+                {'name': 'createReader', 'action': 'createRole', 'realmName': 'test',
+                 'role': {'name': 'reader', 'description': reader_description}}
+            ], f)
+
+    def test_only_changed_actions_are_executed(self):
+        # The configuration is edited after the first synchronization, then left unchanged.
+        sleeps = [lambda: self.write_config('Reader of all resources'), lambda: None, StopWatching]
+        with mock.patch('keycloak_config.watch.time.sleep', side_effect=lambda interval: self.next_sleep(sleeps)):
+            with self.assertRaises(StopWatching):
+                self.watcher.run()
+
+        self.assertEqual(['createAdmin', 'createReader', 'createReader'], self.executed)
+        self.client.cache.clear.assert_called_once_with()
+
+    @staticmethod
+    def next_sleep(sleeps):
+        sleep = sleeps.pop(0)
+        if sleep is StopWatching:
+            raise StopWatching()
+        sleep()
+
+    def test_periodic_resync(self):
+        self.watcher.resync_interval = 0
+        with mock.patch('keycloak_config.watch.time.sleep', side_effect=[None, StopWatching()]):
+            with self.assertRaises(StopWatching):
+                self.watcher.run()
+
+        self.assertEqual(['createAdmin', 'createReader'] * 2, self.executed)
+        self.assertEqual(2, self.client.cache.clear.call_count)
+
+    def test_reconnect_after_restart(self):
+        self.assertTrue(self.watcher.synchronize([], True))
+        self.client.check_availability.return_value = False
+
+        self.client.reconnect.return_value = False
+        self.assertFalse(self.watcher.synchronize([], False))
+        self.assertEqual(['createAdmin', 'createReader'], self.executed)
+
+        # Keycloak may have come back with a different state, so all actions are executed again.
+        self.client.reconnect.return_value = True
+        self.assertTrue(self.watcher.synchronize([], False))
+        self.assertEqual(['createAdmin', 'createReader'] * 2, self.executed)
+        self.client.reconnect.assert_called_with(10)
+
+    def test_engine_options(self):
+        self.watcher.engine_kwargs = {'action_timeout': 30, 'slow_action_threshold': 5}
+        self.assertTrue(self.watcher.synchronize([], True))
+        self.assertEqual([(30, 5)] * 2, [(engine.action_timeout, engine.slow_action_threshold) for engine in self.engines])
+
+    def test_ignore_fingerprints(self):
+        self.assertTrue(self.watcher.synchronize([], True))
+        self.write_config('Reader of all resources')
+        self.assertTrue(self.watcher.synchronize([self.config_file], False))
+        self.assertEqual([True, True, False], [engine.action_kwargs['ignore_fingerprints'] for engine in self.engines])
+
+        self.watcher.engine_kwargs = {'ignore_fingerprints': True}
+        self.write_config('Reader')
+        self.assertTrue(self.watcher.synchronize([self.config_file], False))
+        self.assertTrue(self.engines[-1].action_kwargs['ignore_fingerprints'])
+
+    def test_shard(self):
+        other_shard = 3 - shard_of('test', 2)
+        self.watcher.engine_kwargs = {'shard': (other_shard, 2)}
+        self.assertTrue(self.watcher.synchronize([], True))
+        self.assertEqual([], self.executed)
+
+        self.watcher.engine_kwargs = {'shard': (3 - other_shard, 2)}
+        self.assertTrue(self.watcher.synchronize([], True))
+        self.assertEqual(['createAdmin', 'createReader'], self.executed)